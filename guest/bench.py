@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+from datetime import datetime, timezone
+import hotplug
+import cps
+import irq
+
+# Measures the guest's side of the control plane: per-cpu hotplug as resize_cpus_ufo does it, CPS confining tasks by
+# sched_setaffinity or cgroup cpusets, and irq rebalancing, for varying cpu, task and irq counts. By default every
+# measurement runs against fake sysfs, /proc and cgroup trees in a temporary directory; affinity is still set for real,
+# on threads this script starts itself. With --real the guest's own /sys, /proc and cgroup trees are used instead: cpus
+# are really hotplugged and every task's affinity really changes, so run it as root on a guest that is otherwise idle.
+# Results use the format of host/bench.py, whose compare subcommand reports regressions between two runs.
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+# summarizes samples, given in ms, as one result
+def summarize(name, backend, params, samples_ms):
+    result = {
+        "name": name,
+        "backend": backend,
+        "params": params,
+        "samples": len(samples_ms),
+        "mean_ms": sum(samples_ms) / len(samples_ms),
+        "p50_ms": percentile(samples_ms, 50),
+        "p95_ms": percentile(samples_ms, 95),
+        "p99_ms": percentile(samples_ms, 99),
+        "max_ms": max(samples_ms),
+    }
+    print(f"{name:<22} {backend:<6} {json.dumps(params, sort_keys=True):<26} p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  p99 {result['p99_ms']:9.3f} ms")
+    return result
+
+def make_fake_cpu_dir(root, n_cpus):
+    for cpu in range(n_cpus):
+        os.makedirs(os.path.join(root, f"cpu{cpu}"), exist_ok=True)
+        # cpu0 has no online file, as on most guests
+        if cpu > 0:
+            with open(os.path.join(root, f"cpu{cpu}", "online"), "w") as f:
+                f.write("1")
+    return root
+
+# a /proc that lists n_threads threads of this process, each blocked until stop is set
+def make_fake_proc_dir(root, n_threads, stop):
+    started = threading.Barrier(n_threads + 1)
+    tids = []
+    def idle():
+        tids.append(threading.get_native_id())
+        started.wait()
+        stop.wait()
+    for i in range(n_threads):
+        threading.Thread(target=idle, daemon=True).start()
+    started.wait()
+    task_dir = os.path.join(root, str(os.getpid()), "task")
+    os.makedirs(task_dir, exist_ok=True)
+    for tid in tids:
+        os.makedirs(os.path.join(task_dir, str(tid)), exist_ok=True)
+    return root
+
+def make_fake_cgroup_root(root, n_groups):
+    os.makedirs(root, exist_ok=True)
+    open(os.path.join(root, "cgroup.subtree_control"), "w").close()
+    for group in range(n_groups):
+        os.makedirs(os.path.join(root, f"group{group}"), exist_ok=True)
+        open(os.path.join(root, f"group{group}", "cpuset.cpus"), "w").close()
+    return root
+
+def make_fake_irq_dir(root, n_irqs):
+    for irq_id in range(n_irqs):
+        os.makedirs(os.path.join(root, str(irq_id)), exist_ok=True)
+        with open(os.path.join(root, str(irq_id), "smp_affinity_list"), "w") as f:
+            f.write("0")
+    return root
+
+# shrinks to half the cpus and grows back, iterations times. reports every cpu's online and offline write and each
+# whole resize
+def bench_hotplug(cpu_dir, n_cpus, iterations, backend):
+    online_ms = []
+    offline_ms = []
+    resize_ms = []
+    online = list(range(n_cpus))
+    for i in range(iterations):
+        for required in (max(n_cpus // 2, 1), n_cpus):
+            start = time.perf_counter()
+            online, breakdown = hotplug.resize(required, n_cpus, online, cpu_dir)
+            resize_ms.append((time.perf_counter() - start) * 1000)
+            online_ms.extend(breakdown["online_ms"].values())
+            offline_ms.extend(breakdown["offline_ms"].values())
+    params = {"cpus": n_cpus}
+    return [
+        summarize("hotplug_online_cpu", backend, params, online_ms),
+        summarize("hotplug_offline_cpu", backend, params, offline_ms),
+        summarize("hotplug_resize", backend, params, resize_ms),
+    ]
+
+# alternates the tasks between all allowed cpus and half of them
+def bench_cps_affinity(proc_dir, iterations, params, backend):
+    allowed = sorted(os.sched_getaffinity(0))
+    cpu_sets = [allowed[:max(len(allowed) // 2, 1)], allowed]
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        cps.apply_task_affinity(cpu_sets[i % 2], proc_dir)
+        samples.append((time.perf_counter() - start) * 1000)
+    return [summarize("cps_task_affinity", backend, params, samples)]
+
+def bench_cps_cgroup(cgroup_root, n_cpus, iterations, params, backend):
+    cpu_sets = [list(range(max(n_cpus // 2, 1))), list(range(n_cpus))]
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        cps.apply_cgroup_cpuset(cpu_sets[i % 2], cgroup_root)
+        samples.append((time.perf_counter() - start) * 1000)
+    return [summarize("cps_cgroup_cpuset", backend, params, samples)]
+
+# rebalances irqs with random rates over alternating cpu sets, so that every round moves some irqs
+def bench_irq(proc_irq_dir, irq_ids, n_cpus, iterations, backend):
+    rng = random.Random(len(irq_ids))
+    cpu_sets = [list(range(max(n_cpus // 2, 1))), list(range(n_cpus))]
+    samples = []
+    for i in range(iterations):
+        rates = {str(irq_id): {0: rng.choice([0.0, rng.uniform(1, 50000)])} for irq_id in irq_ids}
+        start = time.perf_counter()
+        irq.balance_irqs(cpu_sets[i % 2], rates, proc_irq_dir)
+        samples.append((time.perf_counter() - start) * 1000)
+    return [summarize("irq_rebalance", backend, {"irqs": len(irq_ids), "cpus": n_cpus}, samples)]
+
+def run_fake(args):
+    results = []
+    stop = threading.Event()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_cpus in args.cpus:
+            cpu_dir = make_fake_cpu_dir(os.path.join(tmp_dir, f"cpu_{n_cpus}"), n_cpus)
+            results += bench_hotplug(cpu_dir, n_cpus, args.iterations, "fake")
+        for n_threads in args.tasks:
+            proc_dir = make_fake_proc_dir(os.path.join(tmp_dir, f"proc_{n_threads}"), n_threads, stop)
+            results += bench_cps_affinity(proc_dir, args.iterations, {"tasks": n_threads}, "fake")
+        for n_groups in args.groups:
+            cgroup_root = make_fake_cgroup_root(os.path.join(tmp_dir, f"cgroup_{n_groups}"), n_groups)
+            results += bench_cps_cgroup(cgroup_root, max(args.cpus), args.iterations, {"groups": n_groups}, "fake")
+        for n_irqs in args.irqs:
+            for n_cpus in args.cpus:
+                irq_dir = make_fake_irq_dir(os.path.join(tmp_dir, f"irq_{n_irqs}_{n_cpus}"), n_irqs)
+                results += bench_irq(irq_dir, list(range(n_irqs)), n_cpus, args.iterations, "fake")
+    stop.set()
+    return results
+
+# the same measurements on this guest's own trees. afterwards every cpu is online and tasks may run anywhere again
+def run_real(args):
+    results = []
+    n_cpus = cps.CPU_COUNT
+    results += bench_hotplug(hotplug.SYSFS_CPU_DIR, n_cpus, args.real_iterations, "real")
+    results += bench_cps_affinity(cps.PROC_DIR, args.real_iterations, {"tasks": len(cps.list_tasks())}, "real")
+    cps.apply_task_affinity(list(range(n_cpus)))
+    irq_ids = [irq_id for irq_id in os.listdir(irq.PROC_IRQ_DIR) if irq_id.isdigit()]
+    results += bench_irq(irq.PROC_IRQ_DIR, irq_ids, n_cpus, args.real_iterations, "real")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="bench", description="benchmarks the guest's side of the control plane")
+    parser.add_argument("--output", default="bench_guest.json", help="where to write the results")
+    parser.add_argument("--iterations", type=int, default=100, help="samples per fake benchmark")
+    parser.add_argument("--real-iterations", type=int, default=10, help="samples per --real benchmark")
+    parser.add_argument("--cpus", type=int, nargs="+", default=[8, 64])
+    parser.add_argument("--tasks", type=int, nargs="+", default=[16, 256])
+    parser.add_argument("--groups", type=int, nargs="+", default=[8, 64])
+    parser.add_argument("--irqs", type=int, nargs="+", default=[32, 256])
+    parser.add_argument("--real", action="store_true", help="also hotplug this guest's cpus and move its tasks and irqs")
+    args = parser.parse_args()
+
+    results = run_fake(args)
+    if args.real:
+        results += run_real(args)
+    report = {
+        "suite": "guest",
+        "created": datetime.now(timezone.utc).isoformat(),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "kernel": platform.release(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {len(results)} results to {args.output}")
@@ -1,36 +1,97 @@
 import os
-import psutil
 import datetime
-import subprocess
+import threading
+import utils
+import cpuload
+import irq
+import protocol
 
+CPU_COUNT = utils.get_cpu_count()
+PROC_DIR = "/proc"
+CGROUP_ROOT = "/sys/fs/cgroup"
+AFFINITY_MODES = ["affinity", "cgroup"]
 
-def balance_all_irq_affinity(cpu_list):
-    # Build affinity mask for the given list of CPU
-    affinity_mask = 0
-    for cpu in cpu_list:
-        affinity_mask |= (1 << cpu)
-    print("New IRQ affinity_mask: ", affinity_mask)
+# How CPS confines the guest to a cpu subset:
+#   affinity: os.sched_setaffinity on every thread under /proc/<pid>/task
+#   cgroup:   write cpuset.cpus of every top-level cgroup v2 group, so the kernel moves all their tasks. the root group
+#             has no cpuset.cpus, so the threads in it are moved with os.sched_setaffinity as in affinity mode
+affinity_mode = "affinity"
+allowed_cpus = utils.online_cpu_list() # cpus the guest's tasks may currently run on
+resize_lock = threading.Lock() # resizes run in their own threads and must not interleave
 
-    if not len(IRQ_LIST) or not len(cpu_list) or not affinity_mask :
-        print("Did not modfy IRQ, IRQ_LIST len : ", len(IRQ_LIST), " CPU_LIST len : ", len(cpu_list))
-        return
-        
-    # Set new mask for IRQ
-    for irq in IRQ_LIST :
-        os.system(f"echo {affinity_mask} | sudo tee /proc/irq/{irq}/smp_affinity > /dev/null")
 
-def resize_cpus_cps(required_cpu_count):
+# ids of every thread of every process in the guest
+def list_tasks(proc_dir=PROC_DIR):
+    tids = []
+    for pid in os.listdir(proc_dir):
+        if not pid.isdigit():
+            continue
+        try:
+            tids.extend(int(tid) for tid in os.listdir(os.path.join(proc_dir, pid, "task")))
+        except OSError:
+            # the process exited while we were listing
+            continue
+    return tids
+
+# returns (tasks updated, tasks that could not be updated). per-cpu kernel threads and exited tasks are expected
+# to fail. each call is a short syscall, so the tasks are updated one after the other
+def set_tasks_affinity(tids, cpus):
+    updated = 0
+    failed = 0
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+            updated += 1
+        except OSError:
+            failed += 1
+    return updated, failed
+
+def apply_task_affinity(cpus, proc_dir=PROC_DIR):
+    tids = list_tasks(proc_dir)
+    updated, failed = set_tasks_affinity(tids, cpus)
+    print(f"set affinity for {updated} tasks, {failed} tasks could not be moved")
+    return { "tasks": updated, "failed": failed, "writes": len(tids) }
+
+# ids of the threads in the root cgroup itself, which no cpuset.cpus confines
+def list_root_cgroup_tasks(cgroup_root=CGROUP_ROOT):
+    try:
+        with open(os.path.join(cgroup_root, "cgroup.threads")) as f:
+            return [int(tid) for tid in f.read().split()]
+    except OSError:
+        return []
+
+# confines every top-level cgroup to cpus and the root cgroup's own threads with their affinity. the cpuset controller
+# is enabled for the root's children first
+def apply_cgroup_cpuset(cpus, cgroup_root=CGROUP_ROOT):
+    cpu_list = ",".join(str(cpu) for cpu in sorted(cpus))
+    with open(os.path.join(cgroup_root, "cgroup.subtree_control"), "w") as f:
+        f.write("+cpuset")
+    writes = 1
+    for entry in os.listdir(cgroup_root):
+        cpuset_file = os.path.join(cgroup_root, entry, "cpuset.cpus")
+        if os.path.isfile(cpuset_file):
+            with open(cpuset_file, "w") as f:
+                f.write(cpu_list)
+            writes += 1
+    root_tids = list_root_cgroup_tasks(cgroup_root)
+    updated, failed = set_tasks_affinity(root_tids, cpus)
+    print(f"set cpuset.cpus to {cpu_list} with {writes} writes, set affinity for {updated} root cgroup tasks, {failed} tasks could not be moved")
+    return { "writes": writes, "tasks": updated, "failed": failed }
+
+def resize_cpus_cps(required_cpu_count, mode=None):
+    global allowed_cpus
+    mode = mode or affinity_mode
     if required_cpu_count < 1 or required_cpu_count > CPU_COUNT:
         print("required cpu count is out of range")
         return
 
-    current_cpu_list = online_cpu_list()
+    current_cpu_list = allowed_cpus
     current_cpu_count = len(current_cpu_list)
-    print("online cpu list (before change)", current_cpu_list)
+    print("allowed cpu list (before change)", current_cpu_list)
 
     # delta is number of cpu cores you want to add
     delta = required_cpu_count - current_cpu_count
- 
+
     start = datetime.datetime.now()
     resized_cpu_list = current_cpu_list.copy()
     if delta < 0:
@@ -43,18 +104,40 @@ def resize_cpus_cps(required_cpu_count):
                 resized_cpu_list.append(i)
                 delta-=1
 
-    for p in psutil.process_iter(["pid"]):
-        try:
-            subprocess.run(["taskset", "-pc" , ','.join(map(str, resized_cpu_list)), str(p.pid)])
-        except Exception as e:
-            print(f"Could not set CPU affinity for PID {p.pid}: {e}")
-        print(f"set affinity for pid {p.pid}")
-    
+    if mode == "cgroup":
+        stats = apply_cgroup_cpuset(resized_cpu_list)
+    else:
+        stats = apply_task_affinity(resized_cpu_list)
+    allowed_cpus = sorted(resized_cpu_list)
+
     end = datetime.datetime.now()
-    print(f"Time taken to task set: {str(end-start)}")
+    print(f"Time taken to task set ({mode}): {str(end-start)}")
+    stats["mode"] = mode
+    stats["taskset_ms"] = (end - start).total_seconds() * 1000
 
     start = datetime.datetime.now()
-    balance_all_irq_affinity(resized_cpu_list)
+    stats["irq"] = irq.balance_irqs(resized_cpu_list, cpuload.load_tracker.latest_irq_rates())
     end = datetime.datetime.now()
-    print(f"Time taken for irq: {str(end-start)}")
-    print("online cpu list (after change)", resized_cpu_list)
+    print(f"Time taken for irq: {str(end-start)} {stats['irq']}")
+    stats["irq"]["irq_ms"] = (end - start).total_seconds() * 1000
+    print("allowed cpu list (after change)", resized_cpu_list)
+    return stats
+
+# handles a vcpu_cnt_request from the host. the reply lists the allowed cpus as vcpu_ids, so the host pins the vcpus
+# that are still in use exactly as it does for ufo
+def resize_cpus_cps_request(s, data):
+    start_time = datetime.datetime.now()
+    required_cpu_count = data["vcpu_cnt_request"]
+    ret = {}
+
+    with resize_lock:
+        stats = resize_cpus_cps(required_cpu_count)
+        if stats is None:
+            ret["error"] = f"required cpu count {required_cpu_count} is out of range"
+        else:
+            ret["cps"] = stats
+        ret["vcpu_ids"] = allowed_cpus
+
+    end_time = datetime.datetime.now()
+    ret["time_elapsed"] = str(end_time - start_time)
+    protocol.reply(s, data, ret)
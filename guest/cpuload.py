@@ -0,0 +1,110 @@
+import re
+import threading
+import time
+
+# Tracks recent per-cpu load in the guest from /proc/stat and /proc/interrupts deltas. UFO uses it to offline the
+# cheapest cpus first: offlining a busy cpu forces its runnable threads to migrate, which costs far more than taking
+# down an idle one.
+PROC_STAT = "/proc/stat"
+PROC_INTERRUPTS = "/proc/interrupts"
+SAMPLE_INTERVAL = 1.0
+IRQ_RATE_PER_BUSY_CPU = 10000.0 # interrupts/s that are counted as costly as one fully busy cpu
+
+# returns {<cpu>: (busy jiffies, total jiffies), ...}
+def read_cpu_times(path=PROC_STAT):
+    times = {}
+    with open(path, "r") as f:
+        for line in f:
+            match = re.match(r"^cpu(\d+)\s+(.*)$", line)
+            if match:
+                fields = [int(x) for x in match.group(2).split()]
+                idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+                total = sum(fields[:8])
+                times[int(match.group(1))] = (total - idle, total)
+    return times
+
+# returns {<irq>: {<cpu>: count, ...}, ...}. irq is the first column of /proc/interrupts, e.g. "24" or "LOC"
+def read_interrupts(path=PROC_INTERRUPTS):
+    interrupts = {}
+    with open(path, "r") as f:
+        cpus = [int(name[3:]) for name in f.readline().split()]
+        for line in f:
+            parts = line.split()
+            if not parts or not parts[0].endswith(":"):
+                continue
+            counts = {}
+            for cpu, count in zip(cpus, parts[1:]):
+                if not count.isdigit():
+                    break
+                counts[cpu] = int(count)
+            interrupts[parts[0][:-1]] = counts
+    return interrupts
+
+
+class LoadTracker:
+    def __init__(self, interval=SAMPLE_INTERVAL, proc_stat=PROC_STAT, proc_interrupts=PROC_INTERRUPTS):
+        self.interval = interval
+        self.proc_stat = proc_stat
+        self.proc_interrupts = proc_interrupts
+        self.lock = threading.Lock()
+        self.previous = None # (time, cpu times, interrupts) of the last sample
+        self.loads = None # {<cpu>: {"util": 0..1, "irq_rate": interrupts/s}, ...} over the last interval
+        self.irq_rates = None # {<irq>: {<cpu>: interrupts/s, ...}, ...} over the last interval
+
+    # takes a sample and updates loads and irq_rates from the delta to the previous sample
+    def sample(self):
+        now = time.perf_counter()
+        cpu_times = read_cpu_times(self.proc_stat)
+        interrupts = read_interrupts(self.proc_interrupts)
+        with self.lock:
+            if self.previous is not None:
+                prev_time, prev_cpu_times, prev_interrupts = self.previous
+                elapsed = max(now - prev_time, 1e-6)
+                irq_rates = {}
+                for irq, counts in interrupts.items():
+                    prev_counts = prev_interrupts.get(irq, {})
+                    irq_rates[irq] = {cpu: max(count - prev_counts.get(cpu, count), 0) / elapsed for cpu, count in counts.items()}
+                loads = {}
+                for cpu, (busy, total) in cpu_times.items():
+                    prev_busy, prev_total = prev_cpu_times.get(cpu, (busy, total))
+                    util = (busy - prev_busy) / (total - prev_total) if total > prev_total else 0.0
+                    irq_rate = sum(rates.get(cpu, 0.0) for rates in irq_rates.values())
+                    loads[cpu] = {"util": util, "irq_rate": irq_rate}
+                self.loads = loads
+                self.irq_rates = irq_rates
+            self.previous = (now, cpu_times, interrupts)
+
+    # samples every interval seconds in a daemon thread
+    def start(self):
+        def run():
+            while True:
+                self.sample()
+                time.sleep(self.interval)
+        threading.Thread(target=run, daemon=True).start()
+
+    # the loads over the last interval; if the tracker has not been started, takes two samples a short time apart
+    def latest(self):
+        if self.loads is None:
+            self.sample()
+            time.sleep(0.1)
+            self.sample()
+        with self.lock:
+            return dict(self.loads)
+
+    # the per-irq rates over the last interval, see latest
+    def latest_irq_rates(self):
+        self.latest()
+        with self.lock:
+            return dict(self.irq_rates)
+
+# shared by ufo, cps and irq balancing; started by guest.py
+load_tracker = LoadTracker()
+
+# cost of offlining a cpu: its recent utilization plus its interrupt load
+def offline_cost(load):
+    return load["util"] + load["irq_rate"] / IRQ_RATE_PER_BUSY_CPU
+
+# orders cpus from cheapest to most expensive to offline. among equally loaded cpus the highest-numbered goes first
+def offline_order(loads, cpus):
+    idle = {"util": 0.0, "irq_rate": 0.0}
+    return sorted(cpus, key=lambda cpu: (offline_cost(loads.get(cpu, idle)), -cpu))
@@ -1,50 +1,57 @@
 #!/usr/bin/env python3
 
 import socket
-import datetime
 import threading
-import json
 import argparse
 import utils
 import cps
 import ufo
+import protocol
+import cpuload
+import events
+import workload
 
 CID = socket.VMADDR_CID_HOST
 PORT = 9999
 
-def run_ufo(s, log_file):
+# starts the workload described by a "threads" message on the guest's runner, which replies when it completes
+def run_workload(s, data):
+    try:
+        workload.runner.start(s, data)
+    except ValueError as e:
+        print(e)
+        protocol.reply(s, data, {"error": str(e)})
+
+def run_ufo(s):
+    cpuload.load_tracker.start()
     while True:
-        raw_data = s.recv(1024).decode('utf-8')
-        print(f"raw_data {raw_data}")
-        data = json.loads(raw_data)
+        data = s.recv()
+        if data is None:
+            print("host closed the connection")
+            break
+        print(f"received {data}")
         if "vcpu_cnt_request" in data:
             resize_cpus_thread = threading.Thread(target=ufo.resize_cpus_ufo, args=(s, data,))
             resize_cpus_thread.start()
         elif "threads" in data:
-            if "mutex" == data["workload"]:
-                sysbench_thread = threading.Thread(target=utils.run_sysbench, args=(s, data, log_file, True))
-                sysbench_thread.start()
-            elif "sysbench" == data["workload"]:
-                print(f"running sysbench with data {data}")
-                sysbench_thread = threading.Thread(target=utils.run_sysbench, args=(s, data, log_file, False))
-                sysbench_thread.start()
-            elif "redis" == data["workload"]:
-                redis_thread = threading.Thread(target=utils.run_redis, args=(s, data, log_file))
-                redis_thread.start()
-        
+            run_workload(s, data)
+
 
-def run_cps(s):  
+# same messages as run_ufo, but vcpu_cnt_request confines tasks to that many cpus instead of hotplugging
+def run_cps(s):
     print("IRQ list : ", utils.get_irq_list())
+    cpuload.load_tracker.start()
     while True:
-        data = json.loads(s.recv(1024).decode('utf-8'))
-        ret = {}
-
-        start_time = datetime.datetime.now()
-        cps.resize_cpus_cps(required_cpu_count)
-        end_time = datetime.datetime.now()
-        time_delta = str(end_time - start_time)
-        ret["time_elapsed"] = time_delta
-        s.sendall(json.dumps(ret).encode('utf-8'))
+        data = s.recv()
+        if data is None:
+            print("host closed the connection")
+            break
+        print(f"received {data}")
+        if "vcpu_cnt_request" in data:
+            resize_cpus_thread = threading.Thread(target=cps.resize_cpus_cps_request, args=(s, data,))
+            resize_cpus_thread.start()
+        elif "threads" in data:
+            run_workload(s, data)
 
 
 if __name__ == "__main__":
@@ -52,19 +59,21 @@ if __name__ == "__main__":
     parser.add_argument("framework", choices=["ufo", "cps"])
     parser.add_argument("mode", choices=["cli", "sim"])
     parser.add_argument("log_file")
+    parser.add_argument("--cps-mode", choices=cps.AFFINITY_MODES, default="affinity", help="how cps confines tasks to the allowed cpus")
     args = parser.parse_args()
+    cps.affinity_mode = args.cps_mode
+    events.event_log = events.EventLog(f"./logs/{args.log_file}.events.bin")
+    workload.runner = workload.WorkloadRunner(f"./logs/{args.log_file}.txt")
 
 
-    s = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
-    s.connect((CID, PORT))
+    sock = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+    sock.connect((CID, PORT))
+    s = protocol.FramedSocket(sock)
     print("total available CPU count:", utils.get_cpu_count())
     print("online CPUs:", utils.online_cpu_list())
     
     if args.framework == "ufo":
-        run_ufo(s, args.log_file)
+        run_ufo(s)
     
     if args.framework == "cps":
-        if args.mode == "sim":
-            print("simulation mode not supported for cps")
-        else:
-            run_cps(s)
+        run_cps(s)
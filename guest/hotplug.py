@@ -0,0 +1,64 @@
+import os
+import time
+import subprocess
+import concurrent.futures
+
+# Onlines and offlines guest cpus by writing their sysfs online files directly. The guest agent is expected to run as
+# root; if it does not, each write falls back to sudo tee. Onlining requests are issued from a small thread pool so
+# that their setup overlaps; the kernel still serializes the parts of cpu hotplug that must be serialized.
+SYSFS_CPU_DIR = "/sys/devices/system/cpu"
+MAX_PARALLEL_ONLINE = 4
+
+online_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_PARALLEL_ONLINE)
+
+# writes 1 or 0 to the online file of cpu and returns how long the write took, in seconds
+def set_cpu_online(cpu, online, sysfs_cpu_dir=SYSFS_CPU_DIR):
+    path = os.path.join(sysfs_cpu_dir, f"cpu{cpu}", "online")
+    value = "1" if online else "0"
+    start = time.perf_counter()
+    try:
+        with open(path, "w") as f:
+            f.write(value)
+    except PermissionError:
+        subprocess.run(["sudo", "tee", path], input=value, text=True, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+# cpus without an online file, usually cpu0, cannot be taken offline
+def is_hotpluggable(cpu, sysfs_cpu_dir=SYSFS_CPU_DIR):
+    return os.path.exists(os.path.join(sysfs_cpu_dir, f"cpu{cpu}", "online"))
+
+# brings the number of online cpus to required_cpu_count by onlining the highest-numbered offline cpus or offlining
+# online cpus in offline_order (the highest-numbered first by default). returns (online cpu list, breakdown), where
+# breakdown has the per-cpu write latencies in ms, the wall time spent in hotplug writes and any per-cpu errors
+def resize(required_cpu_count, cpu_count, current_cpu_list, sysfs_cpu_dir=SYSFS_CPU_DIR, offline_order=None):
+    online = set(current_cpu_list)
+    delta = required_cpu_count - len(online)
+    breakdown = { "online_ms": {}, "offline_ms": {}, "errors": {} }
+
+    if delta > 0:
+        to_change = [i for i in range(cpu_count-1, -1, -1) if i not in online][:delta]
+    elif offline_order is not None:
+        to_change = [i for i in offline_order if i in online][:-delta]
+    else:
+        to_change = [i for i in range(cpu_count-1, -1, -1) if i in online][:-delta]
+
+    start = time.perf_counter()
+    if delta > 0:
+        futures = {cpu: online_executor.submit(set_cpu_online, cpu, True, sysfs_cpu_dir) for cpu in to_change}
+        for cpu, future in futures.items():
+            try:
+                breakdown["online_ms"][cpu] = future.result() * 1000
+                online.add(cpu)
+            except (OSError, subprocess.CalledProcessError) as e:
+                breakdown["errors"][cpu] = str(e)
+    else:
+        # offlining migrates the cpu's tasks away, so cpus are taken down one at a time
+        for cpu in to_change:
+            try:
+                breakdown["offline_ms"][cpu] = set_cpu_online(cpu, False, sysfs_cpu_dir) * 1000
+                online.discard(cpu)
+            except (OSError, subprocess.CalledProcessError) as e:
+                breakdown["errors"][cpu] = str(e)
+    breakdown["hotplug_ms"] = (time.perf_counter() - start) * 1000
+
+    return sorted(online), breakdown
@@ -0,0 +1,67 @@
+import os
+
+# Spreads device interrupts over the cpus the guest currently runs on, weighted by each irq's recent rate from
+# cpuload's /proc/interrupts deltas. Hot irqs get a cpu of their own where possible, assigned greedily to the least
+# loaded allowed cpu; irqs that fired nothing recently share the whole allowed list. Affinities are written to
+# /proc/irq/<irq>/smp_affinity_list, and irqs whose affinity is already correct are not written at all.
+PROC_IRQ_DIR = "/proc/irq"
+
+def format_cpu_list(cpus):
+    return ",".join(str(cpu) for cpu in sorted(cpus))
+
+# expands a cpu list such as "0-3,8" to [0, 1, 2, 3, 8]
+def parse_cpu_list(text):
+    cpus = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            start, end = map(int, part.split("-"))
+            cpus.extend(range(start, end + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+# the cpus irq may currently run on, or None if the irq has no writable affinity
+def read_affinity_list(irq, proc_irq_dir=PROC_IRQ_DIR):
+    try:
+        with open(os.path.join(proc_irq_dir, str(irq), "smp_affinity_list"), "r") as f:
+            return parse_cpu_list(f.read())
+    except OSError:
+        return None
+
+# returns {<irq>: [<cpu>, ...], ...}. irq_rates is {<irq>: {<cpu>: interrupts/s}, ...} as kept by cpuload.LoadTracker
+def plan_irq_affinity(irq_rates, cpus):
+    cpus = sorted(cpus)
+    rates = {irq: sum(per_cpu.values()) for (irq, per_cpu) in irq_rates.items() if irq.isdigit()}
+    cpu_load = {cpu: 0.0 for cpu in cpus}
+    plan = {}
+    for irq in sorted(rates, key=lambda irq: -rates[irq]):
+        if rates[irq] <= 0:
+            plan[irq] = cpus
+            continue
+        cpu = min(cpus, key=lambda cpu: (cpu_load[cpu], cpu))
+        cpu_load[cpu] += rates[irq]
+        plan[irq] = [cpu]
+    return plan
+
+# applies plan_irq_affinity for cpus. returns counts of irqs written, skipped because they were already correct,
+# and that the kernel refused to move (e.g. per-cpu or managed irqs)
+def balance_irqs(cpus, irq_rates, proc_irq_dir=PROC_IRQ_DIR):
+    stats = { "written": 0, "skipped": 0, "failed": 0, "hot": 0 }
+    if not cpus:
+        return stats
+    for (irq, irq_cpus) in plan_irq_affinity(irq_rates, cpus).items():
+        if sum(irq_rates[irq].values()) > 0:
+            stats["hot"] += 1
+        current = read_affinity_list(irq, proc_irq_dir)
+        if current is None:
+            continue
+        if sorted(current) == sorted(irq_cpus):
+            stats["skipped"] += 1
+            continue
+        try:
+            with open(os.path.join(proc_irq_dir, irq, "smp_affinity_list"), "w") as f:
+                f.write(format_cpu_list(irq_cpus))
+            stats["written"] += 1
+        except OSError:
+            stats["failed"] += 1
+    return stats
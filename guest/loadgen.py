@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import sys
+import math
+import time
+import argparse
+import multiprocessing
+
+# A cpu load generator that needs nothing but python, for the "loadgen" workload. threads worker processes each run
+# fixed-cost units of work back to back for the whole run and time every unit. Unit latencies go into log-bucketed
+# histograms that workers hand to the parent once per second; the parent merges them and prints one line per second
+# and a summary of the whole run:
+#   [ 1s ] thds: 4 ops/s: 3981.00 lat (ms): p50 1.004 p95 1.052 p99 1.217 p999 2.113 max 3.120
+#   total: thds: 4 ops: 39810 ops/s: 3981.00 lat (ms): p50 1.004 p95 1.060 p99 1.240 p999 2.310 max 5.901
+# Workers are processes rather than threads so that they really load threads cpus, and the workload runner reaps the
+# parent, whose rusage includes the workers it joined.
+UNIT_ITERATIONS = 5000 # integer operations in one unit of work, about a millisecond on a current cpu
+REPORT_INTERVAL = 1.0
+
+# Counts of integer values (ns here) in buckets that are exact below 2 ** SUB_BUCKET_BITS and then split every power of
+# two into SUB_BUCKETS / 2 linear buckets, so a value's bucket is within 1 / 64 of it, as in an HDR histogram with
+# two significant digits. Only buckets that were hit are stored
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+
+def bucket_index(value):
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    if shift <= 0:
+        return value
+    return shift * HALF_SUB_BUCKETS + (value >> shift)
+
+# the highest value that falls in bucket index
+def bucket_value(index):
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // HALF_SUB_BUCKETS - 1
+    return ((index - shift * HALF_SUB_BUCKETS + 1) << shift) - 1
+
+class Histogram:
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {}) # {<bucket index>: count, ...}
+
+    def record(self, value):
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    def merge(self, other):
+        for (index, count) in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def total(self):
+        return sum(self.counts.values())
+
+    # the value below which a fraction q of the recorded values fall, or None if nothing was recorded
+    def percentile(self, q):
+        total = self.total()
+        if total == 0:
+            return None
+        rank = max(math.ceil(q * total), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return bucket_value(index)
+        return bucket_value(max(self.counts))
+
+    def max(self):
+        return bucket_value(max(self.counts)) if self.counts else None
+
+
+def unit_of_work(iterations):
+    x = 0
+    for i in range(iterations):
+        x = (x * 1103515245 + 12345) & 0x7fffffff
+    return x
+
+# runs units until start + duration and puts (<second>, <histogram counts>, True) on queue for every whole second of
+# the run, even one without a completed unit, then (<second>, <counts>, False) for the part of the last second and None
+def worker(queue, start, duration, iterations):
+    end = start + duration
+    second = 0
+    histogram = Histogram()
+    while True:
+        before = time.monotonic_ns()
+        unit_of_work(iterations)
+        after = time.monotonic_ns()
+        now = after / 1e9
+        while now >= start + (second + 1) * REPORT_INTERVAL:
+            queue.put((second, histogram.counts, True))
+            histogram = Histogram()
+            second += 1
+        histogram.record(after - before)
+        if now >= end:
+            break
+    queue.put((second, histogram.counts, False))
+    queue.put(None)
+
+def format_latencies(histogram):
+    values = [histogram.percentile(q) for q in (0.5, 0.95, 0.99, 0.999)] + [histogram.max()]
+    p50, p95, p99, p999, latency_max = (value / 1e6 for value in values)
+    return f"lat (ms): p50 {p50:.3f} p95 {p95:.3f} p99 {p99:.3f} p999 {p999:.3f} max {latency_max:.3f}"
+
+# runs the workers and prints each second once every worker has reported it. returns the histogram of the whole run
+def run(threads, duration, iterations=UNIT_ITERATIONS, out=sys.stdout):
+    queue = multiprocessing.Queue()
+    start = time.monotonic()
+    workers = [multiprocessing.Process(target=worker, args=(queue, start, duration, iterations), daemon=True) for i in range(threads)]
+    for process in workers:
+        process.start()
+
+    seconds = {} # {<second>: [<merged histogram>, <workers that reported it>]}
+    overall = Histogram()
+    running = threads
+    printed = -1
+    while running > 0:
+        report = queue.get()
+        if report is None:
+            running -= 1
+        elif not report[2]:
+            overall.merge(Histogram(report[1]))
+        else:
+            entry = seconds.setdefault(report[0], [Histogram(), 0])
+            entry[0].merge(Histogram(report[1]))
+            entry[1] += 1
+        # a second is complete once every worker has moved past it or finished
+        while printed + 1 in seconds and (seconds[printed + 1][1] >= threads or running == 0):
+            printed += 1
+            histogram = seconds.pop(printed)[0]
+            overall.merge(histogram)
+            if histogram.total() > 0:
+                out.write(f"[ {printed + 1}s ] thds: {threads} ops/s: {histogram.total() / REPORT_INTERVAL:.2f} {format_latencies(histogram)}\n")
+                out.flush()
+    for process in workers:
+        process.join()
+
+    elapsed = time.monotonic() - start
+    if overall.total() > 0:
+        out.write(f"total: thds: {threads} ops: {overall.total()} ops/s: {overall.total() / elapsed:.2f} {format_latencies(overall)}\n")
+        out.flush()
+    return overall
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="loadgen", description="loads cpus with fixed-cost work and reports its latency")
+    parser.add_argument("--threads", type=int, required=True, help="worker processes")
+    parser.add_argument("--time", type=float, required=True, help="seconds to run")
+    parser.add_argument("--unit-iterations", type=int, default=UNIT_ITERATIONS, help="integer operations per unit of work")
+    args = parser.parse_args()
+    if args.threads > 0:
+        run(args.threads, args.time, args.unit_iterations)
+    else:
+        time.sleep(args.time)
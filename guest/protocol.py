@@ -0,0 +1,65 @@
+import json
+import struct
+import threading
+
+# Every message on the vsock connection is a frame: a 4-byte big-endian body length followed by a utf-8 json body.
+# Requests carry a "req_id" which the other side echoes back in its reply, so several requests can be in flight at once.
+# Messages without a "req_id" are notifications that expect no reply, such as the guest's per-second workload telemetry.
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def encode_frame(msg):
+    body = json.dumps(msg).encode('utf-8')
+    if len(body) > MAX_FRAME_SIZE:
+        raise ValueError(f"frame of {len(body)} bytes exceeds MAX_FRAME_SIZE")
+    return HEADER.pack(len(body)) + body
+
+
+def decode_body(body):
+    return json.loads(body.decode('utf-8'))
+
+
+# Wraps a connected stream socket. send() may be called from several threads, recv() from a single reader thread.
+class FramedSocket:
+    def __init__(self, sock):
+        self.sock = sock
+        self.send_lock = threading.Lock()
+
+    def send(self, msg):
+        frame = encode_frame(msg)
+        with self.send_lock:
+            self.sock.sendall(frame)
+
+    # returns the next message, or None if the peer closed the connection between frames
+    def recv(self):
+        header = self._recv_exact(HEADER.size)
+        if header is None:
+            return None
+        (length,) = HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f"peer announced a frame of {length} bytes, exceeding MAX_FRAME_SIZE")
+        body = self._recv_exact(length)
+        if body is None:
+            raise ConnectionError("connection closed in the middle of a frame")
+        return decode_body(body)
+
+    def _recv_exact(self, n):
+        buf = bytearray()
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                if buf:
+                    raise ConnectionError("connection closed in the middle of a frame")
+                return None
+            buf += chunk
+        return bytes(buf)
+
+    def close(self):
+        self.sock.close()
+
+
+# sends msg as the reply to request, tagging it with the request's id
+def reply(conn, request, msg):
+    msg["req_id"] = request.get("req_id")
+    conn.send(msg)
@@ -1,44 +1,68 @@
+import threading
 import utils
 import datetime
-import json
-import os
+import time
+import protocol
+import hotplug
+import cpuload
+import irq
 
 CPU_COUNT = utils.get_cpu_count()
+resize_lock = threading.Lock() # resizes run in their own threads and must not interleave
 
 def resize_cpus_ufo(s, data):
     start_time = datetime.datetime.now()
-    required_cpu_count = data["vcpu_cnt_request"]
-    ret = {}
-
-    if required_cpu_count < 1 or required_cpu_count > CPU_COUNT:
-        print("required cpu count is out of range")
-        return
-
-    current_cpu_list = utils.online_cpu_list()
-    current_cpu_count = len(current_cpu_list)
-    print("online cpu list (before change)", current_cpu_list)
-
-    # delta is number of cpu cores you want to add
-    delta = required_cpu_count - current_cpu_count
-
-    for i in range(CPU_COUNT-1, -1, -1):
-        if delta == 0:
-            break
-
-        if delta > 0 and i not in current_cpu_list:
-            os.system(f"echo 1 | sudo tee /sys/devices/system/cpu/cpu{i}/online") 
-            delta-=1
-
-        if delta < 0 and i in current_cpu_list:
-            os.system(f"echo 0 | sudo tee /sys/devices/system/cpu/cpu{i}/online")
-            delta+=1
-    
-    print("online cpu list (after change)", utils.online_cpu_list())
-     
-    ret["vcpu_ids"] = utils.online_cpu_list()
-    print(ret["vcpu_ids"])
-    end_time = datetime.datetime.now()
-    time_delta = str(end_time - start_time)
-    ret["time_elapsed"] = time_delta
-    
-    s.sendall(json.dumps(ret).encode('utf-8'))
+    with resize_lock:
+        start = time.perf_counter()
+        required_cpu_count = data["vcpu_cnt_request"]
+        ret = {}
+
+        current_cpu_list = utils.online_cpu_list()
+
+        if required_cpu_count < 1 or required_cpu_count > CPU_COUNT:
+            print("required cpu count is out of range")
+            ret["error"] = f"required cpu count {required_cpu_count} is out of range"
+            ret["vcpu_ids"] = current_cpu_list
+            protocol.reply(s, data, ret)
+            return
+
+        print("online cpu list (before change)", current_cpu_list)
+
+        # when shrinking, offline the least loaded cpus first and report what their load was
+        offline_order = None
+        if required_cpu_count < len(current_cpu_list):
+            loads = cpuload.load_tracker.latest()
+            candidates = [cpu for cpu in current_cpu_list if hotplug.is_hotpluggable(cpu)]
+            offline_order = cpuload.offline_order(loads, candidates)
+            chosen = offline_order[:len(current_cpu_list) - required_cpu_count]
+            ret["offline_choice"] = {
+                "policy": "lowest recent utilization plus irq load first",
+                "chosen": {cpu: loads.get(cpu) for cpu in chosen},
+                "kept": {cpu: loads.get(cpu) for cpu in current_cpu_list if cpu not in chosen},
+            }
+            print("offlining cpus", ret["offline_choice"])
+
+        vcpu_ids, breakdown = hotplug.resize(required_cpu_count, CPU_COUNT, current_cpu_list, offline_order=offline_order)
+        if breakdown["errors"]:
+            print("failed to hotplug cpus", breakdown["errors"])
+
+        print("online cpu list (after change)", vcpu_ids)
+
+        # spread interrupts over the cpus that are now online
+        irq_start = time.perf_counter()
+        ret["irq"] = irq.balance_irqs(vcpu_ids, cpuload.load_tracker.latest_irq_rates())
+        ret["irq"]["irq_ms"] = (time.perf_counter() - irq_start) * 1000
+        print("irq rebalance", ret["irq"])
+
+        ret["vcpu_ids"] = vcpu_ids
+        print(ret["vcpu_ids"])
+        end_time = datetime.datetime.now()
+        time_delta = str(end_time - start_time)
+        ret["time_elapsed"] = time_delta
+
+        # how much of the request was spent in hotplug writes and how much elsewhere in the guest
+        breakdown["total_ms"] = (time.perf_counter() - start) * 1000
+        breakdown["overhead_ms"] = breakdown["total_ms"] - breakdown["hotplug_ms"]
+        ret["hotplug"] = breakdown
+
+        protocol.reply(s, data, ret)
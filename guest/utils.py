@@ -1,13 +1,12 @@
 import os
 import re
-import subprocess
-import datetime
-import json
+import time
+import events
 
 # Includes both online and offline cpus
 def get_cpu_count():
     cpu_files = os.listdir("/sys/devices/system/cpu/")
-    return len([f for f in cpu_files if re.match(r"^cpu\d$", f)])
+    return len([f for f in cpu_files if re.match(r"^cpu\d+$", f)])
 
 def online_cpu_list():
     path = "/sys/devices/system/cpu/online"
@@ -37,86 +36,42 @@ def get_irq_list():
     return irq_list
 
 
-def run_sysbench(s, data, log_file, mutex=False):
-    print(f"running sysbench with data {data} mutex={mutex}")
-    threads = data["threads"]
-    interval = data["interval"] 
-    start_time = datetime.datetime.now()
-    command = f"sudo sysbench cpu --time={interval} --threads={threads} --report-interval=1 run | ts '[%Y-%m-%d %H:%M:%S]'"
-    if mutex:
-        command = f"sudo stress-ng --mutex {threads} --timeout {interval}s --metrics-brief"
-# sudo stress-ng --mutex 20 --timeout 10s --metrics-brief
-    with open(f"./logs/{log_file}.txt", "a") as log_file:
-        # Run the command in a subprocess
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+# parses a line of sysbench, redis-benchmark, stress-ng or loadgen.py output into a workload sample, or returns None.
+# latency_ms is always a p95, or None. sysbench reports p95 latency and events/s every second; redis-benchmark reports
+# requests/s and only an average latency, which its samples carry as latency_avg_ms; stress-ng only reports bogo ops/s
+# at the end of its run, without a latency; loadgen reports ops/s and its p95 every second, and its samples also carry
+# p50_ms, p99_ms and p999_ms
+def parse_workload_line(line, threads, start):
+    match = re.search(r"\[ (\d+)s \] thds: \d+ eps: ([\d.]+) .*lat \(ms,95%\): ([\d.]+)", line)
+    if match:
+        return { "workload": "sysbench", "second": int(match.group(1)), "threads": threads,
+                 "latency_ms": float(match.group(3)), "throughput": float(match.group(2)) }
+    match = re.search(r"\[ (\d+)s \] thds: \d+ ops/s: ([\d.]+) lat \(ms\): p50 ([\d.]+) p95 ([\d.]+) p99 ([\d.]+) p999 ([\d.]+)", line)
+    if match:
+        return { "workload": "loadgen", "second": int(match.group(1)), "threads": threads,
+                 "latency_ms": float(match.group(4)), "throughput": float(match.group(2)),
+                 "p50_ms": float(match.group(3)), "p99_ms": float(match.group(5)), "p999_ms": float(match.group(6)) }
+    match = re.search(r"^\w+: rps=([\d.]+) \(overall: [\d.]+\) avg_msec=([\d.]+)", line)
+    if match:
+        return { "workload": "redis", "second": int(time.monotonic() - start), "threads": threads,
+                 "latency_ms": None, "latency_avg_ms": float(match.group(2)), "throughput": float(match.group(1)) }
+    match = re.search(r"metrc: \[\d+\] mutex\s+\d+\s+([\d.]+)\s+[\d.]+\s+[\d.]+\s+([\d.]+)", line)
+    if match:
+        return { "workload": "mutex", "second": int(float(match.group(1))), "threads": threads,
+                 "latency_ms": None, "throughput": float(match.group(2)) }
+    return None
 
-        # Write the output to the log file
-        log_file.write(f"Sysbench is running in the background with the following parameters: interval={interval}, threads={threads} ...\n")
-        for line in process.stdout:
-            log_file.write(line)  # Write each line to the file
-
-        # Wait for the process to finish
-        process.wait()
-
-        # Log errors, if any
-        if process.returncode != 0:
-            log_file.write(f"Error: {process.stderr.read().strip()}\n")
-        else:
-            log_file.write("Sysbench completed successfully.\n")
-        
-       
-    ret = {}
-    ret["workload_completed"] = True
-   
-    end_time = datetime.datetime.now()
-    time_delta = str(end_time - start_time)
-    ret["time_elapsed"] = time_delta
-    
-    s.sendall(json.dumps(ret).encode('utf-8'))
-
-def run_redis(s, data, log_file):
-    print(f"running sysbench with data {data}")
-    threads = data["threads"]
-    requests = data["interval"] 
-    start_time = datetime.datetime.now()
-    command = f"redis-benchmark -t set,get -c {threads} -n {requests}"
-# redis-benchmark -c 10 -n 10000
-    with open(f"./logs/{log_file}.txt", "a") as log_file:
-        # Run the command in a subprocess
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-
-        # Write the output to the log file
-        log_file.write(f"Sysbench is running in the background with the following parameters: requests={requests}, threads={threads} ...\n")
-        for line in process.stdout:
-            log_file.write(line)  # Write each line to the file
-
-        # Wait for the process to finish
-        process.wait()
-
-        # Log errors, if any
-        if process.returncode != 0:
-            log_file.write(f"Error: {process.stderr.read().strip()}\n")
-        else:
-            log_file.write("Sysbench completed successfully.\n")
-        
-       
-    ret = {}
-    ret["workload_completed"] = True
-   
-    end_time = datetime.datetime.now()
-    time_delta = str(end_time - start_time)
-    ret["time_elapsed"] = time_delta
-    
-    s.sendall(json.dumps(ret).encode('utf-8'))
+# streams the sample in a line of workload output to the host as telemetry and records it in the guest's event log.
+# the log belongs to this guest, so its events carry cid 0
+def report_workload_line(s, line, threads, start):
+    sample = parse_workload_line(line, threads, start)
+    if sample is None:
+        return
+    if events.event_log is not None:
+        events.event_log.record(events.THROUGHPUT, 0, threads, sample["second"], sample["throughput"])
+        if sample["latency_ms"] is not None:
+            events.event_log.record(events.WORKLOAD_SAMPLE, 0, threads, sample["second"], sample["latency_ms"])
+    try:
+        s.send({ "telemetry": sample })
+    except OSError as e:
+        print(f"could not send telemetry: {e}")
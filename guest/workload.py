@@ -0,0 +1,163 @@
+import os
+import re
+import sys
+import time
+import datetime
+import selectors
+import threading
+import subprocess
+import protocol
+import events
+import utils
+
+# Runs the benchmarks the host asks for: sysbench, stress-ng, redis-benchmark, or loadgen.py, which needs nothing but
+# python. Every benchmark is started directly from its argv, without a shell, sudo or a `ts` pipeline, so the only
+# process a workload adds is the benchmark itself and its rusage is exactly the benchmark's cpu time. A single runner
+# thread drains the stdout and stderr of every running benchmark through one selector, prefixes each line with the
+# wall time it was read at, in nanoseconds, and writes it to the guest's log. stderr is read as it comes, so a
+# benchmark never blocks on a full stderr pipe. A benchmark is reaped without blocking once both its pipes are closed,
+# so one that lingers after closing them never holds up the others. The runner is created once by guest.py and runs
+# the workloads of every slice.
+LINE_END = re.compile(rb"\r\n|\r|\n") # redis-benchmark separates its progress updates with \r
+READ_SIZE = 65536
+REAP_INTERVAL = 0.05 # seconds between attempts to reap benchmarks that closed their pipes but have not exited
+LOADGEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadgen.py")
+
+# the argv of the benchmark a "threads" message asks for
+def command(data):
+    threads = data["threads"]
+    interval = data["interval"]
+    if data["workload"] == "sysbench":
+        return ["sysbench", "cpu", f"--time={interval}", f"--threads={threads}", "--report-interval=1", "run"]
+    if data["workload"] == "mutex":
+        return ["stress-ng", "--mutex", str(threads), "--timeout", f"{interval}s", "--metrics-brief"]
+    if data["workload"] == "redis":
+        return ["redis-benchmark", "-t", "set,get", "-c", str(threads), "-n", str(interval)]
+    if data["workload"] == "loadgen":
+        return [sys.executable, LOADGEN, "--threads", str(threads), "--time", str(interval)]
+    raise ValueError(f"unknown workload {data['workload']}")
+
+# "[2024-05-01 12:00:00.123456789]" in local time, like ts, but to the nanosecond
+def format_timestamp(ns):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ns // 1_000_000_000)) + f".{ns % 1_000_000_000:09d}"
+
+
+# one running benchmark
+class Run:
+    def __init__(self, s, data, process):
+        self.s = s
+        self.data = data
+        self.process = process
+        self.start = time.monotonic()
+        self.start_ns = time.monotonic_ns()
+        self.start_time = datetime.datetime.now()
+        self.buffers = {process.stdout.fileno(): b"", process.stderr.fileno(): b""}
+
+
+class WorkloadRunner:
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.log = open(log_path, "a")
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.pending = [] # runs started since the runner thread last registered runs
+        self.exiting = [] # runs whose pipes are closed and whose benchmark has not been reaped yet
+        self.wake_read, self.wake_write = os.pipe()
+        self.selector.register(self.wake_read, selectors.EVENT_READ)
+        self.thread = None
+
+    # starts the benchmark a "threads" message asks for and returns without waiting for it. the host gets a reply
+    # once it exits
+    def start(self, s, data):
+        self.launch(s, data, command(data))
+
+    def launch(self, s, data, argv):
+        print(f"running {data['workload']} with data {data}: {argv}")
+        try:
+            process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            print(f"could not start {argv[0]}: {e}")
+            protocol.reply(s, data, {"error": f"could not start {argv[0]}: {e}"})
+            return
+
+        length = "requests" if data["workload"] == "redis" else "interval"
+        with self.lock:
+            self.log.write(f"Sysbench is running in the background with the following parameters: {length}={data['interval']}, threads={data['threads']} ...\n")
+            self.pending.append(Run(s, data, process))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, daemon=True)
+                self.thread.start()
+        os.write(self.wake_write, b"\0")
+
+    def loop(self):
+        while True:
+            for (key, mask) in self.selector.select(REAP_INTERVAL if self.exiting else None):
+                if key.fd == self.wake_read:
+                    os.read(self.wake_read, READ_SIZE)
+                    with self.lock:
+                        runs, self.pending = self.pending, []
+                    for run in runs:
+                        for fd in run.buffers:
+                            self.selector.register(fd, selectors.EVENT_READ, run)
+                else:
+                    self.drain(key.data, key.fd)
+            self.exiting = [run for run in self.exiting if not self.reap(run)]
+
+    # reads what a benchmark wrote to fd and logs and reports every complete line. at end of file the rest of the
+    # buffer is a last line, and the run is finished once both of its pipes are closed
+    def drain(self, run, fd):
+        chunk = os.read(fd, READ_SIZE)
+        now_ns = time.time_ns()
+        *lines, run.buffers[fd] = LINE_END.split(run.buffers[fd] + chunk)
+        if not chunk:
+            lines.append(run.buffers.pop(fd))
+            self.selector.unregister(fd)
+        stamp = format_timestamp(now_ns)
+        with self.lock:
+            for line in lines:
+                if line:
+                    self.log.write(f"[{stamp}] {line.decode(errors='replace')}\n")
+        for line in lines:
+            if line:
+                utils.report_workload_line(run.s, line.decode(errors="replace"), run.data["threads"], run.start)
+        if not run.buffers:
+            run.process.stdout.close()
+            run.process.stderr.close()
+            self.exiting.append(run)
+
+    # reaps the benchmark with its rusage if it has exited and replies to the host. returns whether it was reaped
+    def reap(self, run):
+        pid, status, rusage = os.wait4(run.process.pid, os.WNOHANG)
+        if pid == 0:
+            return False
+        run.process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed_ns = time.monotonic_ns() - run.start_ns
+        cpu_s = rusage.ru_utime + rusage.ru_stime
+
+        with self.lock:
+            self.log.write(f"cpu: user {rusage.ru_utime:.3f} s system {rusage.ru_stime:.3f} s wall {elapsed_ns / 1e9:.3f} s\n")
+            if run.process.returncode != 0:
+                self.log.write(f"Error: {run.data['workload']} exited with status {run.process.returncode}\n")
+            else:
+                self.log.write("Sysbench completed successfully.\n")
+            self.log.flush()
+        if events.event_log is not None:
+            events.event_log.record(events.WORKLOAD_DONE, 0, run.data["threads"], run.process.returncode, cpu_s * 1000)
+            events.event_log.flush()
+
+        ret = {}
+        ret["workload_completed"] = True
+        ret["time_elapsed"] = str(datetime.datetime.now() - run.start_time)
+        ret["elapsed_ns"] = elapsed_ns
+        ret["returncode"] = run.process.returncode
+        ret["cpu_user_s"] = rusage.ru_utime
+        ret["cpu_system_s"] = rusage.ru_stime
+        try:
+            protocol.reply(run.s, run.data, ret)
+        except OSError as e:
+            print(f"could not reply that the workload completed: {e}")
+        return True
+
+
+# the guest's runner, created by guest.py
+runner = None
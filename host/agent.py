@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import asyncio
+import argparse
+import protocol
+import hypervisor
+import allocator
+import policies
+import timeline
+
+# The per-host side of coordinator.py. A host agent answers the coordinator over a unix socket, with the framing of
+# protocol.py, so the coordinator sees every host the same way whether it is a real `host.py sim --agent-socket` or the
+# FakeHost below. Requests and replies:
+#   {"status": true}                                  {"host", "total_cpus", "migration_uri", "adopt", "vms": [<vm>, ...]}
+#       where <vm> is {"cid", "vm_name", "threads", "cpus", "latency_ms"}; latency_ms is None without telemetry, and
+#       adopt tells whether the host adopts vms migrated to it
+#   {"migrate": {"cid", "dest_uri"}}                  {"migrated": true, "elapsed_ms", "vm": <vm config + threads>}
+#       the vm is live-migrated through the hypervisor backend and leaves this host's allocation
+#   {"adopt": <vm config + threads>}                  {"adopted": true}
+#       a vm migrated here joins this host's allocation
+# A request the agent cannot serve is answered with {"error": <message>}.
+client_tasks = set() # one task per connected coordinator, so close() can stop them
+
+# serves coordinator requests on the unix socket at path until the returned server is stopped with close(). handle(msg)
+# is awaited for each request and returns the reply
+async def serve(path, handle):
+    async def client(reader, writer):
+        client_tasks.add(asyncio.current_task())
+        conn = protocol.AsyncFramedStream(reader, writer)
+        while True:
+            try:
+                msg = await conn.recv()
+            except (OSError, ValueError) as e:
+                print(f"coordinator connection error: {e}")
+                msg = None
+            except asyncio.CancelledError:
+                # close() is stopping the agent. the connection ends normally, since asyncio's stream callback does not
+                # expect a cancelled handler on every python version
+                msg = None
+            if msg is None:
+                break
+            try:
+                resp = await handle(msg)
+            except Exception as e:
+                print(f"could not serve coordinator request {msg}: {e}")
+                resp = {"error": str(e)}
+            await conn.send({**resp, "req_id": msg.get("req_id")})
+        conn.close()
+        client_tasks.discard(asyncio.current_task())
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(client, path)
+    print(f"serving the coordinator on {path}")
+    return server
+
+# stops serving and ends the connections of coordinators that are still connected
+async def close(server):
+    server.close()
+    for task in list(client_tasks):
+        task.cancel()
+    await asyncio.gather(*client_tasks, return_exceptions=True)
+    client_tasks.clear()
+
+
+# A host without guests, for running the coordinator against several agents on one machine. Each vm's threads follow
+# the compiled timeline of a host.py sim config (see timeline.py), with every time scaled by time_scale, and pcpus are
+# split by a policies.py policy whenever threads change. Migrations go to a hypervisor.FakeBackend; an adopted vm keeps
+# the threads it had when it left its previous host.
+class FakeHost:
+    def __init__(self, name, config, total_cpus, migration_uri=None, policy_name="proportional", time_scale=1.0):
+        self.name = name
+        self.config = list(config)
+        self.total_cpus = total_cpus
+        self.migration_uri = migration_uri or f"fake://{name}"
+        self.policy = policies.make_policy(policy_name, config)
+        self.time_scale = time_scale
+        self.backend = hypervisor.FakeBackend()
+        # the fake host only tracks counts, so mappings hold one placeholder pcpu per vcpu
+        self.vms = {vm["vm_cid"]: {"threads": 0, "vcpu_cpu_mapping": {}} for vm in config}
+        self.scheduler = None # timeline.TimelineScheduler replaying the config, built by run
+        self.allocate(allocator.counts_initial(list(self.vms), total_cpus))
+
+    def allocate(self, counts):
+        for (cid, cnt) in counts.items():
+            self.vms[cid]["vcpu_cpu_mapping"] = dict.fromkeys(range(cnt))
+
+    def reallocate(self):
+        if self.vms:
+            self.allocate(self.policy.counts(allocator.snapshot(self.vms), self.total_cpus))
+
+    # a workload runs for its slice's duration, or its interval in seconds when it is open-ended
+    async def run_event(self, event, lateness):
+        self.vms[event["cid"]]["threads"] = event["threads"]
+        self.reallocate()
+        duration = event["duration"] if event["duration"] is not None else event["interval"]
+        await asyncio.sleep(duration * self.time_scale)
+
+    # replays every vm's timeline and returns when all of them are done or have migrated away
+    async def run(self):
+        compiled = [{**event, "at": event["at"] * self.time_scale} for event in timeline.compile_timeline(self.config)]
+        self.scheduler = timeline.TimelineScheduler(compiled, self.run_event)
+        await self.scheduler.run()
+
+    def status(self):
+        vms = []
+        for vm in self.config:
+            runtime = self.vms[vm["vm_cid"]]
+            vms.append({"cid": vm["vm_cid"], "vm_name": vm["vm_name"], "threads": runtime["threads"],
+                        "cpus": len(runtime["vcpu_cpu_mapping"]), "latency_ms": None})
+        return {"host": self.name, "total_cpus": self.total_cpus, "migration_uri": self.migration_uri, "adopt": True, "vms": vms}
+
+    async def migrate(self, cid, dest_uri):
+        vm_config = next(vm for vm in self.config if vm["vm_cid"] == cid)
+        elapsed = await self.backend.migrate_vm(vm_config["vm_name"], dest_uri)
+        if self.scheduler is not None:
+            self.scheduler.drop_vm(cid)
+        self.config.remove(vm_config)
+        runtime = self.vms.pop(cid)
+        self.reallocate()
+        print(f"{self.name}: migrated vm {cid} to {dest_uri} in {elapsed * 1000:.2f} ms")
+        return {"migrated": True, "elapsed_ms": elapsed * 1000, "vm": {**vm_config, "threads": runtime["threads"]}}
+
+    def adopt(self, vm):
+        if vm["vm_cid"] in self.vms:
+            return {"error": f"{self.name} already runs a vm with cid {vm['vm_cid']}"}
+        self.config.append({key: value for (key, value) in vm.items() if key != "threads"})
+        self.vms[vm["vm_cid"]] = {"threads": vm["threads"], "vcpu_cpu_mapping": {}}
+        self.reallocate()
+        print(f"{self.name}: adopted vm {vm['vm_cid']} running {vm['threads']} threads")
+        return {"adopted": True}
+
+    async def handle(self, msg):
+        if "status" in msg:
+            return self.status()
+        if "migrate" in msg:
+            return await self.migrate(msg["migrate"]["cid"], msg["migrate"]["dest_uri"])
+        if "adopt" in msg:
+            return self.adopt(msg["adopt"])
+        return {"error": f"unsupported request {sorted(key for key in msg if key != 'req_id')}"}
+
+
+async def run_fake_agent(socket_path, host):
+    server = await serve(socket_path, host.handle)
+    await host.run()
+    await close(server)
+    print(f"{host.name}: all workloads completed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="agent", description="runs a fake host agent for coordinator.py")
+    parser.add_argument("config_file", help="host.py sim config whose workloads the fake host replays")
+    parser.add_argument("--socket", required=True, help="unix socket to serve the coordinator on")
+    parser.add_argument("--name", default="fake", help="host name reported to the coordinator")
+    parser.add_argument("--cpus", type=int, default=8, help="pcpus of the fake host")
+    parser.add_argument("--policy", choices=policies.POLICIES, default="proportional")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="factor applied to every slice's interval")
+    args = parser.parse_args()
+
+    with open(args.config_file, "r") as f:
+        config = json.load(f)
+    asyncio.run(run_fake_agent(args.socket, FakeHost(args.name, config, args.cpus, policy_name=args.policy, time_scale=args.time_scale)))
@@ -0,0 +1,231 @@
+import numpy as np
+import topology
+
+# Pure allocation planning for UFO. Everything here works on snapshots of the host's runtime state and returns new
+# assignments without mutating that state or talking to guests, so the host can plan under runtime_vm_configs_lock
+# and then apply the plan without holding it.
+#
+# A round is planned as a diff against each vm's current vcpu_cpu_mapping:
+#   resize: {<cid>: <new vcpu count>, ...}   vms whose vcpu count changes (one hotplug request each)
+#   shrinks / grows: [<cid>, ...]             the vms of resize split by direction
+#   moves: {<cid>: {<vcpu_id>: <pcpu_id>}}    pinned pairs whose pcpu may no longer be used and must be re-pinned
+#   targets: {<cid>: <cpu count>, ...}        the planned count of every vm
+#   usable_cpus: [<cpu>, ...]                 the pcpus vms may be pinned on this round
+# vcpus that stay online keep their pcpu, so the only re-pins are for newly onlined vcpus and moves.
+#
+# Count functions are exact: their counts add up to total_cpus whenever total_cpus leaves every vm its floor. With
+# fewer pcpus than that, every vm still gets floor pcpus and pcpus are shared.
+
+# copies the parts of runtime_vm_configs that planning reads
+def snapshot(runtime_vm_configs):
+    return {
+        cid: {
+            "threads": runtime_config.get("threads", 0),
+            "vcpu_cpu_mapping": dict(runtime_config.get("vcpu_cpu_mapping", {})),
+        }
+        for cid, runtime_config in runtime_vm_configs.items()
+    }
+
+# splits total_cpus integer pcpus in proportion to weights (a float array, one entry per vm) by the largest remainder
+# method. vms whose share falls below floor are raised to floor and the rest is split between the others. ties between
+# equal remainders go to the vm holding more pcpus in current (an int array, or None), then to the earlier vm, so equal
+# demand does not make pcpus flap between vms. runs in O(n log n) without python loops. returns an int64 array
+def largest_remainder(weights, total_cpus, floor=1, current=None):
+    weights = np.asarray(weights, dtype=np.float64)
+    n = len(weights)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if total_cpus <= floor * n:
+        return np.full(n, floor, dtype=np.int64)
+    if weights.sum() <= 0:
+        weights = np.ones(n)
+
+    # raising a vm to floor shrinks the others' shares, so the raised vms are the lightest k for the smallest k at which
+    # the next lightest vm, of weight w, reaches floor: w * (total_cpus - floor * k) >= floor * (weight of it and all
+    # heavier vms). the heaviest vm always does, since total_cpus > floor * n
+    order = np.argsort(weights)
+    sorted_weights = weights[order]
+    heavier = np.cumsum(sorted_weights[::-1])[::-1]
+    reaches_floor = sorted_weights * (total_cpus - floor * np.arange(n)) >= floor * heavier
+    n_fixed = int(np.argmax(reaches_floor))
+    fixed = np.zeros(n, dtype=bool)
+    fixed[order[:n_fixed]] = True
+
+    quotas = np.where(fixed, 0.0, weights) * ((total_cpus - floor * n_fixed) / heavier[n_fixed])
+    counts = np.maximum(np.floor(quotas), floor).astype(np.int64)
+    remainders = np.where(fixed, -1.0, quotas - counts)
+    leftover = total_cpus - int(counts.sum())
+    if leftover > 0:
+        # the leftover largest remainders get one more pcpu. only vms tied at the smallest of them need sorting
+        threshold = np.partition(remainders, n - leftover)[n - leftover]
+        above = remainders > threshold
+        ties = np.flatnonzero(remainders == threshold)
+        if current is not None:
+            ties = ties[np.argsort(-np.asarray(current)[ties], kind="stable")]
+        counts[above] += 1
+        counts[ties[:leftover - np.count_nonzero(above)]] += 1
+    return counts
+
+# splits pcpus fairly between vms, used before the simulation starts. returns {<cid>: <cpu count>, ...}
+def counts_initial(cids, total_cpus):
+    cids = list(cids)
+    counts = largest_remainder(np.ones(len(cids)), total_cpus)
+    return dict(zip(cids, counts.tolist()))
+
+# splits pcpus between vms in proportion to their current threads, each multiplied by the vm's weight in weights
+# ({<cid>: float, ...}, 1 if missing). when no vm runs threads, pcpus are split in proportion to the current counts.
+# returns {<cid>: <cpu count>, ...}
+def counts_proportional(snapshot, total_cpus, weights=None, floor=1):
+    cids = list(snapshot)
+    threads = np.fromiter((snapshot[cid]["threads"] for cid in cids), dtype=np.float64, count=len(cids))
+    current = np.fromiter((len(snapshot[cid]["vcpu_cpu_mapping"]) for cid in cids), dtype=np.int64, count=len(cids))
+    if weights:
+        threads *= np.fromiter((weights.get(cid, 1.0) for cid in cids), dtype=np.float64, count=len(cids))
+    demand = threads if threads.sum() > 0 else current
+    counts = largest_remainder(demand, total_cpus, floor, current)
+    return dict(zip(cids, counts.tolist()))
+
+# moves pcpus from vms well under their p95 latency target to vms over it. latencies is {<cid>: recent p95 in ms or
+# None} and targets is {<cid>: p95 target in ms or None}. a vm is over target when its latency exceeds the target and
+# well under it when its latency is below slack * target; vms without a target or a recent latency keep their count.
+# if total_cpus changed, pcpus are first taken from the vms with the most headroom or given to the ones under the most
+# pressure. no vm drops below floor pcpus, and moves change a vm by at most max_step pcpus per round.
+# returns {<cid>: <cpu count>, ...}
+def counts_slo(snapshot, latencies, targets, total_cpus, floor=1, max_step=2, slack=0.8):
+    counts = {cid: len(vm["vcpu_cpu_mapping"]) for (cid, vm) in snapshot.items()}
+
+    def pressure(cid):
+        if not targets.get(cid) or latencies.get(cid) is None:
+            return None
+        return latencies[cid] / targets[cid]
+
+    # vms without a pressure are treated as exactly on target
+    def order(cid):
+        p = pressure(cid)
+        return (1.0 if p is None else p, -counts[cid])
+
+    assigned = sum(counts.values())
+    while assigned > total_cpus:
+        candidates = [cid for cid in counts if counts[cid] > floor]
+        if not candidates:
+            break
+        counts[min(candidates, key=order)] -= 1
+        assigned -= 1
+    while counts and assigned < total_cpus:
+        counts[max(counts, key=order)] += 1
+        assigned += 1
+
+    steps = {cid: 0 for cid in counts}
+    while True:
+        receivers = [cid for cid in counts if pressure(cid) is not None and pressure(cid) > 1.0 and steps[cid] < max_step]
+        donors = [cid for cid in counts if pressure(cid) is not None and pressure(cid) < slack and counts[cid] > floor and steps[cid] > -max_step]
+        if not receivers or not donors:
+            break
+        receiver = max(receivers, key=pressure)
+        donor = min(donors, key=pressure)
+        counts[receiver] += 1
+        counts[donor] -= 1
+        steps[receiver] += 1
+        steps[donor] -= 1
+    return counts
+
+# diffs target counts against the current mappings. usable_cpus are the pcpus vms may be pinned on this round
+def diff_allocation(snapshot, counts, usable_cpus):
+    diff = { "resize": {}, "shrinks": [], "grows": [], "moves": {}, "targets": dict(counts), "usable_cpus": list(usable_cpus) }
+    usable = set(usable_cpus)
+    for (cid, cnt) in counts.items():
+        mapping = snapshot[cid]["vcpu_cpu_mapping"]
+        moves = {vcpu_id: cpu for (vcpu_id, cpu) in mapping.items() if cpu not in usable}
+        if moves:
+            diff["moves"][cid] = moves
+        if cnt != len(mapping):
+            diff["resize"][cid] = cnt
+            if cnt < len(mapping):
+                diff["shrinks"].append(cid)
+            else:
+                diff["grows"].append(cid)
+    return diff
+
+def is_empty(diff):
+    return not diff["resize"] and not diff["moves"]
+
+# returns the ways counts break the guarantees of the count functions, as messages; none if it keeps them
+def check_counts(counts, total_cpus, floor=1):
+    problems = []
+    low = [cid for (cid, cnt) in counts.items() if cnt < floor]
+    if low:
+        problems.append(f"vms {low} are below the floor of {floor} pcpus")
+    if counts and total_cpus >= floor * len(counts) and sum(counts.values()) != total_cpus:
+        problems.append(f"counts add up to {sum(counts.values())} pcpus instead of {total_cpus}")
+    return problems
+
+# returns {<cpu>: [<cid>, ...], ...} for every pcpu that more than one vm is pinned on
+def shared_cpus(snapshot):
+    owners = {}
+    for (cid, vm) in snapshot.items():
+        for cpu in set(vm["vcpu_cpu_mapping"].values()):
+            owners.setdefault(cpu, []).append(cid)
+    return {cpu: cids for (cpu, cids) in owners.items() if len(cids) > 1}
+
+# usable pcpus that no vm is pinned on, in usable_cpus order
+def free_cpus(snapshot, usable_cpus):
+    pinned = set()
+    for vm in snapshot.values():
+        pinned.update(vm["vcpu_cpu_mapping"].values())
+    return [cpu for cpu in usable_cpus if cpu not in pinned]
+
+# hands each vm the number of free pcpus it still needs to reach its target count. vms are served in cid order. with a
+# cpu topology from topology.read_topology, each vm's pcpus are placed compactly next to the ones it already has;
+# without one, vms receive consecutive free pcpus. returns {<cid>: [<cpu>, ...], ...}
+def reserve_cpus(snapshot, targets, free, usable_cpus, cpu_topology=None):
+    usable_cpus = set(usable_cpus)
+    free = list(free)
+    owners = {}
+    for (cid, vm) in snapshot.items():
+        for cpu in vm["vcpu_cpu_mapping"].values():
+            if cpu in usable_cpus:
+                owners[cpu] = cid
+
+    # without a topology the free list is consumed from the front; with one, picked pcpus are filtered out once per vm
+    reserved = {}
+    position = 0
+    for cid in sorted(targets):
+        mapping = snapshot[cid]["vcpu_cpu_mapping"]
+        kept = sum(1 for cpu in mapping.values() if cpu in usable_cpus)
+        need = max(targets[cid] - kept, 0)
+        if cpu_topology is None:
+            reserved[cid] = free[position:position + need]
+            position += len(reserved[cid])
+        elif need > 0:
+            reserved[cid] = topology.pick_cpus(cpu_topology, free, need, owners, cid)
+            picked = set(reserved[cid])
+            free = [cpu for cpu in free if cpu not in picked]
+        else:
+            reserved[cid] = []
+        for cpu in reserved[cid]:
+            owners[cpu] = cid
+    return reserved
+
+# matches a vm's online vcpus to pcpus. vcpus that are still online and pinned on a usable pcpu keep their pin; the
+# remaining vcpus take pcpus from new_cpus in order. with unpin_dropped, vcpus that left vcpu_ids are unpinned (None):
+# under cps they stay online outside the allowed set, and their old pin would share a pcpu that now goes to another
+# vm. returns (new mapping, pins that must be applied)
+def remap_vcpus(mapping, vcpu_ids, new_cpus, usable_cpus, unpin_dropped=False):
+    usable_cpus = set(usable_cpus)
+    online = set(vcpu_ids)
+    new_mapping = {}
+    pins = {}
+    for vcpu_id, cpu in mapping.items():
+        if vcpu_id in online and cpu in usable_cpus:
+            new_mapping[vcpu_id] = cpu
+        elif vcpu_id not in online and unpin_dropped:
+            pins[vcpu_id] = None
+
+    free_cpus = iter(new_cpus)
+    for vcpu_id in vcpu_ids:
+        if vcpu_id not in new_mapping:
+            cpu = next(free_cpus, None)
+            if cpu is None:
+                break
+            new_mapping[vcpu_id] = pins[vcpu_id] = cpu
+    return new_mapping, pins
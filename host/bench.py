@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import collections
+from datetime import datetime, timezone
+import utils
+import topology
+import protocol
+import hypervisor
+import events
+import allocator
+import policies
+import host
+
+# Measures the cost of the host's control plane: a vcpu_cnt_request round trip, a batch of vcpu pins on each
+# hypervisor backend, a whole allocation round as core_allocation_callback runs it, for varying vm and cpu counts, and
+# the policy's counts alone for thousands of vms.
+# Guests are in-memory fakes that answer over socketpairs with the real framing, the host's cpus come from a fake sysfs
+# tree, and pins go to hypervisor.FakeBackend. Real backends are measured when they are available: vsock loopback for
+# the round trip, and libvirt / virsh pins on the vm given with --vm (whose pins are reset afterwards).
+# The guest-side costs (hotplug, cps affinity, irq balancing) are measured by guest/bench.py, which writes the same
+# result format. `bench.py compare old.json new.json` reports results whose p95 regressed.
+#
+# Results are JSON: {"suite", "created", "platform", "results": [{"name", "backend", "params", "samples", "mean_ms",
+# "p50_ms", "p95_ms", "p99_ms", "max_ms"}, ...]}. A result is identified by its name, backend and params.
+VSOCK_CID_LOCAL = 1
+VSOCK_BENCH_PORT = 9998
+reader_tasks = [] # host.client_reader tasks of the fake guests set up by setup_host
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+# summarizes samples, given in seconds, as one result
+def summarize(name, backend, params, samples):
+    samples_ms = [sample * 1000 for sample in samples]
+    result = {
+        "name": name,
+        "backend": backend,
+        "params": params,
+        "samples": len(samples_ms),
+        "mean_ms": sum(samples_ms) / len(samples_ms),
+        "p50_ms": percentile(samples_ms, 50),
+        "p95_ms": percentile(samples_ms, 95),
+        "p99_ms": percentile(samples_ms, 99),
+        "max_ms": max(samples_ms),
+    }
+    print(f"{name:<28} {backend:<15} {json.dumps(params, sort_keys=True):<28} p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  p99 {result['p99_ms']:9.3f} ms")
+    return result
+
+# answers vcpu_cnt_request like a guest that onlines vcpus 0..n-1 instantly
+def fake_guest(sock):
+    conn = protocol.FramedSocket(sock)
+    while True:
+        try:
+            data = conn.recv()
+        except OSError:
+            return
+        if data is None:
+            return
+        if "vcpu_cnt_request" in data:
+            protocol.reply(conn, data, { "vcpu_ids": list(range(data["vcpu_cnt_request"])) })
+        else:
+            protocol.reply(conn, data, {})
+
+# a sysfs tree with n_cpus online cpus and no topology files
+def make_fake_sysfs(root, n_cpus):
+    cpu_dir = os.path.join(root, "devices/system/cpu")
+    os.makedirs(cpu_dir, exist_ok=True)
+    with open(os.path.join(cpu_dir, "online"), "w") as f:
+        f.write(f"0-{n_cpus - 1}\n")
+    return root
+
+# points the host module at n_vms fake guests, n_cpus fake pcpus and the fake hypervisor. the host's lock is
+# recreated, so that every setup may run in an event loop of its own
+async def setup_host(tmp_dir, n_vms, n_cpus):
+    host.runtime_vm_configs_lock = asyncio.Lock()
+    utils.cpu_inventory = topology.CpuInventory(make_fake_sysfs(os.path.join(tmp_dir, f"sysfs_{n_cpus}"), n_cpus))
+    host.backend = hypervisor.FakeBackend(default_vcpu_count=n_cpus)
+    host.event_log = events.EventLog(os.path.join(tmp_dir, "events.bin"))
+    host.config = [{"vm_cid": 100 + i, "vm_name": f"vm{i}"} for i in range(n_vms)]
+    host.vm_migration = False
+    host.policy = policies.make_policy("proportional", host.config)
+    host.runtime_vm_configs.clear()
+    host.conns.clear()
+    host.pending_requests.clear()
+    host.telemetry.clear()
+    for vm in host.config:
+        cid = vm["vm_cid"]
+        host_sock, guest_sock = socket.socketpair()
+        threading.Thread(target=fake_guest, args=(guest_sock,), daemon=True).start()
+        reader, writer = await asyncio.open_connection(sock=host_sock)
+        host.conns[cid] = protocol.AsyncFramedStream(reader, writer)
+        host.pending_requests[cid] = {}
+        host.telemetry[cid] = collections.deque(maxlen=host.TELEMETRY_SAMPLES)
+        host.runtime_vm_configs[cid] = {}
+        reader_tasks.append(host.spawn(host.client_reader(cid)))
+
+    # the initial fair split, as run_sim_mode does before the simulation starts
+    host.sim_started = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        await host.apply_vcpu_pinning(await host.adjust_pcpu_to_vm_mapping())
+    host.sim_started = True
+
+# closes the fake guests' connections and waits for their reader tasks, so the next setup starts from a clean host
+async def teardown_host():
+    for conn in host.conns.values():
+        conn.close()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*reader_tasks)
+    reader_tasks.clear()
+    host.event_log.close()
+
+async def bench_round_trip(tmp_dir, iterations):
+    await setup_host(tmp_dir, 1, 8)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await host.request(100, { "vcpu_cnt_request": 1 + i % 8 })
+        samples.append(time.perf_counter() - start)
+    await teardown_host()
+    return [summarize("vcpu_cnt_request_round_trip", "socketpair", {}, samples)]
+
+# the same round trip over a real vsock connection through the vsock_loopback transport, if the kernel has it
+def bench_round_trip_vsock(iterations):
+    try:
+        listener = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+        listener.bind((VSOCK_CID_LOCAL, VSOCK_BENCH_PORT))
+        listener.listen()
+        client = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
+        client.connect((VSOCK_CID_LOCAL, VSOCK_BENCH_PORT))
+        guest_sock, addr = listener.accept()
+    except (OSError, AttributeError) as e:
+        print(f"skipping vsock round trip: {e}")
+        return []
+    threading.Thread(target=fake_guest, args=(guest_sock,), daemon=True).start()
+    conn = protocol.FramedSocket(client)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        conn.send({ "vcpu_cnt_request": 1 + i % 8, "req_id": i })
+        conn.recv()
+        samples.append(time.perf_counter() - start)
+    conn.close()
+    listener.close()
+    return [summarize("vcpu_cnt_request_round_trip", "vsock-loopback", {}, samples)]
+
+async def bench_pins(backend, vm_name, vcpus, iterations, batch_sizes):
+    results = []
+    for batch in batch_sizes:
+        if batch > vcpus:
+            continue
+        samples = []
+        for i in range(iterations):
+            pins = {vcpu_id: (vcpu_id + i) % vcpus for vcpu_id in range(batch)}
+            samples.append(await backend.pin_vcpus(vm_name, pins))
+        results.append(summarize("vcpu_pin_batch", backend.name, {"pins": batch}, samples))
+    await backend.pin_vcpus(vm_name, {vcpu_id: None for vcpu_id in range(vcpus)})
+    return results
+
+# one round of core_allocation_callback after the wait: plan on a snapshot and apply the diff. every round draws new
+# threads for every vm, so most rounds change the allocation; rounds whose plan is empty are measured as skipped
+async def bench_allocation_round(tmp_dir, n_vms, n_cpus, iterations):
+    await setup_host(tmp_dir, n_vms, n_cpus)
+    rng = random.Random(n_vms * 1000 + n_cpus)
+    samples = []
+    for i in range(iterations):
+        for cid in host.runtime_vm_configs:
+            host.runtime_vm_configs[cid]["threads"] = rng.randint(1, 40)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            diff = await host.adjust_pcpu_to_vm_mapping()
+            if not allocator.is_empty(diff):
+                await host.apply_vcpu_pinning(diff)
+        samples.append(time.perf_counter() - start)
+        host.backend.batches.clear()
+    await teardown_host()
+    return [summarize("allocation_round", "fake", {"vms": n_vms, "cpus": n_cpus}, samples)]
+
+# a snapshot of n_vms vms with random threads, each pinned on its share of n_cpus pcpus
+def random_snapshot(rng, n_vms, n_cpus):
+    counts = allocator.counts_initial(range(n_vms), n_cpus)
+    snapshot = {}
+    cpu = 0
+    for cid in range(n_vms):
+        snapshot[cid] = {"threads": rng.choice([0, rng.randint(1, 64)]), "vcpu_cpu_mapping": {}}
+        for vcpu_id in range(counts[cid]):
+            snapshot[cid]["vcpu_cpu_mapping"][vcpu_id] = cpu % n_cpus
+            cpu += 1
+    return snapshot
+
+# the policy's counts for one round of n_vms vms with random threads on n_cpus pcpus, without applying it
+def bench_policy_counts(name, n_vms, n_cpus, iterations):
+    rng = random.Random(n_vms * 1000 + n_cpus)
+    policy = policies.make_policy(name, [{"vm_cid": cid} for cid in range(n_vms)])
+    samples = []
+    for i in range(iterations):
+        current = random_snapshot(rng, n_vms, n_cpus)
+        start = time.perf_counter()
+        policy.counts(current, n_cpus)
+        samples.append(time.perf_counter() - start)
+    return [summarize("policy_counts", name, {"vms": n_vms, "cpus": n_cpus}, samples)]
+
+async def run_suite(args):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results += await bench_round_trip(tmp_dir, args.iterations)
+        results += await asyncio.to_thread(bench_round_trip_vsock, args.iterations)
+
+        results += await bench_pins(hypervisor.FakeBackend(), "fake", 16, args.iterations, args.pin_batches)
+        if args.vm:
+            for name in ("libvirt", "virsh"):
+                try:
+                    backend = hypervisor.make_backend(name)
+                except Exception as e:
+                    print(f"skipping {name} pins: {e}")
+                    continue
+                vcpus = await backend.vcpu_count(args.vm)
+                results += await bench_pins(backend, args.vm, vcpus, args.real_iterations, args.pin_batches)
+
+        for n_vms in args.vms:
+            for n_cpus in args.cpus:
+                if n_cpus >= n_vms:
+                    results += await bench_allocation_round(tmp_dir, n_vms, n_cpus, args.round_iterations)
+        for n_vms in args.policy_vms:
+            for n_cpus in args.policy_cpus:
+                results += bench_policy_counts("proportional", n_vms, n_cpus, args.round_iterations)
+    return results
+
+def write_results(path, suite, results):
+    report = {
+        "suite": suite,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "kernel": platform.release(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {len(results)} results to {path}")
+
+def result_key(result):
+    return (result["name"], result["backend"], json.dumps(result["params"], sort_keys=True))
+
+# prints every result of new next to the same result in old. returns the results whose p95 grew by more than threshold
+def compare(old_path, new_path, threshold):
+    with open(old_path, "r") as f:
+        old = {result_key(result): result for result in json.load(f)["results"]}
+    with open(new_path, "r") as f:
+        new = json.load(f)["results"]
+    regressions = []
+    for result in new:
+        before = old.get(result_key(result))
+        if before is None:
+            print(f"{result['name']:<28} {result['backend']:<15} {json.dumps(result['params'], sort_keys=True):<28} new")
+            continue
+        change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] > 0 else 0.0
+        flag = "REGRESSION" if change > threshold else ""
+        print(f"{result['name']:<28} {result['backend']:<15} {json.dumps(result['params'], sort_keys=True):<28} p95 {before['p95_ms']:9.3f} -> {result['p95_ms']:9.3f} ms ({change:+.1%}) {flag}")
+        if flag:
+            regressions.append(result)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="bench", description="benchmarks the host's control plane")
+    subparsers = parser.add_subparsers(required=True, dest="mode")
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--output", default="bench_host.json", help="where to write the results")
+    run_parser.add_argument("--iterations", type=int, default=500, help="samples per round trip and fake pin benchmark")
+    run_parser.add_argument("--round-iterations", type=int, default=50, help="samples per allocation round benchmark")
+    run_parser.add_argument("--real-iterations", type=int, default=20, help="samples per real hypervisor pin benchmark")
+    run_parser.add_argument("--vms", type=int, nargs="+", default=[2, 8, 32])
+    run_parser.add_argument("--cpus", type=int, nargs="+", default=[8, 64, 256])
+    run_parser.add_argument("--policy-vms", type=int, nargs="+", default=[32, 1000, 4000], help="vm counts of the policy_counts benchmark")
+    run_parser.add_argument("--policy-cpus", type=int, nargs="+", default=[512, 8192])
+    run_parser.add_argument("--pin-batches", type=int, nargs="+", default=[1, 4, 16])
+    run_parser.add_argument("--vm", help="name of a real vm to measure libvirt and virsh pins on; its pins are reset afterwards")
+    compare_parser = subparsers.add_parser("compare", help="compare two result files, from this script or guest/bench.py")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="relative p95 growth reported as a regression")
+    args = parser.parse_args()
+
+    if args.mode == "run":
+        write_results(args.output, "host", asyncio.run(run_suite(args)))
+    elif args.mode == "compare":
+        sys.exit(1 if compare(args.old, args.new, args.threshold) else 0)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import sys
+import asyncio
+import argparse
+import itertools
+import protocol
+
+# Coordinates UFO allocation across several hosts. Each host runs an agent (`host.py sim --agent-socket PATH`, or
+# agent.py's fake host) and the coordinator polls all of them over their unix sockets, see agent.py for the requests.
+# A host's pressure is the threads its vms run per pcpu it hands out; once a host's pressure exceeds --saturation, the
+# coordinator looks for vms to move to hosts that stay at or below it and prints them as recommendations. With
+# --trigger it also carries them out: the source agent live-migrates the vm and the destination agent adopts it. A move
+# is only triggered if the destination's status says it adopts vms; a real host.py does not, so a vm is never left
+# unmanaged on it.
+#
+# To try it on one machine, start fake agents on configs whose vms have distinct cids and point the coordinator at
+# their sockets:
+#   python3 agent.py a.json --socket /tmp/a.sock --name a --cpus 4 &
+#   python3 agent.py b.json --socket /tmp/b.sock --name b --cpus 16 &
+#   python3 coordinator.py /tmp/a.sock /tmp/b.sock --interval 1 --trigger
+request_ids = itertools.count(1)
+
+
+# One agent connection. The coordinator has at most one request in flight per agent, so a reply is simply the next
+# frame with the request's id
+class AgentConnection:
+    def __init__(self, path, conn):
+        self.path = path
+        self.conn = conn
+
+    @classmethod
+    async def open(cls, path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        return cls(path, protocol.AsyncFramedStream(reader, writer))
+
+    async def request(self, msg):
+        req_id = next(request_ids)
+        await self.conn.send({**msg, "req_id": req_id})
+        while True:
+            resp = await self.conn.recv()
+            if resp is None:
+                raise ConnectionError(f"agent at {self.path} disconnected")
+            if resp.get("req_id") == req_id:
+                return resp
+
+    def close(self):
+        self.conn.close()
+
+
+def host_threads(status):
+    return sum(vm["threads"] for vm in status["vms"])
+
+def host_pressure(threads, total_cpus):
+    return threads / total_cpus if total_cpus > 0 else float("inf")
+
+# plans up to max_moves migrations from hosts above saturation. each move takes the vm and destination that leave the
+# lowest pressure on the source and destination together, among destinations that stay at or below saturation, and
+# is planned against the demand left by the previous moves. statuses are agent status replies. returns
+# [{"cid", "vm_name", "threads", "source", "dest", "dest_uri", "dest_adopts", "source_pressure", "peak_pressure"}, ...]
+def plan_migrations(statuses, saturation=1.0, max_moves=1):
+    threads = {status["host"]: host_threads(status) for status in statuses}
+    cpus = {status["host"]: status["total_cpus"] for status in statuses}
+    uris = {status["host"]: status["migration_uri"] for status in statuses}
+    adopts = {status["host"]: status.get("adopt", False) for status in statuses}
+    vms = {status["host"]: list(status["vms"]) for status in statuses}
+    moves = []
+    while len(moves) < max_moves and threads:
+        pressures = {host: host_pressure(threads[host], cpus[host]) for host in threads}
+        source = max(pressures, key=pressures.get)
+        if pressures[source] <= saturation:
+            break
+
+        best = None
+        for vm in vms[source]:
+            if vm["threads"] <= 0:
+                continue
+            for dest in threads:
+                if dest == source or cpus[dest] <= 0:
+                    continue
+                dest_pressure = host_pressure(threads[dest] + vm["threads"], cpus[dest])
+                if dest_pressure > saturation:
+                    continue
+                peak = max(host_pressure(threads[source] - vm["threads"], cpus[source]), dest_pressure)
+                if best is None or peak < best[0]:
+                    best = (peak, vm, dest)
+        if best is None:
+            break
+
+        peak, vm, dest = best
+        moves.append({"cid": vm["cid"], "vm_name": vm["vm_name"], "threads": vm["threads"], "source": source, "dest": dest,
+                      "dest_uri": uris[dest], "dest_adopts": adopts[dest], "source_pressure": pressures[source], "peak_pressure": peak})
+        vms[source].remove(vm)
+        vms[dest].append(vm)
+        threads[source] -= vm["threads"]
+        threads[dest] += vm["threads"]
+    return moves
+
+def print_cluster(statuses):
+    total_threads = sum(host_threads(status) for status in statuses)
+    total_cpus = sum(status["total_cpus"] for status in statuses)
+    print(f"cluster: {len(statuses)} hosts, {total_threads} threads on {total_cpus} pcpus (pressure {host_pressure(total_threads, total_cpus):.2f})")
+    for status in statuses:
+        threads = host_threads(status)
+        vms = ", ".join(f"{vm['cid']}: {vm['threads']} threads on {vm['cpus']} pcpus" for vm in status["vms"])
+        print(f"  {status['host']}: {threads} threads on {status['total_cpus']} pcpus (pressure {host_pressure(threads, status['total_cpus']):.2f}) [{vms}]")
+
+# asks the source agent to migrate the vm and the destination agent to adopt it. a destination that does not adopt
+# vms is refused before anything moves, and an agent that disconnects is dropped from agents
+async def trigger_migration(agents, move):
+    if not move["dest_adopts"]:
+        print(f"not moving vm {move['cid']}: {move['dest']} does not adopt vms")
+        return False
+    if move["source"] not in agents or move["dest"] not in agents:
+        return False
+
+    host = move["source"]
+    try:
+        resp = await agents[host].request({"migrate": {"cid": move["cid"], "dest_uri": move["dest_uri"]}})
+        if "error" in resp:
+            print(f"{move['source']} could not migrate vm {move['cid']}: {resp['error']}")
+            return False
+        print(f"{move['source']} migrated vm {move['cid']} to {move['dest']} in {resp['elapsed_ms']:.2f} ms")
+        host = move["dest"]
+        resp = await agents[host].request({"adopt": resp["vm"]})
+    except OSError as e:
+        print(f"dropping agent {host}: {e}")
+        agents.pop(host).close()
+        return False
+    if "error" in resp:
+        print(f"{move['dest']} could not adopt vm {move['cid']}: {resp['error']}")
+        return False
+    return True
+
+# polls the agents every interval seconds until every agent has disconnected or rounds rounds have run
+async def coordinate(paths, interval=5.0, saturation=1.0, max_moves=1, trigger=False, rounds=None):
+    connections = await asyncio.gather(*(AgentConnection.open(path) for path in paths))
+    for round in itertools.count():
+        if rounds is not None and round >= rounds:
+            break
+        connections = [connection for connection in connections if connection is not None]
+        if not connections:
+            print("every agent has disconnected")
+            break
+        replies = await asyncio.gather(*(connection.request({"status": True}) for connection in connections), return_exceptions=True)
+        statuses = []
+        agents = {} # {<host>: AgentConnection} of the agents that answered this round
+        for (i, reply) in enumerate(replies):
+            if isinstance(reply, Exception):
+                print(f"dropping agent at {connections[i].path}: {reply}")
+                connections[i].close()
+                connections[i] = None
+            else:
+                statuses.append(reply)
+                agents[reply["host"]] = connections[i]
+
+        print_cluster(statuses)
+        for move in plan_migrations(statuses, saturation, max_moves):
+            print(f"recommend moving vm {move['cid']} ({move['vm_name']}, {move['threads']} threads) from {move['source']} (pressure {move['source_pressure']:.2f}) to {move['dest']} (peak pressure after {move['peak_pressure']:.2f})")
+            if trigger:
+                await trigger_migration(agents, move)
+        await asyncio.sleep(interval)
+
+    for connection in connections:
+        if connection is not None:
+            connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="coordinator", description="balances ufo hosts by recommending or triggering vm migrations")
+    parser.add_argument("agent_sockets", nargs="+", help="unix sockets of the host agents")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between polls of the agents")
+    parser.add_argument("--saturation", type=float, default=1.0, help="threads per pcpu above which a host is saturated")
+    parser.add_argument("--max-moves", type=int, default=1, help="most migrations planned per poll")
+    parser.add_argument("--trigger", action="store_true", help="carry out planned migrations instead of only recommending them")
+    parser.add_argument("--rounds", type=int, help="stop after this many polls")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(coordinate(args.agent_sockets, args.interval, args.saturation, args.max_moves, args.trigger, args.rounds))
+    except KeyboardInterrupt:
+        sys.exit(0)
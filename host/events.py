@@ -0,0 +1,136 @@
+import sys
+import time
+import struct
+import atexit
+import argparse
+import threading
+from datetime import datetime, timezone
+
+# Structured event log. Every event is one fixed-size little-endian record
+#   ts_ns (int64)  kind (int32)  cid (int32)  a (int32)  b (int32)  value (float64)
+# after a header holding the wall clock and the monotonic clock at the time the log was opened, so monotonic
+# timestamps can be turned back into wall time. A log is loaded as a numpy structured array with load(), without any
+# parsing. Records are buffered in memory and written in chunks of buffer_records. Opening a log truncates it, so each
+# run writes its own file.
+#
+# What a, b and value hold depends on kind:
+#   ALLOCATION       a: planned vcpu count   b: vcpu count before the round   value: pcpus usable this round
+#   RESIZE_REQUEST   a: requested vcpus      b: vcpus before the request
+#   RESIZE_REPLY     a: vcpus online         b: vcpus requested               value: round trip in ms
+#   PIN              a: vcpus pinned                                          value: hypervisor time in ms
+#   PIN_VCPU         a: vcpu                 b: pcpu, -1 to unpin
+#   WORKLOAD         a: threads              b: interval (seconds or requests)
+#   WORKLOAD_SAMPLE  a: threads              b: second of the run             value: latency in ms reported by the tool
+#   THROUGHPUT       a: threads              b: second of the run             value: events or requests per second
+#   REACTION         a: 1 if the round changed the allocation                 value: demand change to pins applied in ms
+#   TOTAL_CPU        a: pcpus the host hands out
+#   TIMELINE         a: timeline event index b: timeline.KINDS index          value: ms dispatched after its deadline
+#   WORKLOAD_DONE    a: threads              b: exit status                   value: cpu time of the benchmark in ms
+MAGIC = b"UFOEVT1\0"
+HEADER = struct.Struct("<8sqq8x")
+RECORD = struct.Struct("<qiiiid")
+RECORD_DTYPE = [("ts_ns", "<i8"), ("kind", "<i4"), ("cid", "<i4"), ("a", "<i4"), ("b", "<i4"), ("value", "<f8")]
+
+ALLOCATION = 1
+RESIZE_REQUEST = 2
+RESIZE_REPLY = 3
+PIN = 4
+PIN_VCPU = 5
+WORKLOAD = 6
+WORKLOAD_SAMPLE = 7
+THROUGHPUT = 8
+REACTION = 9
+TOTAL_CPU = 10
+TIMELINE = 11
+WORKLOAD_DONE = 12
+KIND_NAMES = {
+    ALLOCATION: "allocation", RESIZE_REQUEST: "resize_request", RESIZE_REPLY: "resize_reply", PIN: "pin",
+    PIN_VCPU: "pin_vcpu", WORKLOAD: "workload", WORKLOAD_SAMPLE: "workload_sample", THROUGHPUT: "throughput",
+    REACTION: "reaction", TOTAL_CPU: "total_cpu", TIMELINE: "timeline", WORKLOAD_DONE: "workload_done",
+}
+
+
+class EventLog:
+    def __init__(self, path, buffer_records=4096):
+        self.path = path
+        self.buffer_records = buffer_records
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        self.count = 0
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, time.time_ns(), time.monotonic_ns()))
+        self.file.flush()
+        atexit.register(self.close)
+
+    def record(self, kind, cid=0, a=0, b=0, value=0.0):
+        packed = RECORD.pack(time.monotonic_ns(), kind, cid, a, b, value)
+        with self.lock:
+            self.buffer += packed
+            self.count += 1
+            if self.count >= self.buffer_records:
+                self._write()
+
+    def _write(self):
+        if self.buffer and not self.file.closed:
+            self.file.write(self.buffer)
+            self.file.flush()
+        self.buffer = bytearray()
+        self.count = 0
+
+    def flush(self):
+        with self.lock:
+            self._write()
+
+    def close(self):
+        with self.lock:
+            self._write()
+            if not self.file.closed:
+                self.file.close()
+
+# returns (header, records) where header is {"wall_ns": int, "monotonic_ns": int} and records a numpy structured array
+# with the fields of RECORD_DTYPE
+def load(path):
+    import numpy as np
+    with open(path, "rb") as f:
+        magic, wall_ns, monotonic_ns = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not an event log")
+    records = np.fromfile(path, dtype=np.dtype(RECORD_DTYPE), offset=HEADER.size)
+    return {"wall_ns": wall_ns, "monotonic_ns": monotonic_ns}, records
+
+# same as load, but yields records as tuples and does not need numpy
+def iter_records(path):
+    with open(path, "rb") as f:
+        magic, wall_ns, monotonic_ns = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an event log")
+        while True:
+            chunk = f.read(RECORD.size * 4096)
+            if not chunk:
+                break
+            yield from RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % RECORD.size])
+
+def _header(path):
+    with open(path, "rb") as f:
+        magic, wall_ns, monotonic_ns = HEADER.unpack(f.read(HEADER.size))
+    return wall_ns, monotonic_ns
+
+# writes a log as text: one event per line, or the lines of the old cores_log ("[time] cid: X pcpu:N", one per resize
+# request) that the graph scripts read
+def dump(path, out, cores_log=False):
+    wall_ns, monotonic_ns = _header(path)
+    for (ts_ns, kind, cid, a, b, value) in iter_records(path):
+        wall = datetime.fromtimestamp((wall_ns + ts_ns - monotonic_ns) / 1e9, tz=timezone.utc)
+        if cores_log:
+            if kind == RESIZE_REQUEST:
+                out.write(f"{wall.strftime('[%Y-%m-%d %H:%M:%S]')} cid: {cid} pcpu:{a}\n")
+        else:
+            out.write(f"{wall.strftime('%Y-%m-%d %H:%M:%S.%f')} {ts_ns} {KIND_NAMES.get(kind, kind)} cid:{cid} a:{a} b:{b} value:{value:.3f}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="events", description="prints an event log as text")
+    parser.add_argument("event_log")
+    parser.add_argument("--cores-log", action="store_true", help="print resize requests in the old cores_log format")
+    args = parser.parse_args()
+    dump(args.event_log, sys.stdout, args.cores_log)
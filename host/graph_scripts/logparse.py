@@ -0,0 +1,159 @@
+import os
+import re
+import mmap
+import numpy as np
+
+# Parses the logs of an experiment into numpy arrays for the graph scripts:
+#   sysbench   the guest's sysbench cpu output, one sample per second
+#   mutex      the guest's stress-ng --mutex output, one summary per run
+#   redis      the guest's redis-benchmark output: the carriage-return separated progress stream and the per-test summary
+#   loadgen    the guest's loadgen.py output, one sample of latency percentiles per second
+#   cores      the host's cores_log (or `events.py --cores-log` output)
+# Each file is memory-mapped and scanned with one compiled regex, so it is never split into python lines. Parsed arrays
+# are cached next to the log in <log>.parsed.npz together with the log's size and mtime; a log is only reparsed when
+# it changes.
+PARSER_VERSION = 3
+KINDS = ["sysbench", "mutex", "redis", "loadgen", "cores"]
+
+# the guest writes this line before every workload it runs; redis runs give requests instead of an interval
+RUN_HEADER = rb"(?P<header>Sysbench is running in the background with the following parameters: (?:interval|requests)=(?P<length>\d+), threads=(?P<threads>\d+))"
+# ts wrote whole seconds; the guest's workload runner adds nanoseconds, which the parsed times keep
+TIMESTAMP = rb"\[(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d{1,9})?)\]"
+
+PATTERNS = {
+    "sysbench": re.compile(RUN_HEADER + rb"|(?:" + TIMESTAMP + rb" )?\[ *(?P<second>\d+)s \] thds: (?P<thds>\d+) eps: (?P<eps>[\d.]+) .*?lat \(ms,95%\): (?P<p95>[\d.]+)"),
+    "mutex": re.compile(RUN_HEADER + rb"|metrc: \[\d+\] mutex +(?P<ops>\d+) +(?P<real>[\d.]+) +(?P<usr>[\d.]+) +(?P<sys>[\d.]+) +(?P<rate>[\d.]+) +(?P<cpu_rate>[\d.]+)"),
+    "redis": re.compile(RUN_HEADER
+                        + rb"|(?P<test>[A-Z_]+): rps=(?P<rps>[\d.]+) \(overall: [\d.]+\) avg_msec=(?P<avg>[\d.]+)"
+                        + rb"|====== (?P<summary_test>[A-Z_]+) ======"
+                        + rb"|throughput summary: (?P<throughput>[\d.]+) requests per second\s+latency summary \(msec\):\s+avg\s+min\s+p50\s+p95\s+p99\s+max\s+"
+                        + rb"(?P<lat_avg>[\d.]+)\s+(?P<lat_min>[\d.]+)\s+(?P<lat_p50>[\d.]+)\s+(?P<lat_p95>[\d.]+)\s+(?P<lat_p99>[\d.]+)\s+(?P<lat_max>[\d.]+)"),
+    "loadgen": re.compile(RUN_HEADER + rb"|(?:" + TIMESTAMP + rb" )?\[ *(?P<second>\d+)s \] thds: (?P<thds>\d+) ops/s: (?P<ops>[\d.]+) "
+                          + rb"lat \(ms\): p50 (?P<p50>[\d.]+) p95 (?P<p95>[\d.]+) p99 (?P<p99>[\d.]+) p999 (?P<p999>[\d.]+) max (?P<max>[\d.]+)"),
+    "cores": re.compile(TIMESTAMP + rb" cid: (?P<cid>\d+) pcpu: ?(?P<pcpu>\d+)"),
+}
+
+# guesses the kind of a log from its first 64 KiB
+def sniff(data):
+    head = bytes(data[:65536])
+    if b"lat (ms,95%)" in head:
+        return "sysbench"
+    if b"lat (ms): p50" in head:
+        return "loadgen"
+    if b"stress-ng" in head:
+        return "mutex"
+    if b"rps=" in head or b"requests=" in head:
+        return "redis"
+    if b"cid: " in head:
+        return "cores"
+    raise ValueError("unknown log format")
+
+def _times(values):
+    return np.array([value.decode() if value else "NaT" for value in values], dtype="datetime64[ns]")
+
+# returns {<field>: array, ...}. every sample has the index of the run it belongs to and that run's thread count;
+# samples before the first run header belong to run -1
+def _parse(data, kind):
+    columns = {}
+    def add(**fields):
+        for (name, value) in fields.items():
+            columns.setdefault(name, []).append(value)
+
+    run = -1
+    threads = 0
+    summary_test = b""
+    for match in PATTERNS[kind].finditer(data):
+        if kind != "cores" and match.group("header"):
+            run += 1
+            threads = int(match.group("threads"))
+        elif kind == "sysbench":
+            add(run=run, threads=int(match.group("thds")), time=match.group("time"), second=int(match.group("second")),
+                eps=float(match.group("eps")), p95_ms=float(match.group("p95")))
+        elif kind == "loadgen":
+            add(run=run, threads=int(match.group("thds")), time=match.group("time"), second=int(match.group("second")),
+                ops_per_s=float(match.group("ops")), p50_ms=float(match.group("p50")), p95_ms=float(match.group("p95")),
+                p99_ms=float(match.group("p99")), p999_ms=float(match.group("p999")), max_ms=float(match.group("max")))
+        elif kind == "mutex":
+            add(run=run, threads=threads, bogo_ops=int(match.group("ops")), real_s=float(match.group("real")),
+                ops_per_s=float(match.group("rate")), ops_per_s_cpu=float(match.group("cpu_rate")))
+        elif kind == "redis" and match.group("test"):
+            add(run=run, threads=threads, test=match.group("test").decode(), rps=float(match.group("rps")),
+                avg_ms=float(match.group("avg")))
+        elif kind == "redis" and match.group("summary_test"):
+            summary_test = match.group("summary_test")
+        elif kind == "redis":
+            add(summary_run=run, summary_threads=threads, summary_test=summary_test.decode(),
+                summary_rps=float(match.group("throughput")), summary_avg_ms=float(match.group("lat_avg")),
+                summary_p50_ms=float(match.group("lat_p50")), summary_p95_ms=float(match.group("lat_p95")),
+                summary_p99_ms=float(match.group("lat_p99")), summary_max_ms=float(match.group("lat_max")))
+        elif kind == "cores":
+            add(time=match.group("time"), cid=int(match.group("cid")), pcpu=int(match.group("pcpu")))
+
+    fields = {
+        "sysbench": ["run", "threads", "time", "second", "eps", "p95_ms"],
+        "mutex": ["run", "threads", "bogo_ops", "real_s", "ops_per_s", "ops_per_s_cpu"],
+        "loadgen": ["run", "threads", "time", "second", "ops_per_s", "p50_ms", "p95_ms", "p99_ms", "p999_ms", "max_ms"],
+        "redis": ["run", "threads", "test", "rps", "avg_ms", "summary_run", "summary_threads", "summary_test",
+                  "summary_rps", "summary_avg_ms", "summary_p50_ms", "summary_p95_ms", "summary_p99_ms", "summary_max_ms"],
+        "cores": ["time", "cid", "pcpu"],
+    }[kind]
+    arrays = {}
+    for name in fields:
+        values = columns.get(name, [])
+        if name == "time":
+            arrays[name] = _times(values)
+        elif name in ("test", "summary_test"):
+            arrays[name] = np.array(values, dtype=str)
+        elif name in ("run", "threads", "second", "bogo_ops", "cid", "pcpu", "summary_run", "summary_threads"):
+            arrays[name] = np.array(values, dtype=np.int64)
+        else:
+            arrays[name] = np.array(values, dtype=np.float64)
+    return arrays
+
+def _cache_key(stat):
+    return np.array([PARSER_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def _load_cache(cache_path, key, kind):
+    try:
+        with np.load(cache_path, allow_pickle=False) as cached:
+            if not np.array_equal(cached["_key"], key) or (kind is not None and str(cached["_kind"]) != kind):
+                return None
+            return {name: cached[name] for name in cached.files if not name.startswith("_")}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _save_cache(cache_path, key, kind, arrays):
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, _key=key, _kind=np.array(kind), **arrays)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"could not cache parsed log at {cache_path}: {e}")
+
+# parses the log at path into {<field>: numpy array, ...}. kind is one of KINDS and is guessed from the log if not given.
+# with cache, arrays are read from and written to <path>.parsed.npz
+def load(path, kind=None, cache=True):
+    stat = os.stat(path)
+    key = _cache_key(stat)
+    cache_path = f"{path}.parsed.npz"
+    if cache:
+        arrays = _load_cache(cache_path, key, kind)
+        if arrays is not None:
+            return arrays
+
+    with open(path, "rb") as f:
+        if stat.st_size == 0:
+            data = b""
+        else:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            kind = kind or sniff(data)
+            arrays = _parse(data, kind)
+        finally:
+            if stat.st_size != 0:
+                data.close()
+
+    if cache:
+        _save_cache(cache_path, key, kind, arrays)
+    return arrays
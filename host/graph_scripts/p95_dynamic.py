@@ -1,34 +1,27 @@
 import argparse
+import numpy as np
 import matplotlib.pyplot as plt
-import re
+import logparse
         
 def parse_files(file_paths):
     """Parse the latency data from the given files."""
     data = []
-    pattern = r'\[([\d\-:\s]+)\].*lat \(ms,95%\): ([\d.]+)'
-
     for file_path in file_paths:
-        times = []
-        latencies = []
-        with open(file_path, 'r') as file:
-            for line in file:
-                match = re.search(pattern, line)
-                if match:
-                    times.append(match.group(1))
-                    latencies.append(float(match.group(2)))
-        data.append((times, latencies))
+        samples = logparse.load(file_path, "sysbench")
+        data.append((samples["time"], samples["p95_ms"], samples["run"]))
     return data
 
 def plot_data(data, colors, output_file, scheduler):
     """Plot the latency data."""
     plt.figure(figsize=(10, 6))
-    for i, (times, latencies) in enumerate(data):
+    for i, (times, latencies, runs) in enumerate(data):
         plt.plot(latencies, color=colors[i], label=scheduler[i])
         print(latencies)
 
-    plt.axvline(x=19, color='black', linestyle='--', alpha=0.6, label='Workload Change')
-    plt.axvline(x=38, color='black', linestyle='--', alpha=0.6, label='Workload Change')
-    plt.axvline(x=57, color='black', linestyle='--', alpha=0.6, label='Workload Change')
+    # every sysbench run is one slice of the workload timeline, so a workload change is where the first file's run changes
+    runs = data[0][2]
+    for (i, x) in enumerate(np.flatnonzero(np.diff(runs)) + 1):
+        plt.axvline(x=x, color='black', linestyle='--', alpha=0.6, label='Workload Change' if i == 0 else None)
 
 
     # Add labels and title
@@ -1,22 +1,13 @@
 import argparse
 import matplotlib.pyplot as plt
-import re
+import logparse
         
 def parse_files(file_paths):
     """Parse the latency data from the given files."""
     data = []
-    pattern = r'\[([\d\-:\s]+)\].*lat \(ms,95%\): ([\d.]+)'
-
     for file_path in file_paths:
-        times = []
-        latencies = []
-        with open(file_path, 'r') as file:
-            for line in file:
-                match = re.search(pattern, line)
-                if match:
-                    times.append(match.group(1))
-                    latencies.append(float(match.group(2)))
-        data.append((times, latencies))
+        samples = logparse.load(file_path, "sysbench")
+        data.append((samples["time"], samples["p95_ms"]))
     return data
 
 def plot_data(data, colors, output_file, scheduler):
@@ -1,31 +1,19 @@
 import sys
 import matplotlib.pyplot as plt
 import pandas as pd
+import logparse
 
 
 # Function to parse logs and create a DataFrame
 def parse_latency_logs(log_file):
-    data = []
-    with open(log_file, 'r') as file:
-        for line in file:
-            parts = line.split('lat (ms,95%):')
-            if len(parts) == 2:
-                timestamp = parts[0].split(']')[0].strip('[').strip()
-                latency = float(parts[1].strip())
-                data.append((timestamp, latency))
-    return pd.DataFrame(data, columns=['timestamp', 'latency'])
+    samples = logparse.load(log_file, "sysbench")
+    return pd.DataFrame({'timestamp': samples['time'], 'latency': samples['p95_ms']})
 
 # Function to parse CPU logs and create a DataFrame
 def parse_cpu_logs(log_file, cid):
-    data = []
-    with open(log_file, 'r') as file:
-        for line in file:
-            if f'cid: {cid}' in line:
-                parts = line.strip().split()
-                timestamp = f"{parts[0].strip('[')} {parts[1].strip(']')}"
-                cpu_count = int(parts[-1].split(':')[-1]) * 10
-                data.append((timestamp, cpu_count))
-    return pd.DataFrame(data, columns=['timestamp', 'cpu_count'])
+    cores = logparse.load(log_file, "cores")
+    vm = cores['cid'] == cid
+    return pd.DataFrame({'timestamp': cores['time'][vm], 'cpu_count': cores['pcpu'][vm] * 10})
 
 # Read logs for CID 35 and CID 36
 def generate_graph(cores_log_file, log_35_file, log_36_file, folder):
@@ -34,12 +22,6 @@ def generate_graph(cores_log_file, log_35_file, log_36_file, folder):
 	cpu_logs_35 = parse_cpu_logs(cores_log_file, 35)
 	cpu_logs_36 = parse_cpu_logs(cores_log_file, 36)
 
-	# Merge latency and CPU logs on timestamp
-	log_35['timestamp'] = pd.to_datetime(log_35['timestamp'], format='%Y-%m-%d %H:%M:%S')
-	log_36['timestamp'] = pd.to_datetime(log_36['timestamp'], format='%Y-%m-%d %H:%M:%S')
-	cpu_logs_35['timestamp'] = pd.to_datetime(cpu_logs_35['timestamp'], format='%Y-%m-%d %H:%M:%S')
-	cpu_logs_36['timestamp'] = pd.to_datetime(cpu_logs_36['timestamp'], format='%Y-%m-%d %H:%M:%S')
-
 	# Merge latency and CPU logs using nearest timestamp
 	log_35 = pd.merge_asof(log_35.sort_values('timestamp'), 
 						cpu_logs_35.sort_values('timestamp'), 
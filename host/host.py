@@ -2,107 +2,132 @@
 
 import socket
 import argparse
+import asyncio
 import json
-import random
 import time
-from datetime import datetime
-import threading
 import utils
-import math
 import sys
-import copy
+import itertools
+import collections
+import protocol
+import hypervisor
+import allocator
+import topology
+import events
+import metrics
+import policies
+import agent
+import timeline
 
 CID = socket.VMADDR_CID_HOST
 PORT = 9999
 config = None # same as config.json passed
-log_fds = {} # {<cid>: log_fd, ...}
-conns = {} # {<cid>: conn, ....}
-runtime_vm_configs = {} # {<cid>: { cpus: [<cpu1>, ...], vcpu_cpu_mapping: {<vcpu1: cpu2, ...}, threads: int}, ...}
-runtime_vm_configs_lock = threading.Lock()
-reader_cv = {} # condition variables to handle reading of data from each guest vm
-reader_cv_data = {}
+conns = {} # {<cid>: protocol.AsyncFramedStream, ....}
+runtime_vm_configs = {} # {<cid>: { cpus: [<cpu1>, ...], vcpu_cpu_mapping: {<vcpu1: cpu2, ...}, vcpu_ids: [<online vcpu>, ...], threads: int}, ...}
+runtime_vm_configs_lock = asyncio.Lock()
+pending_requests = {} # {<cid>: {<req_id>: asyncio.Future, ...}, ...}
+telemetry = {} # {<cid>: deque of the guest's latest per-second workload samples, see record_telemetry}
+TELEMETRY_SAMPLES = 300 # samples kept per vm
+TELEMETRY_WINDOW = 5.0 # seconds of samples averaged by current_workload_stats
+request_ids = itertools.count(1)
+background_tasks = set() # keeps fire-and-forget tasks alive until they finish
 sim_started = False
-total_cpu = len(utils.get_cpu_list())
+total_cpu = len(utils.get_cpu_list()) # reset in run_sim_mode once --sysfs-root is known
 vm_migration = False
-log_file = "cores_log"
+event_log = None # events.EventLog of allocation decisions, resizes, pins and reactions, opened by run_sim_mode
 sched = "ufo"
-
-# allows a thread to retrieve data that is meant for it
-def get_reader_cv_data(cid, req_key):
-    resp = {}
-    while not resp:
-        with reader_cv[cid]:
-            while not reader_cv_data[cid]:
-                reader_cv[cid].wait()
-
-            if req_key in reader_cv_data[cid]:
-                resp = copy.deepcopy(reader_cv_data[cid])
-                reader_cv_data[cid] = {}
-    # print(f"debugging: with req_key {req_key}, see data {resp}")
-    return resp
-
-def reset_vcpu_pins(config, vm_cid):
+ALLOCATING_SCHEDS = ["ufo", "cps"] # schedulers driven by the host's allocation loop; rorke follows fixed "cores" schedules
+backend = None # hypervisor backend used to query and pin vcpus, see hypervisor.py
+demand_changed = asyncio.Event() # set whenever a vm's threads or the host's total_cpu changes
+demand_events = [] # [(<time.perf_counter() of change>, <description>), ...] not yet handled by an allocation round
+reallocation_debounce = 0.25 # seconds to wait after a demand change for further changes before reallocating
+reallocation_max_period = 5.0 # seconds after which a round runs even if no demand change was seen
+policy = None # policies.Policy that splits and places pcpus once the simulation runs, built by run_sim_mode
+slo_floor = 1 # slo: fewest pcpus a vm is left with
+slo_max_step = 2 # slo: most pcpus a vm gains or loses in one round
+slo_slack = 0.8 # slo: vms below slack * target give pcpus to vms over target
+timeline_scheduler = None # timeline.TimelineScheduler dispatching every vm's workload timeline, built by run_sim_mode
+running_workloads = collections.Counter() # {<cid>: workloads sent to the vm that have not completed}
+allocation_round_lock = asyncio.Lock() # held for a whole allocation round, so a migration never removes a vm mid-round
+host_name = socket.gethostname() # reported to the coordinator, see agent.py
+migration_uri = f"qemu+ssh://{socket.gethostname()}/system" # where other hosts' agents migrate vms to this host
+
+# All of the host's state is owned by a single asyncio event loop: one task per guest connection reader, the workload
+# timeline with a task per event in flight, plus the allocation loop. Nothing here is touched from other threads.
+
+# schedules coro on the event loop without waiting for it
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# sends a request to the guest vm at cid and returns a future that resolves to the guest's reply.
+# several requests may be in flight per vm; client_reader matches replies back using req_id. a request that could not be
+# sent, or whose send was cancelled, is forgotten before the error is raised
+async def send_request(cid, msg):
+    future = asyncio.get_running_loop().create_future()
+    req_id = next(request_ids)
+    pending_requests[cid][req_id] = future
+    try:
+        await conns[cid].send({**msg, "req_id": req_id})
+    except BaseException:
+        pending_requests[cid].pop(req_id, None)
+        raise
+    return future
+
+# sends a request to the guest vm at cid and waits for its reply
+async def request(cid, msg):
+    return await (await send_request(cid, msg))
+
+async def reset_vcpu_pins(config, vm_cid):
     print(f"vm {vm_cid}, resetting all vcpu pins")
-    vm_config = utils.get_vm_config_by_cid(config, vm_cid)
-    vm_name = vm_config["vm_name"]
-    
     # get count of vcpus of vm
-    cmd = f"sudo virsh vcpucount {vm_name}"
-    output = utils.run_command(cmd)
-    vcpu_count = next(int(word) for word in output.split() if word.isdigit())
+    vcpu_count = await backend.vcpu_count(get_vm_name(vm_cid))
 
     # turn on every vcpu
     msg = { "vcpu_cnt_request": vcpu_count }
-    conns[vm_cid].sendall(json.dumps(msg).encode())
-    
-    # guest vm returns adjusted vcpu_id
-    resp = get_reader_cv_data(vm_cid, "vcpu_ids")
-    vcpu_ids = resp["vcpu_ids"]
-   
+
+    # wait for the guest to bring them online
+    await request(vm_cid, msg)
+
     # reset all vcpus
-    for i in range(vcpu_count):
-        cmd = f"sudo virsh vcpupin {vm_name} {i} r"
-        print(f"Running: {cmd}")
-        utils.run_command(cmd)
+    await pin_vcpus(vm_cid, {i: None for i in range(vcpu_count)})
 
 # initializes a guest vm
-def init_guest(conn, cid, sched):
-    global log_fds
+async def init_guest(conn, cid, sched):
     global conns
     global config
-    
-    # create log file handler for vm
-    log_fd = open(f"./logs/log_{cid}", "a")
-    log_fds[cid] = log_fd
 
     # save conn in a global variable
     conns[cid] = conn
 
-    # set up condition variables for reading
-    reader_cv_data[cid] = {}
-    reader_cv[cid] = threading.Condition()
+    # set up table of requests awaiting a reply
+    pending_requests[cid] = {}
+    telemetry[cid] = collections.deque(maxlen=TELEMETRY_SAMPLES)
 
-    # set up reading thread 
-    t = threading.Thread(target=client_reader, args=(cid,), daemon=True)
-    t.start()
+    # set up reading task
+    spawn(client_reader(cid))
 
-    if sched == "ufo":
+    if sched in ALLOCATING_SCHEDS:
         # reset all vcpu pins
-        reset_vcpu_pins(config, cid)
+        await reset_vcpu_pins(config, cid)
 
     # create runtime_config for vm
-    with runtime_vm_configs_lock:
-        runtime_config = runtime_vm_configs[cid] = {}
+    async with runtime_vm_configs_lock:
+        runtime_vm_configs[cid] = {}
 
 
-# Only for UFO! This adjusts the core assignment mapping, but does not actually change core allocation. It occurs at start of simulation and periodically thereafter
-def adjust_pcpu_to_vm_mapping():
+# UFO and CPS only! This plans the core assignment, but does not actually change core allocation. It occurs at start of simulation and periodically thereafter.
+# The plan is computed by allocator.py on a snapshot taken under runtime_vm_configs_lock and returned as a diff against the current vcpu_cpu_mapping
+async def adjust_pcpu_to_vm_mapping():
     global config
     global runtime_vm_configs
     global sim_started
     global total_cpu
     global vm_migration
     global sched
+    global policy
 
     cpu_list = utils.get_cpu_list()
     if vm_migration:
@@ -114,276 +139,430 @@ def adjust_pcpu_to_vm_mapping():
 
     if total_vms == 0 or total_cpus == 0:
         print("No VMs or CPUs available for assignment")
-    
-    # if the simulation has not started, we simply assign pcpus fairly to each vm
-    if not sim_started:
-        cpu_idx = 0
-        for vm in config:
-            cpus_req = total_cpus // total_vms
-            with runtime_vm_configs_lock:
-                runtime_config = runtime_vm_configs.setdefault(vm["vm_cid"], {})
-                runtime_config["cpus"] = cpu_list[cpu_idx: cpu_idx+cpus_req]
-            cpu_idx += cpus_req
-        
-        return
-
-    # if the simulation has started, we should assign pcpus to each vm according to their current load or max_threads
-    elif sim_started:
-        
-        # calculate allocation required for each vm
-        with runtime_vm_configs_lock:
-            total_threads = sum(runtime_config["threads"] for runtime_config in runtime_vm_configs.values())
-            cnt_cpus_req = {}
-            for (cid, runtime_config) in runtime_vm_configs.items():
-                cnt_cpus_req[cid] = math.floor((runtime_config["threads"] / total_threads) * total_cpus)
-            
-            extras = 0
-            for (cid, cpu_req) in cnt_cpus_req.items():
-                if cpu_req == 0:
-                    cnt_cpus_req[cid] = 1
-                    extras += 1
-
-            for (cid, cpu_req) in cnt_cpus_req.items():
-                if extras > 0 and cnt_cpus_req[cid] > 1:
-                    cnt_cpus_req[cid] -= 1
-                    extras -= 1
-            
-            # spare cpus initialized to cpus that have not been pinned previously
-            if vm_migration:
-                spare_cpus = utils.get_cpu_list()[:total_cpus]
-                print(f"adjust_pcpu_to_vm_mapping spare_cpus set to {spare_cpus}")
-            else:
-                spare_cpus = utils.get_cpu_list()
-
-            for runtime_config in runtime_vm_configs.values():
-                for cpu in runtime_config["cpus"]:
-                    if cpu in spare_cpus:
-                        spare_cpus.remove(cpu)
-            
-           # add to spare cpus if cpu is no longer required
-            for (cid, runtime_config) in runtime_vm_configs.items():
-                while len(runtime_config["cpus"]) > cnt_cpus_req[cid]:
-                    cpu = runtime_config["cpus"].pop()
-                    if cpu < total_cpus:
-                        spare_cpus.append(cpu)
-
-            # distribute spare cpus
-            if vm_migration:
-                print(f"adjust_pcpu_to_vm_mapping spare_cpus left {spare_cpus}")
-
-            for (cid, runtime_config) in runtime_vm_configs.items():
-                while len(runtime_config["cpus"]) < cnt_cpus_req[cid]:
-                    runtime_config["cpus"].append(spare_cpus.pop())
-            
-
-#changing the total_cpu to change the number of pcpu and vcpu
-def simulate_cores(cores):
-    global total_cpu
-    global vm_migration
-    global sched
-
-    print(f"Starting simulate cores and cores is none: {cores is None}")
-    if cores is None or sched == "rorke":
-        return 
-    for slice in cores:
-        time.sleep(slice["time"])
-        if vm_migration:
-            total_cpu = slice["pcpu"]
-
-def simulate_vcpu_cores(cores):
-    global vm_migration
-    global sched 
-
-    if cores is None or vm_migration != True or sched != "rorke":
-        return
-    print("starting simulate_vcpu_cores")
-
-    for slice in cores:
-        time.sleep(slice["time"])
-        msg1 = { "vcpu_cnt_request": slice["35"] }
-        msg2 = { "vcpu_cnt_request": slice["36"] }
 
-        conns[35].sendall(json.dumps(msg1).encode())
-        conns[36].sendall(json.dumps(msg2).encode())
+    async with runtime_vm_configs_lock:
+        current = allocator.snapshot(runtime_vm_configs)
 
-        resp_35 = get_reader_cv_data(35, "vcpu_ids")
-        resp_36 = get_reader_cv_data(36, "vcpu_ids")
-
-        print("vcpu_modification rorke 35", resp_35)
-        print("vcpu_modification rorke 36", resp_36)
-
-# Only for UFO! Adjust number of vcpus to match pcpu and then apply cpu pinning. Note UFO's assumption is that 1 vcpu maps to 1 cpu.
-def apply_vcpu_pinning():
-    global conns
-    global sim_started
+    # if the simulation has not started, we simply assign pcpus fairly to each vm
+    if not sim_started:
+        counts = allocator.counts_initial([vm["vm_cid"] for vm in config], total_cpus)
+    # otherwise the policy splits pcpus, e.g. by each vm's current threads or its streamed p95 against its target
+    else:
+        counts = policy.counts(current, total_cpus)
+    for problem in allocator.check_counts(counts, total_cpus, policy.floor):
+        print(f"Logical error to fix: {problem}")
+        metrics.errors.inc(kind="allocation_counts")
+
+    for (cid, cnt) in counts.items():
+        event_log.record(events.ALLOCATION, cid, cnt, len(current[cid]["vcpu_cpu_mapping"]), total_cpus)
+    return allocator.diff_allocation(current, counts, cpu_list[:total_cpus])
+
+
+# UFO and CPS only! Apply a diff from adjust_pcpu_to_vm_mapping: adjust number of vcpus to match pcpu and then apply cpu pinning. Note UFO's assumption is that 1 vcpu maps to 1 cpu.
+# vms are resized and re-pinned concurrently without holding runtime_vm_configs_lock. shrinking vms are applied first;
+# the pcpus they free are then reserved for growing vms and moved vcpus, so that a pcpu is never pinned to two vms at once
+async def apply_vcpu_pinning(diff):
     global runtime_vm_configs
-    global log_file
 
-    # if the simulation has not started, we need to 1. adjust vcpu count 2. create vcpu_cpu_mapping 3. apply vcpu pinning
-    if not sim_started:
-        with runtime_vm_configs_lock:
-            for (cid, runtime_config) in runtime_vm_configs.items():
-                # adjust vcpu count on guest vm
-                msg = { "vcpu_cnt_request": len(runtime_config["cpus"]) }
-                conns[cid].sendall(json.dumps(msg).encode())
-                with open(f"./logs/{log_file}.txt", "a") as log_file_writer:
-                    utc_timestamp = datetime.utcnow().strftime("[%Y-%m-%d %H:%M:%S]")
-                    log_file_writer.write(f"{utc_timestamp} cid: {cid} pcpu:{len(runtime_config["cpus"])}\n")
-
-                # guest vm returns adjusted vcpu_id
-                resp = get_reader_cv_data(cid, "vcpu_ids")
-                vcpu_ids = resp["vcpu_ids"]
-               
-                print(f"vcpu_ids {vcpu_ids}")
-                # create key for vm in vcpu_cpu_mapping
-                runtime_config["vcpu_cpu_mapping"] = {}
-                for i, vcpu_id in enumerate(vcpu_ids):
-                    cpu = runtime_config["cpus"][i]
-                    runtime_config["vcpu_cpu_mapping"][vcpu_id] = cpu
-                    pin_vcpu_on_cpu(cid, vcpu_ids[i], cpu)
-
-
-    # if the simulation has already started, we need to 1. adjust vcpu count 2. vcpu_ids are misaligned with vcpu_cpu_mapping, adjust mapping 3. pin newly-added vcpus on spare cpus
-    elif sim_started:
-        with runtime_vm_configs_lock:
-            # adjust vcpu count of each vm to match cpu count
-            for cid, runtime_config in runtime_vm_configs.items():
-                # adjust vcpu count on guest vm
-                msg = { "vcpu_cnt_request": len(runtime_config["cpus"]) }
-                conns[cid].sendall(json.dumps(msg).encode())
-                with open(f"./logs/{log_file}.txt", "a") as log_file_writer:
-                    utc_timestamp = datetime.utcnow().strftime("[%Y-%m-%d %H:%M:%S]")
-                    log_file_writer.write(f"{utc_timestamp} cid: {cid} pcpu:{len(runtime_config["cpus"])}\n")
-
-                # guest vm returns adjusted vcpu_id
-                resp = get_reader_cv_data(cid, "vcpu_ids")
-                vcpu_ids = resp["vcpu_ids"]
-
-                # variable initializations
-                vm_vcpu_cpu_mapping = runtime_config["vcpu_cpu_mapping"]
-                vm_vcpu_cpu_mapping_new = copy.deepcopy(vm_vcpu_cpu_mapping)
-                allocated_cpu_ids = copy.deepcopy(runtime_config["cpus"])
-                vcpu_ids_that_req_pinning = []
-                
-                # for vcpus that have been unplugged, remove them from mapping. the vcpus in new map is now a subset of vcpu_ids
-                for vcpu_id in vm_vcpu_cpu_mapping.keys():
-                    if vcpu_id not in vcpu_ids:
-                        del vm_vcpu_cpu_mapping_new[vcpu_id]
-                
-                # identify newly added vcpus and cpus that are available to pin
-                for vcpu_id in vcpu_ids:
-                    if vcpu_id in vm_vcpu_cpu_mapping_new:
-                        allocated_cpu_ids.remove(vm_vcpu_cpu_mapping_new[vcpu_id])
-                    else:
-                        vcpu_ids_that_req_pinning.append(vcpu_id)
-                
-                # match the newly added vcpus to available cpus
-                for i, vcpu_id in enumerate(vcpu_ids_that_req_pinning):
-                    vm_vcpu_cpu_mapping_new[vcpu_id] = allocated_cpu_ids[i] 
-                    pin_vcpu_on_cpu(cid, vcpu_id, allocated_cpu_ids[i])
-
-                runtime_config["vcpu_cpu_mapping"] = vm_vcpu_cpu_mapping_new
-
-                # verification
-                if len(vcpu_ids_that_req_pinning) != len(allocated_cpu_ids):
-                    print(f"Logical error to fix: unable to match cpus to vcpus!")
-                
-                mapping = runtime_config["vcpu_cpu_mapping"]
-                if len(mapping) != len(vcpu_ids) or len(mapping) != len(runtime_config["cpus"]):
-                    print(f"Logical error to fix: mismatch is size between mapping and vcpu/cpu count!")
-                
-                for vcpu_id, cpu_id in mapping.items():
-                    if vcpu_id not in vcpu_ids or cpu_id not in runtime_config["cpus"]:
-                        print(f"Logical error to fix: vcpu or cpu found in mapping, but not allocated!")
-                        break
-
-
-# Only for UFO!
-def pin_vcpu_on_cpu(vm_cid, vcpu_id, pcpu_id):
+    start = time.perf_counter()
+    usable_cpus = diff["usable_cpus"]
+    latencies = {}
+
+    # shrinking vms only offline vcpus; their remaining vcpus keep their pins
+    results = await asyncio.gather(*(apply_vm_allocation(cid, diff["resize"][cid], [], usable_cpus) for cid in diff["shrinks"]))
+    latencies.update(zip(diff["shrinks"], results))
+
+    # growing vms and vms with moved vcpus take pcpus that are now free
+    async with runtime_vm_configs_lock:
+        current = allocator.snapshot(runtime_vm_configs)
+    free = allocator.free_cpus(current, usable_cpus)
+    phase = diff["grows"] + [cid for cid in diff["moves"] if cid not in diff["grows"]]
+    reserved = policy.place(current, {cid: diff["targets"][cid] for cid in phase}, free, usable_cpus, utils.cpu_inventory.topology())
+    # shrinking vms with moved vcpus were already resized above and are only re-pinned here
+    resizes = {cid: None if cid in diff["shrinks"] else diff["resize"].get(cid) for cid in phase}
+    results = await asyncio.gather(*(apply_vm_allocation(cid, resizes[cid], reserved[cid], usable_cpus) for cid in phase))
+    for (cid, elapsed) in zip(phase, results):
+        latencies[cid] = latencies.get(cid, 0.0) + elapsed
+
+    # verification
+    async with runtime_vm_configs_lock:
+        for cid in latencies:
+            runtime_config = runtime_vm_configs[cid]
+            if len(runtime_config["vcpu_cpu_mapping"]) != len(runtime_config["vcpu_ids"]):
+                print("Logical error to fix: unable to match cpus to vcpus!")
+                metrics.errors.inc(kind="unmatched_vcpus")
+            if len(runtime_config["vcpu_ids"]) != diff["targets"][cid]:
+                print("Logical error to fix: mismatch is size between mapping and vcpu/cpu count!")
+                metrics.errors.inc(kind="vcpu_count_mismatch")
+        for (cpu, cids) in allocator.shared_cpus(allocator.snapshot(runtime_vm_configs)).items():
+            if cpu in usable_cpus:
+                print(f"Logical error to fix: pcpu {cpu} is pinned by vms {cids}")
+                metrics.errors.inc(kind="shared_pcpu")
+
+    total = time.perf_counter() - start
+    per_vm = ", ".join(f"{cid}: {elapsed * 1000:.2f} ms" for (cid, elapsed) in latencies.items())
+    print(f"applied allocation to {len(latencies)} vms in {total * 1000:.2f} ms (shrinks: {diff['shrinks']}, grows: {diff['grows']}, moves: {diff['moves']}) [{per_vm}]")
+    return latencies
+
+# resizes one vm to vcpu_cnt vcpus (None leaves its vcpu count alone) and pins vcpus that have no usable pcpu onto
+# new_cpus, returning how long it took
+async def apply_vm_allocation(cid, vcpu_cnt, new_cpus, usable_cpus):
+
+    start = time.perf_counter()
+    async with runtime_vm_configs_lock:
+        mapping = dict(runtime_vm_configs[cid].get("vcpu_cpu_mapping", {}))
+        vcpu_ids = list(runtime_vm_configs[cid].get("vcpu_ids", mapping.keys()))
+
+    if vcpu_cnt is not None:
+        # adjust vcpu count on guest vm
+        msg = { "vcpu_cnt_request": vcpu_cnt }
+        future = await send_request(cid, msg)
+        event_log.record(events.RESIZE_REQUEST, cid, vcpu_cnt, len(vcpu_ids))
+
+        # guest vm returns adjusted vcpu_id
+        resp = await future
+        vcpu_ids = resp["vcpu_ids"]
+        round_trip_ms = (time.perf_counter() - start) * 1000
+        event_log.record(events.RESIZE_REPLY, cid, len(vcpu_ids), vcpu_cnt, round_trip_ms)
+        metrics.resize_seconds.observe(round_trip_ms / 1000, cid=cid)
+        hotplug = resp.get("hotplug")
+        if hotplug:
+            print(f"vm {cid}: resize round trip {round_trip_ms:.2f} ms, guest hotplug {hotplug['hotplug_ms']:.2f} ms, guest overhead {hotplug['overhead_ms']:.2f} ms, per cpu online {hotplug['online_ms']} offline {hotplug['offline_ms']}")
+
+    # vcpu_ids may be misaligned with vcpu_cpu_mapping: keep pins that are still valid and pin the other vcpus on new_cpus.
+    # cps vcpus dropped from the allowed set stay online and are unpinned
+    new_mapping, pins = allocator.remap_vcpus(mapping, vcpu_ids, new_cpus, usable_cpus, unpin_dropped=sched == "cps")
+    await pin_vcpus(cid, pins)
+
+    async with runtime_vm_configs_lock:
+        runtime_vm_configs[cid]["vcpu_cpu_mapping"] = new_mapping
+        runtime_vm_configs[cid]["cpus"] = sorted(new_mapping.values())
+        runtime_vm_configs[cid]["vcpu_ids"] = vcpu_ids
+    metrics.vm_cores.set(len(set(new_mapping.values())), cid=cid)
+
+    return time.perf_counter() - start
+
+
+def get_vm_name(vm_cid):
     global config
-    vm_config = utils.get_vm_config_by_cid(config, vm_cid)
-    vm_name = vm_config["vm_name"]
-    cmd = f"sudo virsh vcpupin {vm_name} {vcpu_id} {pcpu_id}"
-    print(f"Running: {cmd}")
-    utils.run_command(cmd)
-
-
-# Only for UFO! A callback that runs every 5 seconds to redistribute cores to vms
-def core_allocation_callback():
+    return utils.get_vm_config_by_cid(config, vm_cid)["vm_name"]
+
+# UFO and CPS only! Applies pins ({<vcpu_id>: <pcpu_id or None>, ...}) for one vm as a single batch and reports its duration
+async def pin_vcpus(vm_cid, pins):
+    global backend
+    if not pins:
+        return 0.0
+    elapsed = await backend.pin_vcpus(get_vm_name(vm_cid), pins)
+    event_log.record(events.PIN, vm_cid, len(pins), 0, elapsed * 1000)
+    metrics.pin_seconds.observe(elapsed, cid=vm_cid, backend=backend.name)
+    for (vcpu_id, cpu) in pins.items():
+        event_log.record(events.PIN_VCPU, vm_cid, vcpu_id, -1 if cpu is None else cpu)
+    print(f"vm {vm_cid}: {backend.name} pinned {len(pins)} vcpus in {elapsed * 1000:.2f} ms: {pins}")
+    return elapsed
+
+
+# records a change in demand and wakes up the allocation loop
+def notify_demand_change(description):
+    demand_events.append((time.perf_counter(), description))
+    demand_changed.set()
+
+# waits until demand changes, then for the debounce window so that a burst of changes is handled by one round.
+# returns after reallocation_max_period if demand does not change
+async def wait_for_demand_change():
+    try:
+        await asyncio.wait_for(demand_changed.wait(), timeout=reallocation_max_period)
+    except asyncio.TimeoutError:
+        return
+    await asyncio.sleep(reallocation_debounce)
+
+# records, for every demand change handled by the round that just finished, the time from the change to pins applied
+def record_reaction_times(changes, applied):
+    now = time.perf_counter()
+    for (changed_at, description) in changes:
+        reaction_ms = (now - changed_at) * 1000
+        print(f"demand change ({description}) handled in {reaction_ms:.2f} ms")
+        event_log.record(events.REACTION, 0, int(applied), 0, reaction_ms)
+        metrics.reaction_seconds.observe(reaction_ms / 1000)
+
+# UFO and CPS only! Redistributes cores to vms whenever demand changes, debounced by reallocation_debounce, and at least
+# every reallocation_max_period seconds
+async def core_allocation_callback():
     global runtime_vm_configs
+    global demand_events
     while True:
-        adjust_pcpu_to_vm_mapping()
-        apply_vcpu_pinning()
-        print(f"runtime_vm_configs (during callback): {runtime_vm_configs}")
-        time.sleep(5.0) 
-
-# changes the level of simulation workload on the vm at cid 
-def adjust_workload(max_threads, percentage_load, interval, cid, cores = None, workload = "sysbench"):
-    global log_fds
-    global conns
-    global vm_migration
-    log_fd = log_fds[cid]
-
-    if cores is not None and vm_migration:
-        core_t = threading.Thread(target=simulate_cores, args=(cores,))
-        core_t.start()
+        await wait_for_demand_change()
+        demand_changed.clear()
+        changes, demand_events = demand_events, []
+
+        start = time.perf_counter()
+        async with allocation_round_lock:
+            diff = await adjust_pcpu_to_vm_mapping()
+            metrics.allocation_rounds.inc()
+            # rounds that change nothing cost no guest round trips
+            if allocator.is_empty(diff):
+                print("allocation unchanged, skipping round")
+                metrics.allocation_rounds_skipped.inc()
+            else:
+                await apply_vcpu_pinning(diff)
+                print(f"runtime_vm_configs (during callback): {runtime_vm_configs}")
+        metrics.allocation_round_seconds.observe(time.perf_counter() - start)
+        print(f"workload telemetry: {current_workload_stats()}")
+        record_reaction_times(changes, not allocator.is_empty(diff))
+
+# starts a workload on the vm at cid and returns when the guest replies that it completed
+async def adjust_workload(cid, threads, interval, workload="sysbench"):
+    # the previous slice's workload should have completed by this slice's deadline
+    if running_workloads[cid] > 0:
+        print(f"vm with cid:{cid} is still running its previous workload, starting the next one alongside it")
+        metrics.workload_overruns.inc(cid=cid)
 
     # run workload on guest vm
-    new_workload = int(max_threads*percentage_load)
-    msg = { "threads": new_workload, "interval": interval, "workload": workload }
+    msg = { "threads": threads, "interval": interval, "workload": workload }
     print(f"sent to vm with cid: {cid}, msg: {msg}")
-    conns[cid].sendall(json.dumps(msg).encode())
-
-
+    future = await send_request(cid, msg)
+    event_log.record(events.WORKLOAD, cid, threads, interval)
+    metrics.vm_threads.set(threads, cid=cid)
+    running_workloads[cid] += 1
 
     # track the new workload on vm
-    with runtime_vm_configs_lock:
-        runtime_vm_configs[cid]["threads"] = new_workload
+    async with runtime_vm_configs_lock:
+        changed = runtime_vm_configs[cid].get("threads") != threads
+        runtime_vm_configs[cid]["threads"] = threads
+    if changed:
+        notify_demand_change(f"cid: {cid} threads: {threads}")
 
     # guest vm replies when workload is completed
-    print(f"waiting {percentage_load} for workload to complete")
-    resp = get_reader_cv_data(cid, "workload_completed")
-    print(f"vm with cid:{cid} completed workload with response:{resp}, continuing to next workload")
-
-
-def sim_workload(max_threads, slices, cid):
-    global vm_migration
-    global sched 
-
-    for slice in slices:
-        if slice["type"] == "repeater":
-            cnt = slice["cnt"]
-            for i in range(cnt):
-                sim_workload(max_threads, slice["slices"], cid)
-        elif slice["type"] == "time_slice":
-            cores = slice.get("cores", None)
-            if cores is not None and vm_migration:
-                print(f"cores is not None")
-            workload = slice.get("workload", "sysbench")
-            print(f"workload is {workload}")
-            if vm_migration and sched == "rorke" and cores is not None:
-                print("triggered simulate_vcpu_cores thread")
-                vcpu_thread = threading.Thread(target=simulate_vcpu_cores, args=(cores,))
-                vcpu_thread.start()
-            adjust_workload(max_threads, slice["percentage_load"], slice["interval"], cid, cores, workload)
-
-
-def run_sim(cid):
+    try:
+        resp = await future
+    finally:
+        running_workloads[cid] -= 1
+    print(f"vm with cid:{cid} completed workload with response:{resp}")
+
+# changes the pcpus the host hands out. ufo and cps only, when vm_migration is set
+def set_total_cpu(pcpu):
+    global total_cpu
+    total_cpu = pcpu
+    event_log.record(events.TOTAL_CPU, 0, total_cpu)
+    metrics.total_cpus.set(total_cpu)
+    notify_demand_change(f"total_cpu: {total_cpu}")
+
+# rorke only! resizes vms directly to counts ({<cid>: <vcpus>, ...}), all resizes in flight at once
+async def resize_vcpus(counts):
+    for (cid, cnt) in counts.items():
+        event_log.record(events.RESIZE_REQUEST, cid, cnt)
+    start = time.perf_counter()
+    resps = await asyncio.gather(*(request(cid, {"vcpu_cnt_request": cnt}) for (cid, cnt) in counts.items()))
+    round_trip_ms = (time.perf_counter() - start) * 1000
+    for ((cid, cnt), resp) in zip(counts.items(), resps):
+        event_log.record(events.RESIZE_REPLY, cid, len(resp["vcpu_ids"]), cnt, round_trip_ms)
+        print(f"vcpu_modification rorke {cid}", resp)
+
+# dispatches one event of the compiled workload timeline, see timeline.py. lateness is the seconds between the event's
+# deadline and now
+async def run_timeline_event(event, lateness):
+    event_log.record(events.TIMELINE, event["cid"], event["index"], timeline.KINDS.index(event["kind"]), lateness * 1000)
+    metrics.timeline_lateness_seconds.observe(lateness, kind=event["kind"])
+    if event["kind"] == "workload":
+        await adjust_workload(event["cid"], event["threads"], event["interval"], event["workload"])
+    elif event["kind"] == "total_cpu":
+        set_total_cpu(event["pcpu"])
+    elif event["kind"] == "vcpu_cnt":
+        await resize_vcpus(event["counts"])
+
+
+# reads replies from the guest vm at cid and resolves the future of the request each reply answers
+async def client_reader(cid):
+    global conns
+    while True:
+        try:
+            resp = await conns[cid].recv()
+        except (OSError, ValueError) as e:
+            print(f"vm with cid:{cid} connection error: {e}")
+            metrics.errors.inc(kind="connection")
+            resp = None
+
+        if resp is None:
+            print(f"vm with cid:{cid} disconnected, failing its pending requests")
+            for future in pending_requests[cid].values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"vm with cid:{cid} disconnected"))
+            pending_requests[cid].clear()
+            return
+
+        if "telemetry" in resp:
+            record_telemetry(cid, resp["telemetry"])
+            continue
+
+        future = pending_requests[cid].pop(resp.get("req_id"), None)
+        if future is None or future.done():
+            print(f"vm with cid:{cid} sent a reply to no pending request: {resp}")
+            continue
+        if "error" in resp:
+            print(f"vm with cid:{cid} reported error: {resp['error']}")
+            metrics.errors.inc(kind="guest")
+        future.set_result(resp)
+
+
+# keeps a workload sample streamed by the guest at cid: {"workload", "second", "threads", "latency_ms", "throughput"},
+# where latency_ms is the p95 of sysbench and loadgen and None for stress-ng and redis-benchmark. redis-benchmark only
+# reports an average, which its samples carry as latency_avg_ms, so the slo policy never compares it to a p95 target
+def record_telemetry(cid, sample):
+    sample["received"] = time.perf_counter()
+    telemetry[cid].append(sample)
+    event_log.record(events.THROUGHPUT, cid, sample["threads"], sample["second"], sample["throughput"])
+    metrics.vm_throughput.set(sample["throughput"], cid=cid)
+    if sample["latency_ms"] is not None:
+        event_log.record(events.WORKLOAD_SAMPLE, cid, sample["threads"], sample["second"], sample["latency_ms"])
+        metrics.vm_latency_ms.set(sample["latency_ms"], cid=cid)
+
+# the latency and throughput of every vm, averaged over the samples it streamed in the last window seconds.
+# returns {<cid>: {"latency_ms": float or None, "throughput": float or None, "samples": int}, ...}
+def current_workload_stats(window=TELEMETRY_WINDOW):
+    now = time.perf_counter()
+    stats = {}
+    for (cid, samples) in telemetry.items():
+        recent = [sample for sample in samples if now - sample["received"] <= window]
+        latencies = [sample["latency_ms"] for sample in recent if sample["latency_ms"] is not None]
+        stats[cid] = {
+            "latency_ms": sum(latencies) / len(latencies) if latencies else None,
+            "throughput": sum(sample["throughput"] for sample in recent) / len(recent) if recent else None,
+            "samples": len(recent),
+        }
+    return stats
+
+# {<cid>: recent latency in ms or None, ...}, read by the slo policy once per round
+def workload_latencies():
+    return {cid: stats["latency_ms"] for (cid, stats) in current_workload_stats().items()}
+
+
+# this host's vms and their demand, as reported to the coordinator. see agent.py for the format
+def agent_status():
+    stats = current_workload_stats()
+    vms = []
+    for vm in config:
+        cid = vm["vm_cid"]
+        runtime_config = runtime_vm_configs.get(cid, {})
+        vms.append({"cid": cid, "vm_name": vm["vm_name"], "threads": runtime_config.get("threads", 0),
+                    "cpus": len(runtime_config.get("vcpu_cpu_mapping", {})), "latency_ms": stats.get(cid, {}).get("latency_ms")})
+    total_cpus = total_cpu if vm_migration else len(utils.get_cpu_list())
+    return {"host": host_name, "total_cpus": total_cpus, "migration_uri": migration_uri, "adopt": False, "vms": vms}
+
+# live-migrates the vm at cid to dest_uri for the coordinator and drops it from this host. its workload events are
+# stopped first, since the guest's vsock connection does not survive the migration
+async def migrate_vm(cid, dest_uri):
     global config
     vm_config = utils.get_vm_config_by_cid(config, cid)
-    max_threads = vm_config["workload_config"]["max_threads"]
-    slices = vm_config["workload_config"]["slices"]
-    sim_workload(max_threads, slices, cid)
-
-
-def client_reader(cid):
-    global conns
+    if vm_config is None:
+        return {"error": f"no vm with cid {cid} on {host_name}"}
+
+    async with allocation_round_lock:
+        await asyncio.gather(*timeline_scheduler.drop_vm(cid), return_exceptions=True)
+        elapsed = await backend.migrate_vm(vm_config["vm_name"], dest_uri)
+        async with runtime_vm_configs_lock:
+            runtime_config = runtime_vm_configs.pop(cid, {})
+        config = [vm for vm in config if vm["vm_cid"] != cid]
+        conns[cid].close()
+        telemetry.pop(cid, None)
+        for gauge in (metrics.vm_cores, metrics.vm_threads, metrics.vm_latency_ms, metrics.vm_throughput):
+            gauge.remove(cid=cid)
+    print(f"vm with cid:{cid} migrated to {dest_uri} in {elapsed * 1000:.2f} ms")
+    notify_demand_change(f"cid: {cid} migrated to {dest_uri}")
+    return {"migrated": True, "elapsed_ms": elapsed * 1000, "vm": {**vm_config, "threads": runtime_config.get("threads", 0)}}
+
+# vms migrated to this host are not adopted: a guest only joins a host.py run that expects it in its config
+async def handle_agent_request(msg):
+    if "status" in msg:
+        return agent_status()
+    if "migrate" in msg:
+        return await migrate_vm(msg["migrate"]["cid"], msg["migrate"]["dest_uri"])
+    return {"error": f"{host_name} does not support {sorted(key for key in msg if key != 'req_id')}"}
+
+
+# sim program runs according to config file and starts all simulations when all expected guests have connected
+async def run_sim_mode(s, sched_name, backend_name="auto", debounce=None, max_period=None, sysfs_root="/sys", event_log_path="./logs/events.bin", metrics_port=None, policy_name="proportional", agent_socket=None):
+    global config
+    global sim_started
+    global vm_migration
+    global sched
+    global backend
+    global total_cpu
+    global reallocation_debounce
+    global reallocation_max_period
+    global event_log
+    global policy
+    global timeline_scheduler
+
+    loop = asyncio.get_running_loop()
+    s.setblocking(False)
+
+    expected_vms = [c["vm_cid"] for c in config]
+    vm_migration = vm_migration or any(vm.get("vm_migration", False) for vm in config)
+    sched = sched_name
+    try:
+        timeline_events = timeline.compile_timeline(config, sched, vm_migration)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f"compiled {len(timeline_events)} timeline events, lasting {timeline.timeline_length(timeline_events)} s")
+    policy = policies.make_policy(policy_name, config, workload_latencies, slo_floor, slo_max_step, slo_slack)
+    utils.cpu_inventory = topology.CpuInventory(sysfs_root)
+    total_cpu = len(utils.get_cpu_list())
+    backend = hypervisor.make_backend(backend_name)
+    event_log = events.EventLog(event_log_path)
+    metrics.total_cpus.set(total_cpu)
+    metrics_server = await metrics.serve(metrics_port) if metrics_port else None
+    agent_server = await agent.serve(agent_socket, handle_agent_request) if agent_socket else None
+    if debounce is not None:
+        reallocation_debounce = debounce
+    if max_period is not None:
+        reallocation_max_period = max_period
+    print(f"vm_migration flag set to : {vm_migration}")
+    print(f"hypervisor backend: {backend.name}")
+    print(f"allocation policy: {policy.name}")
+
+    # guests are initialized concurrently while we keep accepting the remaining ones
+    init_tasks = []
     while True:
-        resp = json.loads(conns[cid].recv(1024).decode('utf-8'))
-        reader_cv[cid].acquire()
-        reader_cv_data[cid] = resp
-        reader_cv[cid].notify_all()
-        reader_cv[cid].release()
+        print("still waiting for guest vm(s)...")
+        sock, (remote_cid, remote_port) = await loop.sock_accept(s)
+        if remote_cid not in expected_vms:
+            print(f"unexpected vm with cid {remote_cid}")
+            sys.exit()
+        else:
+            expected_vms.remove(remote_cid)
+
+        reader, writer = await asyncio.open_connection(sock=sock)
+        conn = protocol.AsyncFramedStream(reader, writer)
+        init_tasks.append(asyncio.create_task(init_guest(conn, remote_cid, sched_name)))
+
+        print(f"guest {remote_cid} has connected")
+        if len(expected_vms) == 0:
+            break
+    await asyncio.gather(*init_tasks)
+
+    if sched_name in ALLOCATING_SCHEDS:
+        diff = await adjust_pcpu_to_vm_mapping()
+        await apply_vcpu_pinning(diff)
+        print(f"runtime_vm_configs (before simulation starts): {runtime_vm_configs}")
+        sim_started = True
+
+    # one scheduler dispatches every vm's events; each vm's reader task routes replies to the event that sent the
+    # request, by req_id
+    timeline_scheduler = timeline.TimelineScheduler(timeline_events, run_timeline_event)
+    if sched_name in ALLOCATING_SCHEDS:
+        spawn(core_allocation_callback())
+
+    lateness = await timeline_scheduler.run()
+    summary = timeline.summarize_lateness(lateness)
+    if summary["events"]:
+        print(f"timeline: {summary['events']} events dispatched, lateness p50 {summary['p50_ms']:.3f} ms, p99 {summary['p99_ms']:.3f} ms, max {summary['max_ms']:.3f} ms")
+    event_log.close()
+    if metrics_server is not None:
+        metrics_server.close()
+    if agent_server is not None:
+        await agent.close(agent_server)
+
+    print("All client simulations completed. Program exiting.")
 
 
 if __name__ == "__main__":
@@ -392,9 +571,21 @@ if __name__ == "__main__":
     cli_parser = subparsers.add_parser("cli", help="cli help")
     sim_parser = subparsers.add_parser("sim", help="sim help")
     sim_parser.add_argument("config_file")
-    sim_parser.add_argument("sched", choices=["ufo", "rorke"])
+    sim_parser.add_argument("sched", choices=["ufo", "cps", "rorke"], help="cps requires the guests to run guest.py cps sim")
+    sim_parser.add_argument("--hypervisor", choices=hypervisor.BACKENDS, default="auto", help="backend used to pin vcpus")
+    sim_parser.add_argument("--debounce", type=float, default=reallocation_debounce, help="seconds to batch demand changes before reallocating")
+    sim_parser.add_argument("--max-period", type=float, default=reallocation_max_period, help="longest time between reallocation rounds")
+    sim_parser.add_argument("--sysfs-root", default="/sys", help="sysfs tree to read the host cpu topology from")
+    sim_parser.add_argument("--policy", choices=policies.POLICIES, default="proportional", help="proportional splits by threads times each vm's weight; slo needs p95_target_ms on the vms")
+    sim_parser.add_argument("--slo-floor", type=int, default=slo_floor, help="slo: fewest pcpus a vm is left with")
+    sim_parser.add_argument("--slo-max-step", type=int, default=slo_max_step, help="slo: most pcpus a vm gains or loses per round")
+    sim_parser.add_argument("--metrics-port", type=int, help="serve prometheus metrics on http://127.0.0.1:<port>/metrics")
+    sim_parser.add_argument("--agent-socket", help="serve coordinator.py on this unix socket")
+    sim_parser.add_argument("--host-name", default=host_name, help="name reported to the coordinator")
+    sim_parser.add_argument("--migration-uri", default=migration_uri, help="hypervisor uri other hosts migrate vms to this host with")
+    sim_parser.add_argument("--event-log", default="./logs/events.bin", help="where to write the binary event log, see events.py")
     args = parser.parse_args()
-    
+
     # start vsock server
     print(f"available cpus on host: {utils.get_cpu_list()}")
     s = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
@@ -405,56 +596,13 @@ if __name__ == "__main__":
     if args.mode == "cli":
         conn, (remote_cid, remote_port) = s.accept()
         run_cli(conn)
-    
-    # sim program runs according to config file and starts all simulations when all expected guests have connected
+
     elif args.mode == "sim":
         config_fd = open(args.config_file, "r")
         config = json.loads(config_fd.read())
-       
-
-        # each client has a simulator thread
-        client_sim_threads = []
-
-        # each client has a reader thread, the reader thread waits for input from client. 
-        # however, the input could be for the simulation thread or the vcpu thread. we use a condition variable to synchronize
-        client_reader_threads = []
-
-        expected_vms = [c["vm_cid"] for c in config]
-        vm_migration = vm_migration or any(vm.get("vm_migration", False) for vm in config)
-        sched = args.sched
-        print(f"vm_migration flag set to : {vm_migration}")
-        while True:
-            print("still waiting for guest vm(s)...")
-            conn, (remote_cid, remote_port) = s.accept()
-            if remote_cid not in expected_vms:
-                print(f"unexpected vm with cid {remote_cid}")
-                sys.exit()
-            else:
-                expected_vms.remove(remote_cid)
-           
-            init_guest(conn, remote_cid, args.sched)
-            
-            t = threading.Thread(target=run_sim, args=(remote_cid,))
-            client_sim_threads.append(t)     
-            
-            print(f"guest {remote_cid} has connected")
-            if len(expected_vms) == 0:
-                break
-        
-        if args.sched == "ufo":
-            adjust_pcpu_to_vm_mapping()
-            apply_vcpu_pinning()
-            print(f"runtime_vm_configs (before simulation starts): {runtime_vm_configs}")
-            sim_started = True
-        
-        for t in client_sim_threads:
-            t.start()
-        
-        if args.sched == "ufo":
-            t = threading.Thread(target=core_allocation_callback, daemon=True)
-            t.start()
-        
-        for t in client_sim_threads:
-            t.join()
-
-        print("All client simulations completed. Program exiting.") 
+        slo_floor = args.slo_floor
+        slo_max_step = args.slo_max_step
+        host_name = args.host_name
+        migration_uri = args.migration_uri
+
+        asyncio.run(run_sim_mode(s, args.sched, args.hypervisor, args.debounce, args.max_period, args.sysfs_root, args.event_log, args.metrics_port, args.policy, args.agent_socket))
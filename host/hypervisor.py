@@ -0,0 +1,122 @@
+import asyncio
+import time
+import utils
+
+# Hypervisor backends that the host uses to query and pin vcpus. Every backend applies a whole vm's pin set as one
+# batch: pins is {<vcpu_id>: <pcpu_id>, ...}, where a pcpu_id of None resets that vcpu to run on any pcpu.
+# pin_vcpus returns the time the batch took in seconds. migrate_vm live-migrates a vm to the hypervisor at dest_uri
+# (e.g. qemu+ssh://other-host/system) when the coordinator asks for it, and returns how long that took in seconds.
+
+# Holds one libvirt connection for the lifetime of the host and pins vcpus through the API, without spawning processes
+class LibvirtBackend:
+    name = "libvirt"
+
+    def __init__(self, uri="qemu:///system"):
+        import libvirt
+        self.libvirt = libvirt
+        self.conn = libvirt.open(uri)
+        self.domains = {} # {<vm_name>: virDomain, ...}
+
+    def _domain(self, vm_name):
+        if vm_name not in self.domains:
+            self.domains[vm_name] = self.conn.lookupByName(vm_name)
+        return self.domains[vm_name]
+
+    def _pin_batch(self, vm_name, pins):
+        dom = self._domain(vm_name)
+        host_cpus = self.conn.getCPUMap()[0]
+        for vcpu_id, pcpu_id in pins.items():
+            if pcpu_id is None:
+                cpumap = tuple(True for _ in range(host_cpus))
+            else:
+                cpumap = tuple(cpu == pcpu_id for cpu in range(host_cpus))
+            dom.pinVcpuFlags(vcpu_id, cpumap, self.libvirt.VIR_DOMAIN_AFFECT_LIVE)
+
+    async def vcpu_count(self, vm_name):
+        dom = self._domain(vm_name)
+        return await asyncio.to_thread(dom.vcpusFlags, self.libvirt.VIR_DOMAIN_VCPU_MAXIMUM)
+
+    async def pin_vcpus(self, vm_name, pins):
+        start = time.perf_counter()
+        if pins:
+            # the libvirt calls block, so the whole batch runs off the event loop in one worker thread
+            await asyncio.to_thread(self._pin_batch, vm_name, pins)
+        return time.perf_counter() - start
+
+    async def migrate_vm(self, vm_name, dest_uri):
+        start = time.perf_counter()
+        flags = self.libvirt.VIR_MIGRATE_LIVE | self.libvirt.VIR_MIGRATE_PERSIST_DEST | self.libvirt.VIR_MIGRATE_UNDEFINE_SOURCE
+        await asyncio.to_thread(self._domain(vm_name).migrateToURI, dest_uri, flags, None, 0)
+        self.domains.pop(vm_name, None)
+        return time.perf_counter() - start
+
+
+# Fallback that shells out to virsh, as the host originally did. A batch is sent as a single virsh invocation with ';'-separated commands.
+class VirshBackend:
+    name = "virsh"
+
+    async def vcpu_count(self, vm_name):
+        # the first number in the vcpucount table is the vm's maximum vcpu count
+        output = await utils.run_command_async(f"sudo virsh vcpucount {vm_name}")
+        return next(int(word) for word in output.split() if word.isdigit())
+
+    async def pin_vcpus(self, vm_name, pins):
+        start = time.perf_counter()
+        if pins:
+            cmds = [f"vcpupin {vm_name} {vcpu_id} {'r' if pcpu_id is None else pcpu_id}" for vcpu_id, pcpu_id in pins.items()]
+            cmd = f"sudo virsh '{'; '.join(cmds)}'"
+            print(f"Running: {cmd}")
+            await utils.run_command_async(cmd)
+        return time.perf_counter() - start
+
+    async def migrate_vm(self, vm_name, dest_uri):
+        start = time.perf_counter()
+        if await utils.run_command_async(f"sudo virsh migrate --live --persistent --undefinesource {vm_name} {dest_uri}") is None:
+            raise RuntimeError(f"virsh could not migrate {vm_name} to {dest_uri}")
+        return time.perf_counter() - start
+
+
+# In-memory hypervisor for tests and benchmarks. pin_delay simulates the per-vcpu cost of a pin operation.
+class FakeBackend:
+    name = "fake"
+
+    def __init__(self, vcpu_counts=None, default_vcpu_count=8, pin_delay=0.0):
+        self.vcpu_counts = vcpu_counts or {} # {<vm_name>: int, ...}
+        self.default_vcpu_count = default_vcpu_count
+        self.pin_delay = pin_delay
+        self.pins = {} # {<vm_name>: {<vcpu_id>: <pcpu_id or None>, ...}, ...}
+        self.batches = [] # [(<vm_name>, {<vcpu_id>: <pcpu_id>, ...}), ...] in the order they were applied
+        self.migrations = [] # [(<vm_name>, <dest_uri>), ...]
+
+    async def vcpu_count(self, vm_name):
+        return self.vcpu_counts.get(vm_name, self.default_vcpu_count)
+
+    async def pin_vcpus(self, vm_name, pins):
+        start = time.perf_counter()
+        if self.pin_delay:
+            await asyncio.sleep(self.pin_delay * len(pins))
+        self.pins.setdefault(vm_name, {}).update(pins)
+        self.batches.append((vm_name, dict(pins)))
+        return time.perf_counter() - start
+
+    async def migrate_vm(self, vm_name, dest_uri):
+        self.migrations.append((vm_name, dest_uri))
+        self.pins.pop(vm_name, None)
+        return 0.0
+
+
+BACKENDS = ["auto", "libvirt", "virsh", "fake"]
+
+# auto uses libvirt when its python bindings are installed and reachable, and virsh otherwise
+def make_backend(name="auto"):
+    if name == "fake":
+        return FakeBackend()
+    if name == "virsh":
+        return VirshBackend()
+    try:
+        return LibvirtBackend()
+    except Exception as e:
+        if name == "libvirt":
+            raise
+        print(f"libvirt backend unavailable ({e}), falling back to virsh")
+        return VirshBackend()
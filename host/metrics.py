@@ -0,0 +1,147 @@
+import asyncio
+import bisect
+
+# Counters, gauges and histograms of the host controller, served over HTTP in the Prometheus text format (version
+# 0.0.4) so a running `host.py sim` can be scraped with standard tooling. Everything runs on the host's event loop, so
+# no locking is needed.
+DEFAULT_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for (name, value) in zip(names, values))
+    return "{" + pairs + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {} # {<label values>: value, ...}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for (key, value) in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def remove(self, **labels):
+        self.values.pop(self._key(labels), None)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = sorted(buckets)
+
+    # values are [<count per bucket>, ..., <count above the last bucket>, sum, count]
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0, 0])
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for (key, counts) in sorted(self.values.items()):
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(counts[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+allocation_rounds = registry.counter("ufo_allocation_rounds_total", "Allocation rounds planned")
+allocation_rounds_skipped = registry.counter("ufo_allocation_rounds_skipped_total", "Allocation rounds that changed nothing and were skipped")
+allocation_round_seconds = registry.histogram("ufo_allocation_round_seconds", "Time to plan and apply an allocation round")
+reaction_seconds = registry.histogram("ufo_reaction_seconds", "Time from a demand change to the end of the round that handled it")
+resize_seconds = registry.histogram("ufo_resize_round_trip_seconds", "Round trip of a guest resize request", ["cid"])
+pin_seconds = registry.histogram("ufo_pin_seconds", "Hypervisor time to apply one batch of vcpu pins", ["cid", "backend"])
+vm_cores = registry.gauge("ufo_vm_cores", "pcpus a vm is pinned on", ["cid"])
+vm_threads = registry.gauge("ufo_vm_threads", "Workload threads a vm was last asked to run", ["cid"])
+vm_latency_ms = registry.gauge("ufo_vm_latency_ms", "Latest workload latency streamed by a vm", ["cid"])
+vm_throughput = registry.gauge("ufo_vm_throughput", "Latest workload throughput streamed by a vm", ["cid"])
+total_cpus = registry.gauge("ufo_total_cpus", "pcpus the host hands out to vms")
+timeline_lateness_seconds = registry.histogram("ufo_timeline_lateness_seconds", "Time a workload timeline event was dispatched after its deadline", ["kind"])
+workload_overruns = registry.counter("ufo_workload_overruns_total", "Workloads sent while the vm's previous workload had not completed", ["cid"])
+errors = registry.counter("ufo_errors_total", "Errors seen by the host controller", ["kind"])
+
+async def _handle(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # the headers are read and ignored
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            status = "200 OK"
+            body = registry.render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"not found\n"
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (OSError, UnicodeDecodeError):
+        pass
+    finally:
+        writer.close()
+
+# serves registry at http://<host>:<port>/metrics until the returned server is closed
+async def serve(port, host="127.0.0.1"):
+    server = await asyncio.start_server(_handle, host, port)
+    print(f"serving metrics on http://{host}:{port}/metrics")
+    return server
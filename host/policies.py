@@ -0,0 +1,60 @@
+import allocator
+
+# Allocation policies that the host and the simulator use to plan rounds once the simulation runs. A policy has two
+# steps:
+#   counts(current, total_cpus)                         {<cid>: <cpu count>, ...} for every vm in current
+#   place(current, targets, free, usable_cpus, topo)    {<cid>: [<cpu>, ...], ...} free pcpus for each growing vm
+# where current is an allocator.snapshot, i.e. each vm's demand (threads) and its current vcpu_cpu_mapping. The host
+# diffs the counts against current with allocator.diff_allocation and places vms after shrinking vms freed their pcpus.
+# Policies are built once per run by make_policy; anything else a policy reads, such as weights or latencies, is given
+# to it there.
+
+# places vms with allocator.reserve_cpus, which policies share unless they need a placement of their own
+class Policy:
+    name = None
+    floor = 1
+
+    def place(self, current, targets, free, usable_cpus, cpu_topology=None):
+        return allocator.reserve_cpus(current, targets, free, usable_cpus, cpu_topology)
+
+
+# splits pcpus in proportion to each vm's threads times its weight, by the largest remainder method
+class ProportionalPolicy(Policy):
+    name = "proportional"
+
+    def __init__(self, weights=None, floor=1):
+        self.weights = weights or {} # {<cid>: float, ...}
+        self.floor = floor
+
+    def counts(self, current, total_cpus):
+        return allocator.counts_proportional(current, total_cpus, self.weights, self.floor)
+
+
+# moves pcpus from vms well under their p95 latency target to vms over it, see allocator.counts_slo. latencies is
+# called once per round and returns {<cid>: recent p95 in ms or None, ...}
+class SloPolicy(Policy):
+    name = "slo"
+
+    def __init__(self, targets, latencies, floor=1, max_step=2, slack=0.8):
+        self.targets = targets # {<cid>: p95 target in ms or None, ...}
+        self.latencies = latencies
+        self.floor = floor
+        self.max_step = max_step
+        self.slack = slack
+
+    def counts(self, current, total_cpus):
+        return allocator.counts_slo(current, self.latencies(), self.targets, total_cpus, self.floor, self.max_step, self.slack)
+
+
+POLICIES = ["proportional", "slo"]
+
+# builds a policy for the vms of config. weights come from each vm's "weight" and slo targets from its "p95_target_ms";
+# floor, max_step and slack only apply to slo
+def make_policy(name, config, latencies=None, floor=1, max_step=2, slack=0.8):
+    if name == "proportional":
+        return ProportionalPolicy({vm["vm_cid"]: vm.get("weight", 1.0) for vm in config})
+    if name == "slo":
+        targets = {vm["vm_cid"]: vm.get("p95_target_ms") for vm in config}
+        return SloPolicy(targets, latencies or (lambda: {}), floor, max_step, slack)
+    raise ValueError(f"unknown allocation policy {name}")
+
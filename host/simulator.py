@@ -0,0 +1,429 @@
+import os
+import re
+import json
+import math
+import heapq
+import argparse
+import itertools
+import numpy as np
+import allocator
+import policies
+import topology
+import timeline
+from graph_scripts import logparse
+
+# Offline model of a `host.py sim` run. A config is replayed on a virtual clock against a modeled host instead of real
+# vms, so a 10 minute experiment finishes in milliseconds and policies can be compared over many configurations.
+#
+# The allocation rounds are the ones host.py runs: the same debounce / max period loop around core_allocation_callback,
+# the same policies.py policy for counts and pcpu placement, and the same allocator functions for diffs and vcpu
+# remapping. The slo policy reads the modeled latencies in place of streamed telemetry. Only the guests are modeled:
+#   - a vm's p95 latency is base_latency_ms while it has a pcpu per thread, and grows with (threads / pcpus) ** exponent
+#     once its threads outnumber its pcpus. calibrate() fits both numbers to recorded sysbench logs
+#   - a vm gets at most its share of the host's pcpus: when all vms together run more vcpus than the host has pcpus,
+#     each runs on host_cpus * its vcpus / all vcpus, whatever the scheduler
+#   - a resize costs a vsock round trip plus hotplug (ufo, rorke) or an affinity update (cps); pinning costs one
+#     hypervisor batch plus a per-pin cost
+# The guest onlines the highest-numbered offline vcpus and offlines the highest-numbered online ones, as it does when
+# all its cpus are equally busy.
+
+DEFAULT_MODEL = {
+    "host_cpus": 8,                     # pcpus of the modeled host
+    "vcpus_per_vm": 8,                  # vcpus each guest can bring online
+    "base_latency_ms": 2.5,             # p95 with at least one pcpu per thread
+    "oversubscription_exponent": 1.0,
+    "round_trip_ms": 1.0,               # one vsock request and its reply
+    "online_ms": 30.0,                  # per vcpu onlined; hotplug.MAX_PARALLEL_ONLINE writes overlap
+    "offline_ms": 15.0,                 # per vcpu offlined, one at a time
+    "parallel_online": 4,
+    "affinity_ms": 5.0,                 # cps: moving every guest task to the new cpu set
+    "pin_batch_ms": 20.0,               # one pin_vcpus call on the hypervisor backend
+    "pin_ms": 0.5,                      # per vcpu pinned within a batch
+    "redis_requests_per_s": 26000.0,    # redis slices give their interval in requests
+    "debounce": 0.25,                   # host.py --debounce
+    "max_period": 5.0,                  # host.py --max-period
+    "sample_interval": 1.0,             # seconds between latency samples, like sysbench's reports
+}
+
+SCHEDS = ["ufo", "cps", "rorke"]
+ALLOCATING_SCHEDS = ["ufo", "cps"]
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+# places a compiled timeline (see timeline.py) on the modeled clock from start. returns [(<time>, <event>), ...] and
+# {<cid>: <end of the vm's last workload>, ...}. open-ended redis slices last their requests at redis_requests_per_s
+def schedule_timeline(timeline_events, model, start=0.0):
+    scheduled = []
+    ends = {} # {<workload event index>: <end>}
+    vm_ends = {}
+    for event in timeline_events:
+        at = (start if event["anchor"] is None else ends[event["anchor"]]) + event["at"]
+        scheduled.append((at, event))
+        if event["kind"] == "workload":
+            duration = event["duration"]
+            if duration is None:
+                duration = event["interval"] / model["redis_requests_per_s"]
+            ends[event["index"]] = at + duration
+            vm_ends[event["cid"]] = max(vm_ends.get(event["cid"], 0.0), at + duration)
+    return scheduled, vm_ends
+
+# p95 latency in ms of a vm running threads on cores pcpus, or None while it runs nothing
+def latency_ms(threads, cores, model):
+    if threads <= 0:
+        return None
+    oversubscription = max(threads / max(cores, 1), 1.0)
+    return model["base_latency_ms"] * oversubscription ** model["oversubscription_exponent"]
+
+# the vcpus a guest has online after a resize to cnt, see resize in guest/hotplug.py and resize_cpus_cps in guest/cps.py
+def guest_resize(online, cnt, vcpus_per_vm):
+    online = sorted(online)
+    if cnt < len(online):
+        return online[:max(cnt, 1)]
+    offline = [i for i in range(vcpus_per_vm - 1, -1, -1) if i not in online]
+    return sorted(online + offline[:cnt - len(online)])
+
+# time in seconds for the guest to go from online to new_online
+def guest_resize_cost(sched, online, new_online, model):
+    added = len(set(new_online) - set(online))
+    removed = len(set(online) - set(new_online))
+    cost_ms = model["round_trip_ms"]
+    if sched == "cps":
+        if added or removed:
+            cost_ms += model["affinity_ms"]
+    else:
+        waves = -(-added // max(int(model["parallel_online"]), 1))
+        cost_ms += waves * model["online_ms"] + removed * model["offline_ms"]
+    return cost_ms / 1000
+
+def pin_cost(pins, model):
+    if not pins:
+        return 0.0
+    return (model["pin_batch_ms"] + model["pin_ms"] * len(pins)) / 1000
+
+
+class Simulation:
+    def __init__(self, config, sched, model=None, cpu_topology=None, policy_name="proportional"):
+        if sched not in SCHEDS:
+            raise ValueError(f"unknown scheduler {sched}")
+        self.config = config
+        self.sched = sched
+        self.policy = policies.make_policy(policy_name, config, self.latencies)
+        self.model = dict(DEFAULT_MODEL, **(model or {}))
+        self.cpu_topology = cpu_topology
+        self.now = 0.0
+        self.events = []
+        self.seq = itertools.count()
+
+        self.vm_migration = any(vm.get("vm_migration", False) for vm in config)
+        self.host_cpus = sorted(cpu_topology) if cpu_topology else list(range(int(self.model["host_cpus"])))
+        self.total_cpu = len(self.host_cpus)
+        self.vcpus_per_vm = int(self.model["vcpus_per_vm"])
+        # {cid: {"threads", "vcpu_cpu_mapping", "vcpu_ids", "cores"}} where cores is the vcpus the vm currently runs,
+        # before contention with the other vms, see effective_cores
+        self.vms = {}
+        for vm in config:
+            vcpu_ids = list(range(self.vcpus_per_vm))
+            self.vms[vm["vm_cid"]] = {"threads": 0, "vcpu_cpu_mapping": {}, "vcpu_ids": vcpu_ids, "cores": len(vcpu_ids)}
+
+        self.sim_started = False
+        self.sim_start_time = 0.0
+        self.running_vms = 0
+        # the allocation loop: waiting for demand, debouncing, or applying a round
+        self.loop_state = "waiting"
+        self.loop_generation = 0
+        self.demand_events = []
+
+        self.samples = {cid: [] for cid in self.vms}
+        self.reaction_ms = []
+        self.rounds = 0
+        self.skipped_rounds = 0
+        self.resizes = 0
+        self.pins = 0
+
+    def schedule(self, at, fn, *args):
+        heapq.heappush(self.events, (at, next(self.seq), fn, args))
+
+    def run(self):
+        if self.sched in ALLOCATING_SCHEDS:
+            # like run_sim_mode, every vm gets its fair share before the workloads start
+            counts = allocator.counts_initial(list(self.vms), self.total_cpu)
+            duration = self.apply(counts)
+            self.schedule(duration, self.start_sim)
+        else:
+            self.schedule(0.0, self.start_sim)
+
+        while self.events:
+            at, seq, fn, args = heapq.heappop(self.events)
+            self.now = at
+            fn(*args)
+            if self.sim_started and self.running_vms == 0:
+                break
+        return self.result()
+
+    def start_sim(self):
+        self.sim_started = True
+        self.sim_start_time = self.now
+        compiled = timeline.compile_timeline(self.config, self.sched, self.vm_migration)
+        scheduled, vm_ends = schedule_timeline(compiled, self.model, self.now)
+        for (at, event) in scheduled:
+            self.schedule(at, self.start_event, event)
+        self.running_vms = len(vm_ends)
+        for (cid, end) in vm_ends.items():
+            self.schedule(end, self.finish_vm, cid)
+        self.schedule(self.now, self.sample)
+        if self.sched in ALLOCATING_SCHEDS:
+            self.wait_for_demand_change()
+
+    def finish_vm(self, cid):
+        self.running_vms -= 1
+
+    # see run_timeline_event in host.py
+    def start_event(self, event):
+        if event["kind"] == "workload":
+            if self.vms[event["cid"]]["threads"] != event["threads"]:
+                self.vms[event["cid"]]["threads"] = event["threads"]
+                self.notify_demand_change()
+        elif event["kind"] == "total_cpu":
+            self.set_total_cpu(event["pcpu"])
+        elif event["kind"] == "vcpu_cnt":
+            self.rorke_resize(event["counts"])
+
+    def set_total_cpu(self, pcpu):
+        self.total_cpu = pcpu
+        self.notify_demand_change()
+
+    # the pcpus the vm at cid effectively runs on: its vcpus, or its share of the host's pcpus once all vms' vcpus
+    # outnumber them
+    def effective_cores(self, cid):
+        cores = self.vms[cid]["cores"]
+        total = sum(vm["cores"] for vm in self.vms.values())
+        if total == 0:
+            return 0.0
+        return min(cores, len(self.host_cpus) * cores / total)
+
+    def latencies(self):
+        return {cid: latency_ms(vm["threads"], self.effective_cores(cid), self.model) for (cid, vm) in self.vms.items()}
+
+    def sample(self):
+        for cid, vm in self.vms.items():
+            cores = self.effective_cores(cid)
+            latency = latency_ms(vm["threads"], cores, self.model)
+            self.samples[cid].append((self.now - self.sim_start_time, vm["threads"], cores, latency))
+        if self.running_vms > 0:
+            self.schedule(self.now + self.model["sample_interval"], self.sample)
+
+    # see notify_demand_change and wait_for_demand_change in host.py. a change while the loop waits starts the
+    # debounce window; changes during the window or a round are handled by the next round
+    def notify_demand_change(self):
+        if self.sched not in ALLOCATING_SCHEDS:
+            return
+        self.demand_events.append(self.now)
+        if self.loop_state == "waiting":
+            self.debounce()
+
+    def debounce(self):
+        self.loop_state = "debouncing"
+        self.loop_generation += 1
+        self.schedule(self.now + self.model["debounce"], self.allocation_round, self.loop_generation)
+
+    def wait_for_demand_change(self):
+        if self.demand_events:
+            self.debounce()
+            return
+        self.loop_state = "waiting"
+        self.loop_generation += 1
+        self.schedule(self.now + self.model["max_period"], self.allocation_round, self.loop_generation)
+
+    def allocation_round(self, generation):
+        if generation != self.loop_generation or self.running_vms == 0:
+            return
+        self.loop_state = "allocating"
+        events, self.demand_events = self.demand_events, []
+        current = allocator.snapshot(self.vms)
+        counts = self.policy.counts(current, self.total_cpu)
+        duration = self.apply(counts)
+        self.schedule(self.now + duration, self.finish_round, events)
+
+    def finish_round(self, events):
+        self.reaction_ms.extend((self.now - changed_at) * 1000 for changed_at in events)
+        self.wait_for_demand_change()
+
+    # plans a round with the allocator and models apply_vcpu_pinning: shrinks first, then grows and moves. each vm's
+    # cores change when its own resize and pins complete. returns the time the round takes
+    def apply(self, counts):
+        usable_cpus = self.host_cpus[:self.total_cpu]
+        current = allocator.snapshot(self.vms)
+        diff = allocator.diff_allocation(current, counts, usable_cpus)
+        self.rounds += 1
+        if allocator.is_empty(diff):
+            self.skipped_rounds += 1
+            return 0.0
+
+        shrink_time = 0.0
+        for cid in diff["shrinks"]:
+            shrink_time = max(shrink_time, self.apply_vm(cid, diff["resize"][cid], [], usable_cpus, 0.0))
+
+        current = allocator.snapshot(self.vms)
+        free = allocator.free_cpus(current, usable_cpus)
+        reserved = self.policy.place(current, diff["targets"], free, usable_cpus, self.cpu_topology)
+        grow_time = 0.0
+        for cid in set(diff["grows"]) | set(diff["moves"]):
+            vcpu_cnt = None if cid in diff["shrinks"] else diff["resize"].get(cid)
+            grow_time = max(grow_time, self.apply_vm(cid, vcpu_cnt, reserved[cid], usable_cpus, shrink_time))
+        return shrink_time + grow_time
+
+    # resizes and re-pins one vm starting offset seconds from now. returns how long it takes
+    def apply_vm(self, cid, vcpu_cnt, new_cpus, usable_cpus, offset):
+        vm = self.vms[cid]
+        duration = 0.0
+        if vcpu_cnt is not None:
+            new_online = guest_resize(vm["vcpu_ids"], vcpu_cnt, self.vcpus_per_vm)
+            duration += guest_resize_cost(self.sched, vm["vcpu_ids"], new_online, self.model)
+            vm["vcpu_ids"] = new_online
+            self.resizes += 1
+        new_mapping, pins = allocator.remap_vcpus(vm["vcpu_cpu_mapping"], vm["vcpu_ids"], new_cpus, usable_cpus, self.sched == "cps")
+        duration += pin_cost(pins, self.model)
+        vm["vcpu_cpu_mapping"] = new_mapping
+        self.pins += len(pins)
+        self.schedule(self.now + offset + duration, self.set_cores, cid, len(set(new_mapping.values())))
+        return duration
+
+    def set_cores(self, cid, cores):
+        self.vms[cid]["cores"] = cores
+
+    # rorke resizes vms directly to counts and does not pin, see resize_vcpus in host.py
+    def rorke_resize(self, counts):
+        for (cid, cnt) in counts.items():
+            vm = self.vms[cid]
+            new_online = guest_resize(vm["vcpu_ids"], cnt, self.vcpus_per_vm)
+            duration = guest_resize_cost(self.sched, vm["vcpu_ids"], new_online, self.model)
+            vm["vcpu_ids"] = new_online
+            self.resizes += 1
+            self.schedule(self.now + duration, self.set_cores, cid, len(new_online))
+
+    def result(self):
+        vms = {}
+        for cid, samples in self.samples.items():
+            latencies = [latency for (t, threads, cores, latency) in samples if latency is not None]
+            vms[cid] = {
+                "mean_latency_ms": sum(latencies) / len(latencies) if latencies else None,
+                "p95_latency_ms": percentile(latencies, 95),
+                "max_latency_ms": max(latencies) if latencies else None,
+                "samples": samples,
+            }
+        return {
+            "sched": self.sched,
+            "policy": self.policy.name,
+            "duration_s": self.now - self.sim_start_time,
+            "rounds": self.rounds,
+            "skipped_rounds": self.skipped_rounds,
+            "resizes": self.resizes,
+            "pins": self.pins,
+            "reaction_ms": {
+                "mean": sum(self.reaction_ms) / len(self.reaction_ms) if self.reaction_ms else None,
+                "p95": percentile(self.reaction_ms, 95),
+                "max": max(self.reaction_ms) if self.reaction_ms else None,
+            },
+            "vms": vms,
+        }
+
+def simulate(config, sched, model=None, cpu_topology=None, policy_name="proportional"):
+    return Simulation(config, sched, model, cpu_topology, policy_name).run()
+
+
+# fits base_latency_ms and oversubscription_exponent to the sysbench logs of graphs_data directories that also have a
+# cores_log, both read with logparse. every latency report is matched with its thread count and the pcpus the vm had
+# at that time, and log(latency) is fit linearly against log(max(threads / pcpus, 1)). returns the fitted model entries
+def calibrate(log_dirs):
+    xs = []
+    latencies = []
+    for log_dir in log_dirs:
+        cores_path = os.path.join(log_dir, "cores_log.txt")
+        if not os.path.exists(cores_path):
+            continue
+        cores = logparse.load(cores_path, "cores")
+        for entry in os.listdir(log_dir):
+            match = re.match(r"^log_(\d+)\.txt$", entry)
+            if not match:
+                continue
+            vm = cores["cid"] == int(match.group(1))
+            order = np.argsort(cores["time"][vm], kind="stable")
+            at = cores["time"][vm][order]
+            pcpus = cores["pcpu"][vm][order]
+            if len(at) == 0:
+                continue
+
+            # each report takes the vm's last cores entry at or before it
+            samples = logparse.load(os.path.join(log_dir, entry), "sysbench")
+            index = np.searchsorted(at, samples["time"], side="right") - 1
+            valid = ~np.isnat(samples["time"]) & (index >= 0) & (samples["p95_ms"] > 0)
+            xs.append(np.maximum(samples["threads"][valid] / np.maximum(pcpus[index[valid]], 1), 1.0))
+            latencies.append(samples["p95_ms"][valid])
+
+    xs = np.log(np.concatenate(xs)) if xs else np.zeros(0)
+    ys = np.log(np.concatenate(latencies)) if latencies else np.zeros(0)
+    if len(xs) < 2:
+        print(f"not enough samples to calibrate ({len(xs)}), keeping the default model")
+        return {}
+    var_x = ((xs - xs.mean()) ** 2).sum()
+    exponent = float(((xs - xs.mean()) * (ys - ys.mean())).sum() / var_x) if var_x > 0 else 0.0
+    base = math.exp(ys.mean() - exponent * xs.mean())
+    print(f"calibrated from {len(xs)} samples: base_latency_ms={base:.3f} oversubscription_exponent={exponent:.3f}")
+    return {"base_latency_ms": base, "oversubscription_exponent": exponent}
+
+def print_summary(label, result):
+    reaction = result["reaction_ms"]["mean"]
+    reaction = f"{reaction:.1f}" if reaction is not None else "-"
+    print(f"{label} rounds:{result['rounds']} skipped:{result['skipped_rounds']} resizes:{result['resizes']} pins:{result['pins']} reaction_ms:{reaction}")
+    for cid, vm in result["vms"].items():
+        if vm["mean_latency_ms"] is None:
+            print(f"  cid: {cid} idle")
+        else:
+            print(f"  cid: {cid} mean_ms:{vm['mean_latency_ms']:.2f} p95_ms:{vm['p95_latency_ms']:.2f} max_ms:{vm['max_latency_ms']:.2f}")
+
+# "debounce=0,0.25,1" -> ("debounce", [0.0, 0.25, 1.0])
+def parse_sweep(text):
+    key, values = text.split("=", 1)
+    if key not in DEFAULT_MODEL:
+        raise argparse.ArgumentTypeError(f"unknown model parameter {key}")
+    return key, [float(value) for value in values.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="simulator", description="replays a host.py sim config against a modeled host")
+    parser.add_argument("config_file")
+    parser.add_argument("sched", choices=SCHEDS)
+    parser.add_argument("--policy", choices=policies.POLICIES, default="proportional", help="policy of ufo and cps rounds; slo reads p95_target_ms from the config")
+    parser.add_argument("--model", help="json file of model parameters overriding the defaults")
+    parser.add_argument("--calibrate", nargs="+", metavar="LOG_DIR", help="graphs_data directories to fit the latency model to")
+    parser.add_argument("--sweep", type=parse_sweep, action="append", default=[], metavar="PARAM=V1,V2,...",
+                        help="simulate every combination of the given model parameter values")
+    parser.add_argument("--sysfs-root", help="sysfs tree to read a host cpu topology from; pcpus are placed in order without one")
+    parser.add_argument("--json", action="store_true", help="print the full results, including per-second samples, as json")
+    args = parser.parse_args()
+
+    with open(args.config_file, "r") as f:
+        config = json.load(f)
+    model = {}
+    if args.model:
+        with open(args.model, "r") as f:
+            model.update(json.load(f))
+    if args.calibrate:
+        model.update(calibrate(args.calibrate))
+    cpu_topology = topology.read_topology(args.sysfs_root) if args.sysfs_root else None
+
+    keys = [key for (key, values) in args.sweep]
+    results = []
+    for values in itertools.product(*[values for (key, values) in args.sweep]):
+        run_model = dict(model, **dict(zip(keys, values)))
+        result = simulate(config, args.sched, run_model, cpu_topology, args.policy)
+        result["params"] = dict(zip(keys, values))
+        results.append(result)
+        if not args.json:
+            print_summary(" ".join(f"{key}={value}" for (key, value) in zip(keys, values)) or args.sched, result)
+    if args.json:
+        print(json.dumps(results if args.sweep else results[0], indent=2))
@@ -0,0 +1,100 @@
+import random
+import asyncio
+import collections
+import numpy as np
+import pytest
+import allocator
+import policies
+import utils
+import host
+import bench
+
+# Property checks of the allocation policies: counts keep the floor and add up to the pcpus, and once the host has
+# applied a round with apply_vcpu_pinning, against fake guests and hypervisor.FakeBackend as bench.py sets them up,
+# every usable pcpu is held by exactly one vm.
+SIZES = [(2, 8), (32, 64), (1000, 512), (4000, 1024)]
+APPLY_SIZES = [(2, 8), (8, 64), (32, 128)]
+ROUNDS = 50
+APPLY_ROUNDS = 20
+
+
+@pytest.mark.parametrize("total_cpus", [1, 3, 8, 64, 1000])
+@pytest.mark.parametrize("n", [1, 2, 7, 100])
+def test_largest_remainder_is_exact(n, total_cpus):
+    rng = np.random.default_rng(n * 1000 + total_cpus)
+    for weights in (rng.random(n), rng.integers(0, 4, n), np.zeros(n)):
+        counts = allocator.largest_remainder(weights, total_cpus)
+        assert (counts >= 1).all()
+        if total_cpus >= n:
+            assert counts.sum() == total_cpus
+
+# a heavier vm never gets fewer pcpus than a lighter one
+@pytest.mark.parametrize("n", [2, 7, 100])
+def test_largest_remainder_is_monotonic(n):
+    rng = np.random.default_rng(n)
+    for i in range(ROUNDS):
+        weights = rng.random(n) ** 4
+        counts = allocator.largest_remainder(weights, int(rng.integers(n, 4 * n)))
+        by_weight = counts[np.argsort(weights, kind="stable")]
+        assert (np.diff(by_weight) >= 0).all()
+
+def test_check_counts():
+    assert allocator.check_counts({0: 2, 1: 2}, 4) == []
+    assert len(allocator.check_counts({0: 0, 1: 4}, 4)) == 1
+    assert len(allocator.check_counts({0: 2, 1: 3}, 4)) == 1
+    # with fewer pcpus than the floors, counts only have to keep the floor
+    assert allocator.check_counts({0: 2, 1: 2}, 3, floor=2) == []
+
+@pytest.mark.parametrize("n_vms, n_cpus", SIZES)
+@pytest.mark.parametrize("name", policies.POLICIES)
+def test_counts_keep_the_floor_and_add_up(name, n_vms, n_cpus):
+    rng = random.Random(n_vms * 100000 + n_cpus)
+    policy = policies.make_policy(name, [{"vm_cid": cid} for cid in range(n_vms)])
+    for i in range(ROUNDS):
+        total_cpus = rng.randint(max(min(n_vms, n_cpus) // 2, 1), n_cpus)
+        counts = policy.counts(bench.random_snapshot(rng, n_vms, n_cpus), total_cpus)
+        assert allocator.check_counts(counts, total_cpus, policy.floor) == []
+
+# rounds of random threads and a random number of usable pcpus, planned and applied by the host. every vm is resized
+# at most once per round to its target, its mapping matches the fake hypervisor's pins, and every usable pcpu is held
+# by exactly one vm. under cps, vcpus outside a vm's allowed set are unpinned
+@pytest.mark.parametrize("n_vms, n_cpus", APPLY_SIZES)
+@pytest.mark.parametrize("sched", host.ALLOCATING_SCHEDS)
+def test_every_pcpu_is_assigned_once(sched, n_vms, n_cpus, tmp_path, monkeypatch):
+    resizes = collections.Counter()
+    send_request = host.send_request
+    async def counting_send_request(cid, msg):
+        if "vcpu_cnt_request" in msg:
+            resizes[cid] += 1
+        return await send_request(cid, msg)
+    monkeypatch.setattr(host, "send_request", counting_send_request)
+    monkeypatch.setattr(host, "sched", sched)
+
+    async def run():
+        await bench.setup_host(str(tmp_path), n_vms, n_cpus)
+        host.vm_migration = True
+        rng = random.Random(n_vms * 100000 + n_cpus)
+        try:
+            for i in range(APPLY_ROUNDS):
+                for runtime_config in host.runtime_vm_configs.values():
+                    runtime_config["threads"] = rng.choice([0, rng.randint(1, 64)])
+                host.total_cpu = rng.randint(n_vms, n_cpus)
+                resizes.clear()
+                diff = await host.adjust_pcpu_to_vm_mapping()
+                await host.apply_vcpu_pinning(diff)
+
+                assert resizes == collections.Counter(diff["resize"].keys())
+                assigned = []
+                for (cid, runtime_config) in host.runtime_vm_configs.items():
+                    mapping = runtime_config["vcpu_cpu_mapping"]
+                    assert sorted(mapping) == sorted(runtime_config["vcpu_ids"])
+                    assert len(mapping) == diff["targets"][cid]
+                    pins = host.backend.pins[host.get_vm_name(cid)]
+                    assert {vcpu_id: pins[vcpu_id] for vcpu_id in mapping} == mapping
+                    if sched == "cps":
+                        assert all(cpu is None for (vcpu_id, cpu) in pins.items() if vcpu_id not in mapping)
+                    assigned += mapping.values()
+                assert sorted(assigned) == utils.get_cpu_list()[:host.total_cpu]
+        finally:
+            await bench.teardown_host()
+    asyncio.run(run())
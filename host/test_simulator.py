@@ -0,0 +1,25 @@
+import pytest
+import simulator
+
+# a graphs_data directory of one vm running 8 sysbench threads on 8 pcpus and then on 2, stamped as the guest's workload
+# runner stamps its lines
+def write_log_dir(log_dir):
+    (log_dir / "cores_log.txt").write_text(
+        "[2024-05-01 12:00:00.000000000] cid: 3 pcpu: 8\n"
+        "[2024-05-01 12:00:02.500000000] cid: 3 pcpu: 2\n")
+    (log_dir / "log_3.txt").write_text(
+        "Sysbench is running in the background with the following parameters: interval=4, threads=8 ...\n"
+        "[2024-05-01 12:00:00.100000000] Number of threads: 8\n"
+        "[2024-05-01 12:00:01.000000001] [ 1s ] thds: 8 eps: 800.00 lat (ms,95%): 10.00\n"
+        "[2024-05-01 12:00:02.000000001] [ 2s ] thds: 8 eps: 800.00 lat (ms,95%): 10.00\n"
+        "[2024-05-01 12:00:03.000000001] [ 3s ] thds: 8 eps: 200.00 lat (ms,95%): 40.00\n"
+        "[2024-05-01 12:00:04] [ 4s ] thds: 8 eps: 200.00 lat (ms,95%): 40.00\n")
+
+def test_calibrate_reads_nanosecond_stamps(tmp_path):
+    write_log_dir(tmp_path)
+    model = simulator.calibrate([str(tmp_path)])
+    assert model["base_latency_ms"] == pytest.approx(10.0)
+    assert model["oversubscription_exponent"] == pytest.approx(1.0)
+
+def test_calibrate_without_samples_keeps_the_default_model(tmp_path):
+    assert simulator.calibrate([str(tmp_path)]) == {}
@@ -0,0 +1,206 @@
+import heapq
+import asyncio
+
+# Workload timelines. A config's slices are compiled once, before any guest connects, into a flat list of events with
+# deadlines, and a single TimelineScheduler dispatches all vms' events against the event loop's monotonic clock. A
+# slice therefore starts at the sum of the durations before it, however long earlier round trips took, and lateness
+# does not accumulate across slices or vms.
+#
+# Compiled events are dicts with
+#   index    position in the compiled list
+#   kind     "workload": run threads of workload on vm cid for interval (seconds, or requests for redis)
+#            "total_cpu": hand out pcpu pcpus from now on (a "cores" entry of a slice, ufo and cps with vm_migration)
+#            "vcpu_cnt": resize each vm in counts ({<cid>: <vcpus>}) directly (a "cores" entry under rorke)
+#   cid      the vm whose slice the event comes from
+#   at       seconds from the event's anchor
+#   anchor   None for the start of the timeline, or the index of an open-ended workload: its completion
+# A time_slice lasts its "duration" in seconds if given, and otherwise its interval for sysbench, mutex and loadgen.
+# redis slices without a duration run a number of requests, so the vm's later events are anchored on their completion.
+WORKLOADS = ["sysbench", "mutex", "redis", "loadgen"]
+KINDS = ["workload", "total_cpu", "vcpu_cnt"] # an event's position here is its kind in the event log
+
+def _check(condition, path, message):
+    if not condition:
+        raise ValueError(f"invalid config at {path}: {message}")
+
+def _number(value, path, integer=False):
+    _check(isinstance(value, (int, float)) and not isinstance(value, bool), path, f"expected a number, got {value!r}")
+    _check(value >= 0, path, f"expected a non-negative number, got {value}")
+    _check(not integer or value == int(value), path, f"expected an integer, got {value}")
+    return int(value) if integer else float(value)
+
+def _compile_cores(events, cid, cores, start, anchor, sched, path):
+    _check(isinstance(cores, list), path, "cores must be a list")
+    at = start
+    for (i, core_slice) in enumerate(cores):
+        core_path = f"{path}[{i}]"
+        _check(isinstance(core_slice, dict) and "time" in core_slice, core_path, "a cores entry needs a time")
+        at += _number(core_slice["time"], f"{core_path}.time")
+        event = {"index": len(events), "cid": cid, "at": at, "anchor": anchor}
+        if sched == "rorke":
+            counts = {}
+            for (key, value) in core_slice.items():
+                if key != "time":
+                    _check(key.isdigit(), f"{core_path}.{key}", "rorke cores entries map vm cids to vcpu counts")
+                    counts[int(key)] = _number(value, f"{core_path}.{key}", integer=True)
+            event.update(kind="vcpu_cnt", counts=counts)
+        else:
+            _check("pcpu" in core_slice, core_path, "a cores entry needs a pcpu count")
+            event.update(kind="total_cpu", pcpu=_number(core_slice["pcpu"], f"{core_path}.pcpu", integer=True))
+        events.append(event)
+
+# appends the events of a vm's slices. position is {"at", "anchor"}: where the next slice starts
+def _compile_slices(events, cid, max_threads, slices, position, sched, vm_migration, path):
+    _check(isinstance(slices, list), path, "slices must be a list")
+    for (i, slice) in enumerate(slices):
+        slice_path = f"{path}[{i}]"
+        _check(isinstance(slice, dict), slice_path, "a slice must be an object")
+        if slice.get("type") == "repeater":
+            cnt = _number(slice.get("cnt"), f"{slice_path}.cnt", integer=True)
+            for j in range(cnt):
+                _compile_slices(events, cid, max_threads, slice.get("slices"), position, sched, vm_migration, f"{slice_path}.slices")
+        elif slice.get("type") == "time_slice":
+            workload = slice.get("workload", "sysbench")
+            _check(workload in WORKLOADS, f"{slice_path}.workload", f"expected one of {WORKLOADS}, got {workload!r}")
+            percentage_load = _number(slice.get("percentage_load"), f"{slice_path}.percentage_load")
+            interval = _number(slice.get("interval"), f"{slice_path}.interval", integer=True)
+            if "duration" in slice:
+                duration = _number(slice["duration"], f"{slice_path}.duration")
+            else:
+                duration = None if workload == "redis" else float(interval)
+
+            event = {"index": len(events), "kind": "workload", "cid": cid, "at": position["at"], "anchor": position["anchor"],
+                     "threads": int(max_threads * percentage_load), "interval": interval, "workload": workload, "duration": duration}
+            events.append(event)
+            if slice.get("cores") is not None and vm_migration:
+                _compile_cores(events, cid, slice["cores"], position["at"], position["anchor"], sched, f"{slice_path}.cores")
+            if duration is None:
+                position["at"] = 0.0
+                position["anchor"] = event["index"]
+            else:
+                position["at"] += duration
+        else:
+            _check(False, f"{slice_path}.type", f"expected repeater or time_slice, got {slice.get('type')!r}")
+
+# validates config and compiles every vm's slices into one timeline. raises ValueError naming the offending entry
+def compile_timeline(config, sched="ufo", vm_migration=False):
+    _check(isinstance(config, list), "config", "expected a list of vms")
+    events = []
+    cids = set()
+    for (i, vm) in enumerate(config):
+        path = f"config[{i}]"
+        _check(isinstance(vm, dict) and "vm_cid" in vm and "vm_name" in vm, path, "a vm needs a vm_cid and a vm_name")
+        cid = _number(vm["vm_cid"], f"{path}.vm_cid", integer=True)
+        _check(cid not in cids, f"{path}.vm_cid", f"cid {cid} appears twice")
+        cids.add(cid)
+        workload_config = vm.get("workload_config")
+        _check(isinstance(workload_config, dict), f"{path}.workload_config", "missing workload_config")
+        max_threads = _number(workload_config.get("max_threads"), f"{path}.workload_config.max_threads", integer=True)
+        _compile_slices(events, cid, max_threads, workload_config.get("slices"), {"at": 0.0, "anchor": None}, sched,
+                        vm_migration, f"{path}.workload_config.slices")
+
+    for event in events:
+        if event["kind"] == "vcpu_cnt":
+            unknown = [cid for cid in event["counts"] if cid not in cids]
+            _check(not unknown, f"vm {event['cid']} cores", f"cids {unknown} are not in the config")
+    return events
+
+# end of the timeline in seconds, or None if it has open-ended workloads
+def timeline_length(events):
+    if any(event["kind"] == "workload" and event["duration"] is None for event in events):
+        return None
+    return max((event["at"] + event.get("duration", 0.0) for event in events), default=0.0)
+
+
+# Dispatches a compiled timeline. Events without an anchor are due at start + at, where start is when run() is called;
+# events anchored on an open-ended workload are due at that workload's completion + at. dispatch(event, lateness) is
+# awaited in a task of its own for every event, with lateness the seconds it was dispatched after its deadline, and
+# returns once the event is complete (for a workload, when the guest replies). Dispatch never waits for earlier
+# events, so a workload whose guest has not replied yet by its next slice's deadline simply overlaps it. A workload
+# whose dispatch fails, e.g. because its guest disconnected, drops its vm; the other vms' timelines carry on.
+class TimelineScheduler:
+    def __init__(self, events, dispatch):
+        self.events = events
+        self.dispatch = dispatch
+        self.heap = [] # [(<deadline>, <index>), ...] of events that are due at a known time
+        self.held = {} # {<anchor index>: [<event>, ...]} waiting for an open-ended workload to complete
+        self.tasks = {} # {<index>: asyncio.Task} of dispatched events that are not complete
+        self.dropped = set() # cids whose remaining workload events are skipped
+        self.errors = [] # [(<event>, <exception>), ...] of failed dispatches
+        self.lateness = [] # [(<event>, <lateness in seconds>), ...] in dispatch order
+        self.wake = asyncio.Event()
+        self.start = None
+
+    def now(self):
+        return asyncio.get_running_loop().time() - self.start
+
+    # skips the vm's remaining workload events and cancels the ones in flight, returning their tasks
+    def drop_vm(self, cid):
+        self.dropped.add(cid)
+        cancelled = []
+        for (index, task) in list(self.tasks.items()):
+            if self.events[index]["kind"] == "workload" and self.events[index]["cid"] == cid:
+                task.cancel()
+                cancelled.append(task)
+        return cancelled
+
+    def _release(self, index):
+        now = self.now()
+        for event in self.held.pop(index, []):
+            heapq.heappush(self.heap, (now + event["at"], event["index"]))
+        self.wake.set()
+
+    async def _run_event(self, event, lateness):
+        failed = False
+        try:
+            await self.dispatch(event, lateness)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"timeline: {event['kind']} event {event['index']} of vm {event['cid']} failed: {e!r}")
+            self.errors.append((event, e))
+            failed = True
+        del self.tasks[event["index"]]
+        if failed and event["kind"] == "workload":
+            print(f"timeline: dropping the remaining workloads of vm {event['cid']}")
+            self.drop_vm(event["cid"])
+        self._release(event["index"])
+
+    # returns self.lateness once every event has been dispatched and has completed or was dropped. failed dispatches
+    # are in self.errors
+    async def run(self):
+        self.start = asyncio.get_running_loop().time()
+        for event in self.events:
+            if event["anchor"] is None:
+                heapq.heappush(self.heap, (event["at"], event["index"]))
+            else:
+                self.held.setdefault(event["anchor"], []).append(event)
+
+        while self.heap or self.tasks:
+            if self.heap and self.heap[0][0] <= self.now():
+                deadline, index = heapq.heappop(self.heap)
+                event = self.events[index]
+                if event["kind"] == "workload" and event["cid"] in self.dropped:
+                    self._release(index)
+                    continue
+                lateness = self.now() - deadline
+                self.lateness.append((event, lateness))
+                self.tasks[index] = asyncio.create_task(self._run_event(event, lateness))
+                continue
+
+            self.wake.clear()
+            timeout = self.heap[0][0] - self.now() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.lateness
+
+# {"events", "p50_ms", "p99_ms", "max_ms"} of the lateness returned by TimelineScheduler.run
+def summarize_lateness(lateness):
+    values = sorted(late * 1000 for (event, late) in lateness)
+    if not values:
+        return {"events": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+    def percentile(p):
+        return values[min(int(len(values) * p / 100), len(values) - 1)]
+    return {"events": len(values), "p50_ms": percentile(50), "p99_ms": percentile(99), "max_ms": values[-1]}
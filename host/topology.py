@@ -0,0 +1,133 @@
+import os
+import re
+from collections import Counter
+
+# Reads the host's cpu topology from sysfs so that UFO can place a vm's pcpus compactly: on one NUMA node, within one
+# last-level cache, and on whole physical cores rather than hyperthreads shared with another vm.
+# sysfs_root defaults to /sys but can point at a recorded copy of a host's sysfs tree.
+
+# expands a sysfs cpu list such as "0-3,8,10-11" to [0, 1, 2, 3, 8, 10, 11]
+def parse_cpu_list(text):
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = map(int, part.split("-"))
+            cpus.extend(range(start, end + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def _read(path, default=None):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+# returns {<cpu>: {"node": int, "llc": int, "core": int, "siblings": [<cpu>, ...]}, ...} for every online cpu.
+# llc and core identify a cache domain / physical core by the lowest cpu in it. Files missing from sysfs_root fall
+# back to treating each cpu as its own core and cache domain on node 0
+def read_topology(sysfs_root="/sys"):
+    cpu_dir = os.path.join(sysfs_root, "devices/system/cpu")
+    node_dir = os.path.join(sysfs_root, "devices/system/node")
+
+    node_of = {}
+    if os.path.isdir(node_dir):
+        for entry in os.listdir(node_dir):
+            match = re.match(r"^node(\d+)$", entry)
+            if match:
+                for cpu in parse_cpu_list(_read(os.path.join(node_dir, entry, "cpulist"), "")):
+                    node_of[cpu] = int(match.group(1))
+
+    topology = {}
+    for cpu in parse_cpu_list(_read(os.path.join(cpu_dir, "online"), "")):
+        base = os.path.join(cpu_dir, f"cpu{cpu}")
+        siblings = parse_cpu_list(_read(os.path.join(base, "topology/thread_siblings_list"), str(cpu)))
+
+        # the last-level cache is the highest-level data or unified cache
+        llc_cpus = [cpu]
+        llc_level = -1
+        cache_dir = os.path.join(base, "cache")
+        if os.path.isdir(cache_dir):
+            for index in os.listdir(cache_dir):
+                if not index.startswith("index"):
+                    continue
+                level = int(_read(os.path.join(cache_dir, index, "level"), "-1"))
+                cache_type = _read(os.path.join(cache_dir, index, "type"), "")
+                if cache_type in ("Data", "Unified") and level > llc_level:
+                    llc_level = level
+                    llc_cpus = parse_cpu_list(_read(os.path.join(cache_dir, index, "shared_cpu_list"), str(cpu)))
+
+        topology[cpu] = {"node": node_of.get(cpu, 0), "llc": min(llc_cpus), "core": min(siblings), "siblings": siblings}
+    return topology
+
+def _cpu_info(topology, cpu):
+    return topology.get(cpu) or {"node": 0, "llc": cpu, "core": cpu, "siblings": [cpu]}
+
+# picks n cpus out of free for the vm cid, one at a time. owners is {<cpu>: <cid>, ...} for every pinned pcpu.
+# each pick prefers, in order: the numa node the vm mostly lives on, a last-level cache the vm already uses, a
+# hyperthread whose core the vm already holds, then a core that is entirely free, and only then a hyperthread shared
+# with another vm. a vm without pcpus starts on the node and cache domain with the most free pcpus
+def pick_cpus(topology, free, n, owners, cid):
+    free = list(free)
+    owners = dict(owners)
+    picked = []
+    while len(picked) < n and free:
+        vm_cpus = [cpu for (cpu, owner) in owners.items() if owner == cid]
+        free_per_node = Counter(_cpu_info(topology, cpu)["node"] for cpu in free)
+        free_per_llc = Counter(_cpu_info(topology, cpu)["llc"] for cpu in free)
+        if vm_cpus:
+            preferred_node = Counter(_cpu_info(topology, cpu)["node"] for cpu in vm_cpus).most_common(1)[0][0]
+        else:
+            preferred_node = free_per_node.most_common(1)[0][0]
+        vm_llcs = {_cpu_info(topology, cpu)["llc"] for cpu in vm_cpus}
+
+        def key(cpu):
+            info = _cpu_info(topology, cpu)
+            sibling_owners = {owners.get(sibling) for sibling in info["siblings"] if sibling != cpu}
+            if cid in sibling_owners:
+                sibling_penalty = 0
+            elif sibling_owners - {None}:
+                sibling_penalty = 2
+            else:
+                sibling_penalty = 1
+            llc_penalty = 0 if not vm_llcs or info["llc"] in vm_llcs else 1
+            return (info["node"] != preferred_node, llc_penalty, sibling_penalty, -free_per_llc[info["llc"]], info["core"], cpu)
+
+        cpu = min(free, key=key)
+        free.remove(cpu)
+        owners[cpu] = cid
+        picked.append(cpu)
+    return picked
+
+# The host's online cpus, read from <sysfs_root>/devices/system/cpu/online instead of forking lscpu. Each query costs
+# one small sysfs read; the parsed cpu list and the topology are only rebuilt when the online mask has changed
+class CpuInventory:
+    def __init__(self, sysfs_root="/sys"):
+        self.sysfs_root = sysfs_root
+        self.online_path = os.path.join(sysfs_root, "devices/system/cpu/online")
+        self._online_text = None
+        self._cpus = []
+        self._topology = None
+
+    # re-reads the online mask, returning True if it changed since the last read
+    def refresh(self):
+        text = _read(self.online_path, "")
+        if text == self._online_text:
+            return False
+        self._online_text = text
+        self._cpus = parse_cpu_list(text)
+        self._topology = None
+        return True
+
+    def cpu_list(self):
+        self.refresh()
+        return list(self._cpus)
+
+    def topology(self):
+        self.refresh()
+        if self._topology is None:
+            self._topology = read_topology(self.sysfs_root)
+        return self._topology
@@ -1,5 +1,7 @@
 import sys
+import asyncio
 import subprocess
+import topology
 
 def run_command(cmd):
     try:
@@ -8,22 +10,24 @@ def run_command(cmd):
     except subprocess.CalledProcessError as e:
         print(f"Error running command: {cmd}\n{e.stderr}", file=sys.stderr)
 
+# asyncio counterpart of run_command, so the host's event loop is not blocked while the command runs
+async def run_command_async(cmd):
+    process = await asyncio.create_subprocess_shell(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        print(f"Error running command: {cmd}\n{stderr.decode().strip()}", file=sys.stderr)
+        return None
+    return stdout.decode().strip()
+
+# online cpus of the host, see topology.CpuInventory. run_sim_mode replaces it when --sysfs-root is given
+cpu_inventory = topology.CpuInventory()
+
 def get_cpu_list():
-    """Get the list of available CPUs from lscpu."""
-    lscpu_output = run_command("lscpu")
-    for line in lscpu_output.splitlines():
-        if line.startswith("On-line CPU(s) list:"):
-            cpu_range = line.split(":")[1].strip()
-            # Expand ranges like "0-3" to [0, 1, 2, 3]
-            cpus = []
-            for part in cpu_range.split(","):
-                if "-" in part:
-                    start, end = map(int, part.split("-"))
-                    cpus.extend(range(start, end + 1))
-                else:
-                    cpus.append(int(part))
-            return cpus
-    print("Failed to fetch CPU list from the host machine")
+    """Get the list of online CPUs from sysfs, cached until the online mask changes."""
+    cpus = cpu_inventory.cpu_list()
+    if not cpus:
+        print("Failed to fetch CPU list from the host machine")
+    return cpus
 
 
 def get_vm_config_by_cid(config, cid):